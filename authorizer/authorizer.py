@@ -1,4 +1,188 @@
-import boto3, datetime, hashlib, hmac
+import os
+import json
+import time
+import base64
+import threading
+import slim_dynamodb
+from collections import OrderedDict
+import datetime, hashlib, hmac
+
+# Item in the authorizer table whose credentials_version attribute is incremented by manage/users.py whenever a
+# user's keys change; warm containers compare it against the version their cache was filled under.
+CREDENTIALS_VERSION_ID = '__credentials_version__'
+# Attributes on the same item named session_revoked_<user_id> hold the epoch time before which that user's session
+# tokens are no longer accepted.
+SESSION_REVOKED_PREFIX = 'session_revoked_'
+# Shared with the manage function, which issues session tokens; session tokens are rejected when it is not set.
+SESSION_TOKEN_KEY = os.environ.get('SESSION_TOKEN_KEY')
+
+CREDENTIAL_CACHE_TTL = int(os.environ.get('CREDENTIAL_CACHE_TTL', 300))
+NEGATIVE_CACHE_TTL = int(os.environ.get('NEGATIVE_CACHE_TTL', 30))
+CREDENTIAL_CACHE_MAX_SIZE = int(os.environ.get('CREDENTIAL_CACHE_MAX_SIZE', 1024))
+CREDENTIALS_VERSION_CHECK_INTERVAL = int(os.environ.get('CREDENTIALS_VERSION_CHECK_INTERVAL', 5))
+# 'slim' sends the authorizer's DynamoDB reads through slim_dynamodb so boto3 is never imported
+DYNAMODB_CLIENT = os.environ.get('AUTHORIZER_DYNAMODB_CLIENT', 'boto3')
+# When enabled, warm containers serve lookups from an in-memory copy of the whole authorizer table
+SNAPSHOT_ENABLED = os.environ.get('AUTHORIZER_SNAPSHOT', 'false').lower() == 'true'
+SNAPSHOT_REFRESH_INTERVAL = int(os.environ.get('SNAPSHOT_REFRESH_INTERVAL', 60))
+SIG_DATE_MAX_AGE = 10
+SIGNING_KEY_CACHE_SIZE = int(os.environ.get('SIGNING_KEY_CACHE_SIZE', 256))
+
+
+class CredentialCache:
+
+    def __init__(self, ttl, negative_ttl, max_size):
+        """
+        TTL-bounded cache of api_key -> (secret_key, user_id, admin) that lives at module scope so it survives warm
+        invocations. Unknown api_keys are cached as (None, None, None) for the shorter negative_ttl.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.version = None
+        self.version_checked = 0.0
+        self.session_revocations = {}
+        self.__entries = {}
+
+    def get(self, api_key):
+        """Returns the cached (secret_key, user_id, admin) for api_key, or None if there is no live entry"""
+        entry = self.__entries.get(api_key)
+        if entry is None:
+            return None
+        if entry[3] < time.monotonic():
+            del self.__entries[api_key]
+            return None
+        return entry[0], entry[1], entry[2]
+
+    def put(self, api_key, secret_key, user_id, admin):
+        if len(self.__entries) >= self.max_size:
+            now = time.monotonic()
+            for key in [k for k, v in self.__entries.items() if v[3] < now]:
+                del self.__entries[key]
+            if len(self.__entries) >= self.max_size:
+                del self.__entries[next(iter(self.__entries))]
+        ttl = self.ttl if user_id else self.negative_ttl
+        self.__entries[api_key] = (secret_key, user_id, admin, time.monotonic() + ttl)
+
+    def clear(self):
+        self.__entries.clear()
+
+    def version_check_due(self):
+        return time.monotonic() - self.version_checked >= CREDENTIALS_VERSION_CHECK_INTERVAL
+
+    def set_version(self, version, session_revocations):
+        """Records the latest credentials version, dropping all entries if it changed since the last check"""
+        if version != self.version:
+            self.clear()
+            self.version = version
+        self.session_revocations = session_revocations
+        self.version_checked = time.monotonic()
+
+
+class SigningKeyCache:
+
+    def __init__(self, max_size):
+        """
+        Bounded LRU of derived signing keys. Keys are only valid for one date_stamp, so every entry is evicted as soon
+        as a request arrives for a new UTC day. A max_size of 0 disables caching.
+        """
+        self.max_size = max_size
+        self.date_stamp = None
+        self.__entries = OrderedDict()
+
+    def get(self, cache_key, date_stamp):
+        if date_stamp != self.date_stamp:
+            self.__entries.clear()
+            self.date_stamp = date_stamp
+            return None
+        signing_key = self.__entries.get(cache_key)
+        if signing_key is not None:
+            self.__entries.move_to_end(cache_key)
+        return signing_key
+
+    def put(self, cache_key, signing_key):
+        if self.max_size <= 0:
+            return
+        self.__entries[cache_key] = signing_key
+        if len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+    def clear(self):
+        self.__entries.clear()
+
+
+class CredentialSnapshot:
+
+    def __init__(self, refresh_interval):
+        """
+        In-memory copy of the authorizer table, keyed by api_key. It is reloaded synchronously when the credentials
+        version written by manage/users.py changes and in a background thread once it is older than refresh_interval.
+        """
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self.loaded_at = None
+        self.__entries = {}
+        self.__refresh_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def get(self, api_key):
+        """Returns (secret_key, user_id, admin) for api_key; the snapshot is authoritative, so unknown keys get Nones"""
+        return self.__entries.get(api_key, (None, None, None))
+
+    def stale(self):
+        return time.monotonic() - self.loaded_at >= self.refresh_interval
+
+    def load(self, client, campaign_id, version):
+        """Replaces the snapshot with a full scan of the table, recording the credentials version it was taken at"""
+        entries = {}
+        scan_kwargs = {'TableName': f'{campaign_id}-authorizer'}
+        done = False
+        start_key = None
+        while not done:
+            if start_key:
+                scan_kwargs['ExclusiveStartKey'] = start_key
+            response = client.scan(**scan_kwargs)
+            for item in response['Items']:
+                if 'api_key' in item and 'secret_key' in item:
+                    entries[item['api_key']['S']] = (
+                        item['secret_key']['S'], item['user_id']['S'], item.get('admin', {}).get('S', 'no')
+                    )
+            start_key = response.get('LastEvaluatedKey', None)
+            done = start_key is None
+        self.__entries = entries
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def refresh(self, client, campaign_id, version):
+        """Reloads the snapshot unless another thread is already doing so"""
+        if not self.__refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.load(client, campaign_id, version)
+        except Exception as error:
+            print({'snapshot_refresh_failed': str(error)})
+        finally:
+            self.__refresh_lock.release()
+
+    def refresh_in_background(self, region, campaign_id, version):
+        threading.Thread(
+            target=self.refresh, args=(new_dynamodb_client(region), campaign_id, version), daemon=True
+        ).start()
+
+
+def new_dynamodb_client(region):
+    if DYNAMODB_CLIENT == 'slim':
+        return slim_dynamodb.SlimDynamoDBClient(region)
+    import aws_clients
+    return aws_clients.get_client('dynamodb', region)
+
+
+credential_cache = CredentialCache(CREDENTIAL_CACHE_TTL, NEGATIVE_CACHE_TTL, CREDENTIAL_CACHE_MAX_SIZE)
+signing_key_cache = SigningKeyCache(SIGNING_KEY_CACHE_SIZE)
+credential_snapshot = CredentialSnapshot(SNAPSHOT_REFRESH_INTERVAL)
 
 
 class Login:
@@ -8,24 +192,94 @@ class Login:
         self.campaign_id = campaign_id
         self.api_domain_name = api_domain_name
         self.api_arn = f'arn:aws:execute-api:{region}:{account_id}:{api_id}/havoc_sh/*/*'
-        self.api_key = event['headers']['x-api-key']
-        self.sig_date = event['headers']['x-sig-date']
-        self.signature = event['headers']['x-signature']
+        headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        self.api_key = headers.get('x-api-key')
+        self.sig_date = headers.get('x-sig-date')
+        self.signature = headers.get('x-signature')
+        self.session_token = headers.get('x-session-token')
+        self.request_time = datetime.datetime.utcnow()
         self.authorized = None
+        self.auth_type = None
+        self.admin = None
+        self.reason = None
         self.user_id = None
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = new_dynamodb_client(self.region)
+        return self.__aws_dynamodb_client
 
     def sign(self, key, msg):
         return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
 
     def getSignatureKey(self, key, date_stamp):
+        cache_key = (key, self.region, self.api_domain_name)
+        kSigning = signing_key_cache.get(cache_key, date_stamp)
+        if kSigning is None:
+            kSigning = self.deriveSignatureKey(key, date_stamp)
+            signing_key_cache.put(cache_key, kSigning)
+        return kSigning
+
+    def deriveSignatureKey(self, key, date_stamp):
         k_date = self.sign(('havoc' + key).encode('utf-8'), date_stamp)
         k_region = self.sign(k_date, self.region)
         kSigning = self.sign(k_region, self.api_domain_name)
         return kSigning
 
-    def authorize_keys(self):
-        client = boto3.client('dynamodb', region_name=self.region)
-        response = client.query(
+    def check_credentials_version(self):
+        """Invalidates the credential cache if manage/users.py has changed any keys since the last check"""
+        if not credential_cache.version_check_due():
+            return
+        response = self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-authorizer',
+            Key={
+                'user_id': {'S': CREDENTIALS_VERSION_ID}
+            }
+        )
+        version = None
+        session_revocations = {}
+        if 'Item' in response:
+            for k, v in response['Item'].items():
+                if k == 'credentials_version':
+                    version = v['N']
+                if k.startswith(SESSION_REVOKED_PREFIX):
+                    session_revocations[k[len(SESSION_REVOKED_PREFIX):]] = int(v['N'])
+        credential_cache.set_version(version, session_revocations)
+
+    def get_admin_flag(self, user_id):
+        """Reads the admin flag from the user's item when the ApiKeyIndex does not project it"""
+        response = self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-authorizer',
+            Key={
+                'user_id': {'S': user_id}
+            },
+            ProjectionExpression='admin'
+        )
+        if 'Item' in response and 'admin' in response['Item']:
+            return response['Item']['admin']['S']
+        return 'no'
+
+    def get_snapshot_credentials(self):
+        """Returns (secret_key, user_id, admin) for the request's api_key from the in-memory table snapshot"""
+        self.check_credentials_version()
+        if not credential_snapshot.loaded or credential_snapshot.version != credential_cache.version:
+            credential_snapshot.load(self.aws_dynamodb_client, self.campaign_id, credential_cache.version)
+        elif credential_snapshot.stale():
+            credential_snapshot.refresh_in_background(self.region, self.campaign_id, credential_cache.version)
+        return credential_snapshot.get(self.api_key)
+
+    def get_credentials(self):
+        """Returns (secret_key, user_id, admin) for the request's api_key, consulting the credential cache first"""
+        if SNAPSHOT_ENABLED:
+            return self.get_snapshot_credentials()
+        self.check_credentials_version()
+        cached = credential_cache.get(self.api_key)
+        if cached is not None:
+            return cached
+        response = self.aws_dynamodb_client.query(
             TableName=f'{self.campaign_id}-authorizer',
             IndexName=f'{self.campaign_id}-ApiKeyIndex',
             KeyConditionExpression='api_key = :key',
@@ -35,37 +289,54 @@ class Login:
                 }
             }
         )
-        resp_api_key = None
-        resp_secret_key = None
-        resp_user_id = None
+        secret_key = None
+        user_id = None
+        admin = None
         if response['Items']:
-            resp_api_key = response['Items'][0]['api_key']['S']
-            resp_secret_key = response['Items'][0]['secret_key']['S']
-            resp_user_id = response['Items'][0]['user_id']['S']
+            secret_key = response['Items'][0]['secret_key']['S']
+            user_id = response['Items'][0]['user_id']['S']
+            if 'admin' in response['Items'][0]:
+                admin = response['Items'][0]['admin']['S']
+            else:
+                admin = self.get_admin_flag(user_id)
+        credential_cache.put(self.api_key, secret_key, user_id, admin)
+        return secret_key, user_id, admin
 
-        if not self.api_key:
-            self.authorized = False
-            print('Authorization failed due to missing api_key')
-            return self.authorized
-        if not resp_user_id:
-            self.authorized = False
-            print('Authorization failed due to invalid api_key')
-            return self.authorized
+    def deny(self, reason, message):
+        """Records a failed authorization with a structured reason that is logged and returned in the context"""
+        self.authorized = False
+        self.reason = reason
+        print({'authorization_failed': {'reason': reason, 'message': message}})
+        return self.authorized
+
+    def validate_signature_headers(self):
+        """Rejects signed requests with missing headers or an unusable x-sig-date before any AWS call is made"""
+        for header, value in [('x-api-key', self.api_key), ('x-sig-date', self.sig_date),
+                              ('x-signature', self.signature)]:
+            if not value:
+                return self.deny('missing_header', f'{header} header is missing or empty')
+        try:
+            sig_date = datetime.datetime.strptime(self.sig_date, '%Y%m%dT%H%M%SZ')
+        except ValueError:
+            return self.deny('malformed_sig_date', 'x-sig-date must be formatted as %Y%m%dT%H%M%SZ')
+
+        # Ensure sig_date is within the allowed window
+        duration_in_s = (self.request_time - sig_date).total_seconds()
+        if duration_in_s > SIG_DATE_MAX_AGE or duration_in_s < 0:
+            return self.deny('clock_skew', 'x-sig-date is outside of the allowed time window')
+        return True
 
-        # Create signing key elements
-        sig_date = datetime.datetime.strptime(self.sig_date, '%Y%m%dT%H%M%SZ')
-        t = datetime.datetime.utcnow()
-        local_date_stamp = t.strftime('%Y%m%d')
-
-        # Ensure sig_date is within the last 5 seconds
-        duration = t - sig_date
-        duration_in_s = duration.total_seconds()
-        if duration_in_s > 10 or duration_in_s < 0:
-            self.authorized = False
-            print('Authorization failed due to time delay in signature date')
+    def authorize_keys(self):
+        if not self.validate_signature_headers():
             return self.authorized
 
+        resp_secret_key, resp_user_id, resp_admin = self.get_credentials()
+        resp_api_key = self.api_key
+        if not resp_user_id:
+            return self.deny('invalid_api_key', 'api_key does not exist')
+
         # Get signing_key
+        local_date_stamp = self.request_time.strftime('%Y%m%d')
         signing_key = self.getSignatureKey(resp_secret_key, local_date_stamp)
 
         # Setup string to sign
@@ -79,10 +350,49 @@ class Login:
 
         if self.api_key == resp_api_key and self.signature == signature:
             self.authorized = True
+            self.auth_type = 'signature'
             self.user_id = resp_user_id
+            self.admin = resp_admin
         else:
-            self.authorized = False
-            print('Authorization failed due to api_key, signature match failure')
+            return self.deny('signature_mismatch', 'api_key, signature match failure')
+        return self.authorized
+
+    def authorize_session_token(self):
+        """Verifies a session token issued by the manage function without looking up the user's credentials"""
+        if not SESSION_TOKEN_KEY:
+            return self.deny('session_tokens_disabled', 'session tokens are not enabled')
+
+        try:
+            payload, token_signature = self.session_token.split('.')
+            signature = base64.urlsafe_b64encode(
+                hmac.new(SESSION_TOKEN_KEY.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+            ).decode('utf-8').rstrip('=')
+            signature_match = hmac.compare_digest(signature, token_signature)
+            claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+            user_id = claims['user_id']
+            api_key = claims['api_key']
+            admin = claims.get('admin', 'no')
+            issued_at = int(claims['iat'])
+            expires_at = int(claims['exp'])
+        except (ValueError, TypeError, KeyError):
+            return self.deny('malformed_session_token', 'session token could not be decoded')
+
+        if not signature_match:
+            return self.deny('signature_mismatch', 'session token signature match failure')
+        if expires_at <= int(time.time()):
+            return self.deny('session_token_expired', 'session token has expired')
+
+        # Tokens issued before the user's keys were reset or the user was deleted are revoked
+        self.check_credentials_version()
+        revoked_at = credential_cache.session_revocations.get(user_id)
+        if revoked_at is not None and issued_at <= revoked_at:
+            return self.deny('session_token_revoked', 'session token has been revoked')
+
+        self.authorized = True
+        self.auth_type = 'session'
+        self.user_id = user_id
+        self.admin = admin
+        self.api_key = api_key
         return self.authorized
 
     def gen_response(self):
@@ -100,7 +410,9 @@ class Login:
 
         if self.authorized:
             policy = gen_policy(self.authorized)
-            context = {'user_id': self.user_id, 'api_key': self.api_key}
+            context = {
+                'user_id': self.user_id, 'api_key': self.api_key, 'auth_type': self.auth_type, 'admin': self.admin
+            }
             response = {
                 'principalId': self.api_key,
                 'policyDocument': policy,
@@ -111,7 +423,7 @@ class Login:
 
         if not self.authorized:
             policy = gen_policy(self.authorized)
-            context = {}
+            context = {'reason': self.reason} if self.reason else {}
             response = {
                 'context': context,
                 'policyDocument': policy
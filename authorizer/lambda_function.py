@@ -14,7 +14,10 @@ def lambda_handler(event, context):
         api_domain_name = os.environ['API_DOMAIN_NAME']
 
     auth = Login(region, campaign_id, api_domain_name, account_id, api_id, event)
-    auth.authorize_keys()
+    if auth.session_token:
+        auth.authorize_session_token()
+    else:
+        auth.authorize_keys()
     response = auth.gen_response()
 
     return response
@@ -0,0 +1,122 @@
+import os
+import hmac
+import json
+import time
+import hashlib
+import datetime
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+API_VERSION = 'DynamoDB_20120810'
+RETRYABLE_ERRORS = ['ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+                    'InternalServerError', 'ServiceUnavailable']
+MAX_ATTEMPTS = 3
+
+# Connections are kept at module scope so warm invocations reuse the established TLS session; they are per thread
+# because http.client connections cannot be shared between concurrent requests.
+connections = threading.local()
+
+
+class SlimClientError(Exception):
+
+    def __init__(self, code, message, operation_name):
+        """
+        Mirrors the shape of botocore's ClientError so callers can inspect error.response['Error']['Code']
+        """
+        super().__init__(f'An error occurred ({code}) when calling the {operation_name} operation: {message}')
+        self.response = {'Error': {'Code': code, 'Message': message}}
+        self.operation_name = operation_name
+
+
+class SlimDynamoDBClient:
+
+    def __init__(self, region):
+        """
+        Standard library DynamoDB client for the handful of read operations the authorizer makes. Requests are signed
+        with Signature Version 4 using the credentials Lambda places in the environment, which avoids importing
+        boto3/botocore on cold start.
+        """
+        self.region = region
+        endpoint = os.environ.get('AWS_ENDPOINT_URL_DYNAMODB') or os.environ.get('AWS_ENDPOINT_URL') or \
+            f'https://dynamodb.{region}.amazonaws.com'
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.host = url.netloc
+        self.access_key = os.environ['AWS_ACCESS_KEY_ID']
+        self.secret_key = os.environ['AWS_SECRET_ACCESS_KEY']
+        self.session_token = os.environ.get('AWS_SESSION_TOKEN')
+
+    def sign(self, key, msg):
+        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+    def signed_headers(self, target, body):
+        t = datetime.datetime.utcnow()
+        amz_date = t.strftime('%Y%m%dT%H%M%SZ')
+        date_stamp = t.strftime('%Y%m%d')
+        headers = {
+            'content-type': 'application/x-amz-json-1.0',
+            'host': self.host,
+            'x-amz-date': amz_date,
+            'x-amz-target': f'{API_VERSION}.{target}'
+        }
+        if self.session_token:
+            headers['x-amz-security-token'] = self.session_token
+        signed_header_names = ';'.join(sorted(headers))
+        canonical_headers = ''.join(f'{k}:{headers[k]}\n' for k in sorted(headers))
+        canonical_request = '\n'.join([
+            'POST', '/', '', canonical_headers, signed_header_names, hashlib.sha256(body).hexdigest()
+        ])
+        credential_scope = f'{date_stamp}/{self.region}/dynamodb/aws4_request'
+        canonical_request_hash = hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, credential_scope, canonical_request_hash])
+        k_date = self.sign(('AWS4' + self.secret_key).encode('utf-8'), date_stamp)
+        k_region = self.sign(k_date, self.region)
+        k_service = self.sign(k_region, 'dynamodb')
+        k_signing = self.sign(k_service, 'aws4_request')
+        signature = hmac.new(k_signing, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['authorization'] = f'AWS4-HMAC-SHA256 Credential={self.access_key}/{credential_scope}, ' \
+                                   f'SignedHeaders={signed_header_names}, Signature={signature}'
+        return headers
+
+    def get_connection(self, fresh=False):
+        if not hasattr(connections, 'pool'):
+            connections.pool = {}
+        connection_key = (self.scheme, self.host)
+        if fresh or connection_key not in connections.pool:
+            if self.scheme == 'https':
+                connections.pool[connection_key] = http.client.HTTPSConnection(self.host, timeout=5)
+            else:
+                connections.pool[connection_key] = http.client.HTTPConnection(self.host, timeout=5)
+        return connections.pool[connection_key]
+
+    def call(self, target, params):
+        body = json.dumps(params).encode('utf-8')
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            headers = self.signed_headers(target, body)
+            try:
+                connection = self.get_connection(fresh=attempt > 1)
+                connection.request('POST', '/', body=body, headers=headers)
+                response = connection.getresponse()
+                status = response.status
+                data = json.loads(response.read() or b'{}')
+            except (http.client.HTTPException, OSError) as error:
+                if attempt == MAX_ATTEMPTS:
+                    raise SlimClientError('ConnectionError', str(error), target)
+                continue
+            if status == 200:
+                return data
+            code = data.get('__type', 'UnknownError').split('#')[-1]
+            message = data.get('message', data.get('Message', ''))
+            if code not in RETRYABLE_ERRORS or attempt == MAX_ATTEMPTS:
+                raise SlimClientError(code, message, target)
+            time.sleep(0.05 * 2 ** attempt)
+
+    def query(self, **kwargs):
+        return self.call('Query', kwargs)
+
+    def get_item(self, **kwargs):
+        return self.call('GetItem', kwargs)
+
+    def scan(self, **kwargs):
+        return self.call('Scan', kwargs)
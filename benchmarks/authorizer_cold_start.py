@@ -0,0 +1,108 @@
+"""
+Cold-start benchmark of the authorizer with the boto3 and slim DynamoDB clients.
+
+Each sample runs in a fresh interpreter and measures the time to import lambda_function and the time taken by the
+first lambda_handler call. DynamoDB is served by a local HTTP stub that both clients reach through
+AWS_ENDPOINT_URL_DYNAMODB.
+
+Usage: python benchmarks/authorizer_cold_start.py [--samples N]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AUTHORIZER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'authorizer')
+
+SAMPLE = r'''
+import sys, json, time, hmac, hashlib, datetime
+start = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+
+t = datetime.datetime.utcnow()
+sig_date = t.strftime('%Y%m%dT%H%M%SZ')
+date_stamp = t.strftime('%Y%m%d')
+sign = lambda key, msg: hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+signing_key = sign(sign(sign(b'havocbench-secret', date_stamp), 'us-east-1'), 'api.havoc.example')
+string_to_sign = 'HMAC-SHA256\n' + sig_date + '\n' + date_stamp + '/us-east-1/api.havoc.example' + \
+    hashlib.sha256(b'bench-key').hexdigest()
+signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+event = {
+    'headers': {'x-api-key': 'bench-key', 'x-sig-date': sig_date, 'x-signature': signature},
+    'requestContext': {'accountId': '123456789012', 'apiId': 'bench'}
+}
+
+
+class Context:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:bench-authorizer'
+
+
+response = lambda_function.lambda_handler(event, Context())
+finished = time.perf_counter()
+assert response['policyDocument']['Statement'][0]['Effect'] == 'Allow', response
+print(json.dumps({'import': imported - start, 'first_request': finished - imported}))
+'''
+
+
+class StubDynamoDBHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        target = self.headers['X-Amz-Target'].split('.')[-1]
+        if target == 'Query':
+            body = {'Count': 1, 'Items': [{
+                'api_key': {'S': 'bench-key'}, 'secret_key': {'S': 'bench-secret'}, 'user_id': {'S': 'bench'},
+                'admin': {'S': 'no'}
+            }]}
+        else:
+            body = {'Item': {'user_id': {'S': '__credentials_version__'}, 'credentials_version': {'N': '1'}}}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def sample(client, endpoint):
+    env = dict(
+        os.environ, CAMPAIGN_ID='bench', API_DOMAIN_NAME='api.havoc.example', AUTHORIZER_DYNAMODB_CLIENT=client,
+        AWS_ENDPOINT_URL_DYNAMODB=endpoint, AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench',
+        AWS_DEFAULT_REGION='us-east-1', PYTHONDONTWRITEBYTECODE='1'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', SAMPLE], cwd=AUTHORIZER_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise RuntimeError(f'{client} sample failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubDynamoDBHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+
+    print(f'samples: {args.samples} (median, ms)')
+    for client in ['boto3', 'slim']:
+        samples = [sample(client, endpoint) for _ in range(args.samples)]
+        import_ms = statistics.median(s['import'] for s in samples) * 1000
+        first_ms = statistics.median(s['first_request'] for s in samples) * 1000
+        print(f'{client:>6}: import {import_ms:8.1f}  first request {first_ms:8.1f}  total {import_ms + first_ms:8.1f}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
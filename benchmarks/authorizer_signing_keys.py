@@ -0,0 +1,91 @@
+"""
+Micro-benchmark of Login.authorize_keys throughput with and without the signing key cache.
+
+DynamoDB is replaced with an in-process stub so the numbers reflect only the authorizer's own work.
+
+Usage: python benchmarks/authorizer_signing_keys.py [--requests N] [--users N]
+"""
+import os
+import sys
+import time
+import hmac
+import hashlib
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'authorizer'))
+import authorizer
+
+REGION = 'us-east-1'
+API_DOMAIN_NAME = 'api.havoc.example'
+
+
+class StubDynamoDB:
+
+    def __init__(self, users):
+        self.items = {
+            api_key: {'api_key': {'S': api_key}, 'secret_key': {'S': secret}, 'user_id': {'S': user_id},
+                      'admin': {'S': 'no'}}
+            for user_id, api_key, secret in users
+        }
+
+    def query(self, **kwargs):
+        item = self.items.get(kwargs['ExpressionAttributeValues'][':key']['S'])
+        return {'Items': [item] if item else []}
+
+    def get_item(self, **kwargs):
+        return {'Item': {'credentials_version': {'N': '1'}}}
+
+
+def sign_headers(api_key, secret):
+    t = datetime.datetime.utcnow()
+    sig_date = t.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = t.strftime('%Y%m%d')
+
+    def sign(key, msg):
+        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+    signing_key = sign(sign(sign(('havoc' + secret).encode('utf-8'), date_stamp), REGION), API_DOMAIN_NAME)
+    string_to_sign = 'HMAC-SHA256\n' + sig_date + '\n' + date_stamp + '/' + REGION + '/' + API_DOMAIN_NAME + \
+        hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return {'x-api-key': api_key, 'x-sig-date': sig_date, 'x-signature': signature}
+
+
+def run(events, signing_key_cache_size):
+    authorizer.signing_key_cache.max_size = signing_key_cache_size
+    authorizer.signing_key_cache.clear()
+    denied = 0
+    start = time.perf_counter()
+    for event in events:
+        login = authorizer.Login(REGION, 'bench', API_DOMAIN_NAME, '123456789012', 'bench', event)
+        if not login.authorize_keys():
+            denied += 1
+    elapsed = time.perf_counter() - start
+    assert not denied, f'{denied} requests were denied'
+    return len(events) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=20)
+    args = parser.parse_args()
+
+    users = [(f'user{i}', f'apikey{i:06d}', f'secret{i:018d}') for i in range(args.users)]
+    stub = StubDynamoDB(users)
+    authorizer.new_dynamodb_client = lambda region: stub
+    headers = [sign_headers(api_key, secret) for _, api_key, secret in users]
+    events = [{'headers': headers[i % len(headers)]} for i in range(args.requests)]
+
+    # Warm the credential cache so both runs measure the same lookup path
+    run(events[:len(users)], 0)
+    uncached = run(events, 0)
+    cached = run(events, authorizer.SIGNING_KEY_CACHE_SIZE)
+    print(f'requests: {args.requests}, users: {args.users}')
+    print(f'without signing key cache: {uncached:,.0f} req/s')
+    print(f'with signing key cache:    {cached:,.0f} req/s ({cached / uncached:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Round-trip checks and benchmark for task_control/dynamodb_codec.py.
+
+Randomly generated argument maps (strings, numbers, floats, booleans, None, bytes, lists, nested dicts and sets) are
+marshalled and unmarshalled and must come back unchanged. The codec is then timed against the per-key loops it
+replaced on large flat argument maps.
+
+Usage: python benchmarks/dynamodb_codec.py [--cases N] [--keys N] [--rounds N]
+"""
+import os
+import sys
+import math
+import time
+import random
+import string
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'task_control'))
+import dynamodb_codec
+
+
+def random_scalar(rng):
+    kind = rng.randrange(7)
+    if kind == 0:
+        return ''.join(rng.choice(string.printable) for _ in range(rng.randrange(12)))
+    if kind == 1:
+        return rng.randrange(-10 ** 12, 10 ** 12)
+    if kind == 2:
+        return rng.uniform(-1e6, 1e6)
+    if kind == 3:
+        return rng.random() < 0.5
+    if kind == 4:
+        return None
+    if kind == 5:
+        return rng.randbytes(rng.randrange(1, 16))
+    return {f's{i}' for i in range(rng.randrange(1, 4))}
+
+
+def random_value(rng, depth=0):
+    kind = rng.randrange(6) if depth < 3 else 0
+    if kind == 4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    if kind == 5:
+        return {f'k{i}': random_value(rng, depth + 1) for i in range(rng.randrange(4))}
+    return random_scalar(rng)
+
+
+def check_round_trips(cases, seed=1):
+    rng = random.Random(seed)
+    for case in range(cases):
+        args = {f'arg{i}': random_value(rng) for i in range(rng.randrange(1, 8))}
+        result = dynamodb_codec.unmarshal_map(dynamodb_codec.marshal_map(args))
+        assert result == args, f'round trip {case} changed {args!r} to {result!r}'
+    for value in [float('nan'), float('inf'), set(), {1, 'a'}, object()]:
+        try:
+            dynamodb_codec.marshal(value)
+        except (TypeError, ValueError):
+            continue
+        raise AssertionError(f'{value!r} should not be marshalled')
+    assert dynamodb_codec.unmarshal({'N': '1.5e3'}) == 1500.0 and not math.isnan(dynamodb_codec.unmarshal({'N': '0'}))
+
+
+def legacy_marshal(instruct_args):
+    instruct_args_fixup = {}
+    for k, v in instruct_args.items():
+        if isinstance(v, str):
+            instruct_args_fixup[k] = {'S': v}
+        if isinstance(v, int) and not isinstance(v, bool):
+            instruct_args_fixup[k] = {'N': str(v)}
+        if isinstance(v, bool):
+            instruct_args_fixup[k] = {'BOOL': v}
+        if isinstance(v, bytes):
+            instruct_args_fixup[k] = {'B': v}
+    return instruct_args_fixup
+
+
+def legacy_unmarshal(instruct_args):
+    instruct_args_fixup = {}
+    for key, value in instruct_args.items():
+        if 'S' in value:
+            instruct_args_fixup[key] = value['S']
+        if 'N' in value:
+            instruct_args_fixup[key] = value['N']
+        if 'BOOL' in value:
+            instruct_args_fixup[key] = value['BOOL']
+        if 'B' in value:
+            instruct_args_fixup[key] = value['B']
+    return instruct_args_fixup
+
+
+def timed(function, value, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(value)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    check_round_trips(args.cases)
+    print(f'round trips: {args.cases} random argument maps unchanged')
+
+    rng = random.Random(2)
+    scalars = [lambda: 'x' * rng.randrange(1, 32), lambda: rng.randrange(10 ** 6), lambda: rng.random() < 0.5]
+    flat_args = {f'arg{i}': rng.choice(scalars)() for i in range(args.keys)}
+    marshalled = dynamodb_codec.marshal_map(flat_args)
+    print(f'flat argument map with {args.keys} keys (microseconds per map)')
+    print(f'  marshal:   legacy {timed(legacy_marshal, flat_args, args.rounds):9.1f}  '
+          f'codec {timed(dynamodb_codec.marshal_map, flat_args, args.rounds):9.1f}')
+    print(f'  unmarshal: legacy {timed(legacy_unmarshal, marshalled, args.rounds):9.1f}  '
+          f'codec {timed(dynamodb_codec.unmarshal_map, marshalled, args.rounds):9.1f}')
+
+
+if __name__ == '__main__':
+    main()
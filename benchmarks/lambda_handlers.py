@@ -0,0 +1,745 @@
+"""
+End-to-end benchmark of all five lambda_handler functions against the in-memory AWS stand-in in local_aws.py.
+
+Each function directory is imported in isolation (they all ship their own lambda_function, aws_clients and
+dynamodb_codec modules) and its aws_clients registry is pointed at a shared LocalAWS account. A seeded campaign is then
+driven with a realistic mix of events: signed requests through the authorizer, manage requests from the CLI, task
+launches, interactions and result polling through task_control, remote task check-ins through remote_task and
+CloudWatch Logs deliveries through task_result. Throughput and p50/p99 latency are reported per action.
+
+Two scenarios are the same on every run: a bulk launch with a repeated task_name before the first round, and a session
+token issued, used and refused for creating another token in every round, then revoked after the last one.
+
+Waits in the handlers (time.sleep in execute and deliver) are skipped and reported separately so the numbers reflect
+the work the functions do rather than how long they sleep. Skipped sleeps advance a virtual clock that the stand-in's
+task provisioning and DNS propagation delays are measured against.
+
+Usage: python benchmarks/lambda_handlers.py [--rounds N] [--tasks N] [--bulk-tasks N] [--latency MS] [--jitter MS]
+       [--seed N]
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import datetime
+import importlib
+import contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+import local_aws
+
+REGION = 'us-east-1'
+ACCOUNT_ID = local_aws.ACCOUNT_ID
+CAMPAIGN_ID = 'bench'
+API_ID = 'benchapi'
+API_DOMAIN_NAME = 'api.havoc.example'
+SUBNET = 'subnet-bench1'
+# Launch subnets with their zone and free addresses; the small one runs out during long runs
+SUBNETS = [(SUBNET, f'{REGION}a', 4000), ('subnet-bench2', f'{REGION}b', 4000), ('subnet-bench3', f'{REGION}b', 40)]
+VPC_ID = 'vpc-bench'
+HOSTED_ZONE = 'ZBENCH'
+DOMAIN_NAME = 'havoc.example'
+TASK_TYPE = 'nmap'
+CAPABILITIES = ['Initialize', 'run_scan', 'get_scan_results', 'echo', 'sync_from_workspace', 'terminate']
+FUNCTIONS = ['authorizer', 'manage', 'task_control', 'remote_task', 'task_result']
+
+ENVIRONMENT = {
+    'CAMPAIGN_ID': CAMPAIGN_ID,
+    'API_DOMAIN_NAME': API_DOMAIN_NAME,
+    'SUBNET': SUBNET,
+    'SUBNETS': ','.join(f'{subnet}:{zone}' for subnet, zone, _ in SUBNETS),
+    'VPC_ID': VPC_ID,
+    'RESULTS_QUEUE_EXPIRATION': '30',
+    'SESSION_TOKEN_KEY': 'bench-session-token-key',
+    'AWS_DEFAULT_REGION': REGION,
+    'TASK_CONTROL_FUNCTION': f'{CAMPAIGN_ID}-task_control'
+}
+
+
+class SkippedSleep:
+
+    def __init__(self):
+        """
+        Stands in for the time module in handler modules so fixed waits are counted instead of slept. Skipped sleeps
+        advance a virtual clock that LocalAWS and the Lambda contexts also read, so polling loops see time pass.
+        """
+        self.seconds = 0.0
+        self.advanced = 0.0
+
+    def sleep(self, seconds):
+        self.seconds += seconds
+
+    def advance(self, seconds):
+        """Moves the virtual clock on without counting it as a skipped sleep, as if the campaign sat idle"""
+        self.advanced += seconds
+
+    def monotonic(self):
+        return time.monotonic() + self.seconds + self.advanced
+
+    def time(self):
+        return time.time() + self.seconds + self.advanced
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class Context:
+
+    def __init__(self, function_name, clock, timeout=900):
+        self.function_name = f'{CAMPAIGN_ID}-{function_name}'
+        self.invoked_function_arn = f'arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{self.function_name}'
+        self.aws_request_id = os.urandom(16).hex()
+        self.clock = clock
+        self.deadline = clock() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - self.clock()) * 1000))
+
+
+class Function:
+
+    def __init__(self, name, backend, skipped_sleep):
+        """Imports a function directory's modules without letting them collide with other functions' modules"""
+        self.name = name
+        self.clock = skipped_sleep.monotonic
+        directory = os.path.join(ROOT, name)
+        module_names = [f[:-3] for f in os.listdir(directory) if f.endswith('.py') and f != '__init__.py']
+        for module_name in module_names:
+            sys.modules.pop(module_name, None)
+        sys.path.insert(0, directory)
+        try:
+            for module_name in module_names:
+                importlib.import_module(module_name)
+        finally:
+            sys.path.remove(directory)
+        self.modules = {m: sys.modules.pop(m) for m in module_names}
+        self.handler = self.modules['lambda_function'].lambda_handler
+        backend.install(self.modules['aws_clients'])
+        for module in self.modules.values():
+            if getattr(module, 't', None) is time:
+                module.t = skipped_sleep
+
+    @contextlib.contextmanager
+    def active(self):
+        """Makes this function's modules the ones that lazy imports inside the handler resolve to"""
+        saved = {m: sys.modules.get(m) for m in self.modules}
+        sys.modules.update(self.modules)
+        try:
+            yield
+        finally:
+            for module_name, module in saved.items():
+                if module is None:
+                    sys.modules.pop(module_name, None)
+                else:
+                    sys.modules[module_name] = module
+
+    def invoke(self, event):
+        with self.active():
+            return self.handler(event, Context(self.name, self.clock))
+
+
+class Recorder:
+
+    def __init__(self):
+        self.samples = {}
+        self.failures = {}
+
+    def record(self, function_name, action, seconds, ok):
+        key = (function_name, action)
+        self.samples.setdefault(key, []).append(seconds)
+        if not ok:
+            self.failures[key] = self.failures.get(key, 0) + 1
+
+    def report(self):
+        print(f'{"function":<13}{"action":<26}{"calls":>7}{"errors":>8}{"calls/s":>11}{"p50 ms":>10}{"p99 ms":>10}')
+        for (function_name, action), samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            p50 = ordered[int(0.50 * (len(ordered) - 1))] * 1000
+            p99 = ordered[int(0.99 * (len(ordered) - 1))] * 1000
+            throughput = len(ordered) / sum(ordered) if sum(ordered) else float('inf')
+            errors = self.failures.get((function_name, action), 0)
+            print(f'{function_name:<13}{action:<26}{len(ordered):>7}{errors:>8}{throughput:>11,.0f}{p50:>10.2f}'
+                  f'{p99:>10.2f}')
+
+
+def sign_headers(api_key, secret):
+    t = datetime.datetime.utcnow()
+    sig_date = t.strftime('%Y%m%dT%H%M%SZ')
+    date_stamp = t.strftime('%Y%m%d')
+
+    def sign(key, msg):
+        return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+    signing_key = sign(sign(sign(('havoc' + secret).encode('utf-8'), date_stamp), REGION), API_DOMAIN_NAME)
+    string_to_sign = 'HMAC-SHA256\n' + sig_date + '\n' + date_stamp + '/' + REGION + '/' + API_DOMAIN_NAME + \
+        hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+    signature = hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    return {'x-api-key': api_key, 'x-sig-date': sig_date, 'x-signature': signature}
+
+
+def api_event(user, body, auth_type='signature'):
+    authorizer = {'user_id': user['user_id'], 'api_key': user['api_key'], 'admin': user['admin']}
+    if auth_type:
+        authorizer['auth_type'] = auth_type
+    return {
+        'body': json.dumps(body),
+        'requestContext': {'accountId': ACCOUNT_ID, 'apiId': API_ID, 'authorizer': authorizer}
+    }
+
+
+def authorizer_event(headers):
+    return {
+        'type': 'REQUEST',
+        'methodArn': f'arn:aws:execute-api:{REGION}:{ACCOUNT_ID}:{API_ID}/havoc/POST/task-control',
+        'headers': headers,
+        'requestContext': {'accountId': ACCOUNT_ID, 'apiId': API_ID}
+    }
+
+
+def log_event(payload):
+    data = json.dumps({'logEvents': [{'id': '0', 'timestamp': int(time.time() * 1000), 'message': json.dumps(payload)}]})
+    return {'awslogs': {'data': base64.b64encode(gzip.compress(data.encode('utf-8'))).decode('utf-8')}}
+
+
+def result_payload(user, task, instruct_command, instruct_args, timestamp, output=None):
+    return {
+        'instruct_command_output': output or {'outcome': 'success', 'scan': 'x' * 512},
+        'user_id': user['user_id'], 'task_name': task['task_name'], 'task_context': f'{CAMPAIGN_ID}-{REGION}',
+        'task_type': TASK_TYPE, 'instruct_user_id': user['user_id'], 'instruct_instance': 'bench',
+        'instruct_command': instruct_command, 'instruct_args': instruct_args, 'attack_ip': task['attack_ip'],
+        'local_ip': ['10.0.0.10'], 'end_time': 'None', 'forward_log': 'False', 'timestamp': str(timestamp)
+    }
+
+
+def seed(backend, users):
+    backend.create_campaign(CAMPAIGN_ID)
+    dynamodb = backend.dynamodb
+    for user in users:
+        dynamodb.put_item(TableName=f'{CAMPAIGN_ID}-authorizer', Item={
+            'user_id': {'S': user['user_id']}, 'api_key': {'S': user['api_key']}, 'secret': {'S': user['secret']},
+            'secret_key': {'S': user['secret']}, 'admin': {'S': user['admin']}
+        })
+    dynamodb.put_item(TableName=f'{CAMPAIGN_ID}-authorizer', Item={
+        'user_id': {'S': '__credentials_version__'}, 'credentials_version': {'N': '1'}
+    })
+    dynamodb.put_item(TableName=f'{CAMPAIGN_ID}-task-types', Item={
+        'task_type': {'S': TASK_TYPE}, 'source_image': {'S': 'havoc/nmap:latest'}, 'created_by': {'S': 'admin'},
+        'task_definition_arn': {'S': f'arn:aws:ecs:{REGION}:{ACCOUNT_ID}:task-definition/{CAMPAIGN_ID}-{TASK_TYPE}:1'},
+        'capabilities': {'SS': CAPABILITIES}, 'cpu': {'N': '1024'}, 'memory': {'N': '2048'}
+    })
+    backend.route53.create_hosted_zone(HOSTED_ZONE, DOMAIN_NAME)
+    dynamodb.put_item(TableName=f'{CAMPAIGN_ID}-domains', Item={
+        'domain_name': {'S': DOMAIN_NAME}, 'hosted_zone': {'S': HOSTED_ZONE}, 'tasks': {'SS': ['None']},
+        'host_names': {'SS': ['None']}, 'api_domain': {'S': 'no'}, 'user_id': {'S': 'admin'}
+    })
+    for subnet, zone, free_ips in SUBNETS:
+        backend.ec2.create_subnet(subnet, zone, free_ips)
+    backend.s3.put_object(Bucket=f'{CAMPAIGN_ID}-workspace', Key='shared/targets.txt', Body=b'10.0.0.0/24\n')
+
+
+class Workload:
+
+    def __init__(self, functions, backend, recorder, users, rng, clock):
+        self.functions = functions
+        self.clock = clock
+        self.backend = backend
+        self.recorder = recorder
+        self.users = users
+        self.rng = rng
+        self.tasks = []
+        self.portgroups = []
+        self.counter = 0
+        self.launching_user = None
+        self.adopted = {}
+        # Asynchronous invocations are named after their single top-level key (launch_job, replenish_pool)
+        backend.lambda_.register_handler(
+            f'{CAMPAIGN_ID}-task_control', lambda payload: self.call('task_control', next(iter(payload)), payload)
+        )
+        backend.s3.add_put_listener(self.standby_container)
+
+    def call(self, function_name, action, event, expect=200):
+        start = time.perf_counter()
+        response = self.functions[function_name].invoke(event)
+        elapsed = time.perf_counter() - start
+        if function_name == 'authorizer':
+            # expect=403 marks a request the authorizer must deny
+            ok = response['policyDocument']['Statement'][0]['Effect'] == ('Deny' if expect == 403 else 'Allow')
+        elif function_name == 'task_result':
+            ok = response is True or response is None
+        elif action == 'replenish_pool':
+            ok = 'launched' in response
+        elif action.startswith('run_schedules'):
+            ok = 'schedules' in response
+        else:
+            ok = response['statusCode'] == expect
+        self.recorder.record(function_name, action, elapsed, ok)
+        return response
+
+    def next_id(self, prefix):
+        self.counter += 1
+        return f'{prefix}{self.counter}'
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def authorize(self):
+        user = self.user()
+        self.call('authorizer', 'signature', authorizer_event(sign_headers(user['api_key'], user['secret'])))
+
+    def manage(self, resource, command, detail, expect=200, user=None):
+        body = {'resource': resource, 'command': command, 'detail': detail}
+        return self.call('manage', f'{resource}.{command}', api_event(user or self.user(), body), expect)
+
+    def task_control(self, action, detail, expect=200, user=None, label=None):
+        body = {'action': action, 'detail': detail}
+        return self.call('task_control', label or action, api_event(user or self.user(), body), expect)
+
+    def remote_task(self, command, user, expect=200, **body):
+        body['command'] = command
+        return self.call('remote_task', command, api_event(user, body), expect)
+
+    def session(self):
+        """
+        The session token path, the same on every round: a signed request creates a token and the authorizer accepts
+        it. A request the authorizer let in with a session token, or whose context has no auth_type, must not be able
+        to create another one. Returns the token.
+        """
+        user = self.users[-1]
+        response = self.manage('session', 'create', {'session_ttl': 600}, user=user)
+        session_token = json.loads(response['body']).get('session_token')
+        if not session_token:
+            return None
+        self.call('authorizer', 'session_token', authorizer_event({'x-session-token': session_token}))
+        body = {'resource': 'session', 'command': 'create', 'detail': {}}
+        self.call('manage', 'session.from_session', api_event(user, body, auth_type='session'), expect=403)
+        self.call('manage', 'session.no_auth_type', api_event(user, body, auth_type=None), expect=403)
+        return session_token
+
+    def revoke_session(self):
+        """Revokes the session user's tokens; a token issued before the revocation must then be denied"""
+        session_token = self.session()
+        self.manage('session', 'delete', {}, user=self.users[-1])
+        # Warm authorizers pick up revocations on their next credentials version check, which is made due at once
+        self.functions['authorizer'].modules['authorizer'].credential_cache.version_checked = float('-inf')
+        self.call('authorizer', 'session_token.revoked', authorizer_event({'x-session-token': session_token}),
+                  expect=403)
+
+    def create_portgroup(self):
+        portgroup_name = self.next_id('pg')
+        self.manage('portgroup', 'create', {'portgroup_name': portgroup_name, 'portgroup_description': 'bench'})
+        self.manage('portgroup', 'update', {
+            'portgroup_name': portgroup_name, 'portgroup_action': 'add', 'ip_ranges': [{'CidrIp': '0.0.0.0/0'}],
+            'port': 443, 'ip_protocol': 'tcp'
+        })
+        self.portgroups.append(portgroup_name)
+
+    def standby_container(self, bucket, key, body):
+        """
+        A standby container watching its standby name's workspace: on Initialize it adopts the task_name it was given
+        and reports the result under it. One in ten does not answer, so execute has to stop it and launch a new task.
+        """
+        standby_name, _, object_name = key.partition('/')
+        if not standby_name.startswith('standby-') or object_name != 'init.txt' or self.rng.random() < 0.1:
+            return
+        task_name = json.loads(body)['instruct_args']['task_name']
+        task_entry = self.backend.dynamodb.get_item(TableName=f'{CAMPAIGN_ID}-tasks',
+                                                    Key={'task_name': {'S': task_name}})['Item']
+        task = {'task_name': task_name, 'attack_ip': task_entry['attack_ip']['S'], 'user': self.launching_user,
+                'timestamp': int(time.time())}
+        self.deliver(task, 'Initialize', {'task_name': task_name})
+        self.adopted[task_name] = task
+
+    def execute(self):
+        user = self.launching_user = self.user()
+        task_name = self.next_id('task')
+        detail = {'task_name': task_name, 'task_type': TASK_TYPE}
+        if self.portgroups and self.rng.random() < 0.5:
+            detail['portgroups'] = self.rng.sample(self.portgroups, min(2, len(self.portgroups)))
+        if self.rng.random() < 0.5:
+            detail['task_host_name'] = task_name
+            detail['task_domain_name'] = DOMAIN_NAME
+            if self.rng.random() < 0.2:
+                detail['wait_for_dns'] = 'yes'
+        if self.rng.random() < 0.1:
+            # The launch scheduler backs off and retries a throttled RunTask
+            self.backend.fail_next('ecs', 'RunTask', 'ThrottlingException')
+        if self.rng.random() < 0.5:
+            # Asynchronous launch: the request returns at once and a launch job finishes the setup
+            detail['async'] = 'yes'
+            response = self.task_control('execute', detail, expect=202, user=user, label='execute.async')
+            if response['statusCode'] != 202:
+                return
+            self.backend.run_pending_invocations()
+            response = self.task_control('launch_status', {'task_name': task_name}, user=user)
+            if json.loads(response['body']).get('launch_status') != 'ready':
+                return
+        else:
+            response = self.task_control('execute', detail, user=user)
+            # Refills the standby pool if the task was claimed from it
+            self.backend.run_pending_invocations()
+            if response['statusCode'] != 200:
+                return
+        if task_name in self.adopted:
+            # A standby task already reported its Initialize while execute waited for it
+            self.tasks.append(self.adopted.pop(task_name))
+            return
+        attack_ip = json.loads(response['body']).get('attack_ip')
+        task = {'task_name': task_name, 'attack_ip': attack_ip, 'user': user, 'timestamp': int(time.time())}
+        # The container picks up its Initialize instruction and reports back through CloudWatch Logs
+        self.remote_task('get_commands', user, detail={'task_name': task_name})
+        self.deliver(task, 'Initialize', {'no_args': 'True'})
+        self.tasks.append(task)
+
+    def bulk_execute(self, count):
+        detail = {'task_type': TASK_TYPE, 'task_domain_name': DOMAIN_NAME, 'tasks': []}
+        if self.portgroups:
+            detail['portgroups'] = self.rng.sample(self.portgroups, min(2, len(self.portgroups)))
+        self.launch_bulk(detail, count, self.user())
+
+    def fixed_bulk_execute(self, count):
+        """
+        The same bulk launch on every run: count tasks, every other one with a host name, plus a repeat of the first
+        task_name. The repeated name must fail without being launched and every other task must start.
+        """
+        detail = {'task_type': TASK_TYPE, 'task_domain_name': DOMAIN_NAME, 'tasks': [],
+                  'portgroups': self.portgroups[:2] or ['None']}
+        start = time.perf_counter()
+        outcomes = self.launch_bulk(detail, count, self.users[0], repeat_first=True)
+        repeated = [o for o in outcomes if o['task_name'] == detail['tasks'][0]['task_name']]
+        ok = len(outcomes) == count and repeated == [
+            {'task_name': repeated[0]['task_name'], 'outcome': 'failed',
+             'message': f'{repeated[0]["task_name"]} is requested more than once'}
+        ] and all(o['outcome'] == 'success' for o in outcomes if o not in repeated)
+        self.recorder.record('task_control', 'bulk_execute.fixed', time.perf_counter() - start, ok)
+
+    def launch_bulk(self, detail, count, user, repeat_first=False):
+        """Launches count new tasks with one bulk_execute and checks in the ones that started; returns the outcomes"""
+        for i in range(count):
+            task_name = self.next_id('task')
+            detail['tasks'].append({'task_name': task_name, 'task_host_name': task_name if i % 2 == 0 else None})
+        if repeat_first:
+            detail['tasks'].append(dict(detail['tasks'][0]))
+        response = self.task_control('bulk_execute', detail, user=user)
+        if response['statusCode'] != 200:
+            return []
+        outcomes = json.loads(response['body'])['tasks']
+        for outcome in outcomes:
+            if outcome['outcome'] != 'success':
+                continue
+            task = {'task_name': outcome['task_name'], 'attack_ip': outcome['attack_ip'], 'user': user,
+                    'timestamp': int(time.time())}
+            self.remote_task('get_commands', user, detail={'task_name': task['task_name']})
+            self.deliver(task, 'Initialize', {'no_args': 'True'})
+            self.tasks.append(task)
+        return outcomes
+
+    def register_remote(self):
+        user = self.user()
+        task_name = self.next_id('remote')
+        self.remote_task('register_task', user, detail={
+            'task_name': task_name, 'task_context': 'remote', 'task_type': TASK_TYPE, 'attack_ip': '198.51.100.7',
+            'local_ip': ['192.168.1.20']
+        })
+        task = {'task_name': task_name, 'attack_ip': '198.51.100.7', 'user': user, 'timestamp': int(time.time())}
+        self.remote_task('post_results', user, results=result_payload(user, task, 'Initialize', {'no_args': 'True'},
+                                                                       self.tick(task)))
+        self.tasks.append(task)
+
+    def tick(self, task):
+        # Queue rows are keyed by task and second, so successive results for one task get distinct run_times
+        task['timestamp'] += 1
+        return task['timestamp']
+
+    def deliver(self, task, instruct_command, instruct_args):
+        payload = result_payload(task['user'], task, instruct_command, instruct_args, self.tick(task))
+        self.call('task_result', 'deliver', log_event(payload))
+
+    def interact(self):
+        if not self.tasks:
+            return
+        task = self.rng.choice(self.tasks)
+        instruct_args = {'target': '10.0.0.0/24', 'options': '-sV', 'ports': self.rng.randrange(1, 65535)}
+        self.instruct(task, instruct_args)
+        queued_args = None
+        if self.rng.random() < 0.3:
+            # A second instruction while the task is busy waits in its queue and goes out once the first completes
+            queued_args = {'target': '10.0.1.0/24', 'options': '-sT', 'ports': self.rng.randrange(1, 65535)}
+            response = self.instruct(task, queued_args, expect=202)
+            instruction_id = json.loads(response['body']).get('instruction_id')
+            self.task_control('queue_status', {'task_name': task['task_name']}, user=task['user'])
+            if self.rng.random() < 0.25:
+                self.task_control('cancel_instruction', {
+                    'task_name': task['task_name'], 'instruction_id': instruction_id
+                }, user=task['user'])
+                queued_args = None
+        self.complete(task, instruct_args)
+        if queued_args:
+            self.complete(task, queued_args)
+
+    def instruct(self, task, instruct_args, expect=200):
+        return self.task_control('interact', {
+            'task_name': task['task_name'], 'instruct_command': 'run_scan', 'instruct_instance': 'bench',
+            'instruct_args': instruct_args
+        }, expect=expect, user=task['user'], label=None if expect == 200 else 'interact.queued')
+
+    def complete(self, task, instruct_args, output=None):
+        """The task picks up its instruction and reports the result"""
+        response = self.remote_task('get_commands', task['user'], detail={'task_name': task['task_name']})
+        if task['task_name'].startswith('remote'):
+            self.remote_task('post_results', task['user'], results=result_payload(
+                task['user'], task, 'run_scan', instruct_args, self.tick(task), output
+            ))
+        else:
+            payload = result_payload(task['user'], task, 'run_scan', instruct_args, self.tick(task), output)
+            self.call('task_result', 'deliver', log_event(payload))
+        return response
+
+    def pipeline(self):
+        """Runs a two step pipeline whose second step takes its target from the first step's output"""
+        if not self.tasks:
+            return
+        task = self.rng.choice(self.tasks)
+        host = f'10.0.3.{self.rng.randrange(1, 255)}'
+        steps = [
+            {'instruct_command': 'run_scan', 'instruct_instance': 'bench', 'instruct_args': {'target': '10.0.3.0/24'}},
+            {'instruct_command': 'run_scan', 'instruct_instance': 'bench', 'instruct_args': {
+                'target': '{{step.0.hosts.0}}', 'options': '-sV -p {{step.0.ports.1}}'
+            }}
+        ]
+        self.task_control('interact', {'task_name': task['task_name'], 'pipeline': steps}, user=task['user'],
+                          label='interact.pipeline')
+        self.complete(task, steps[0]['instruct_args'], {'outcome': 'success', 'hosts': [host], 'ports': [22, 443]})
+        # The second step was sent by result delivery, with its bindings resolved
+        start = time.perf_counter()
+        response = self.complete(task, {'target': host, 'options': '-sV -p 443'})
+        commands = json.loads(response['body']).get('commands', [])
+        ok = any(c['instruct_args'] == {'target': host, 'options': '-sV -p 443'} for c in commands)
+        self.recorder.record('task_result', 'pipeline.step', time.perf_counter() - start, ok)
+
+    def broadcast(self):
+        """Sends one instruction to several tasks at once, then lets each of them report back"""
+        if len(self.tasks) < 2:
+            return
+        tasks = self.rng.sample(self.tasks, min(4, len(self.tasks)))
+        instruct_args = {'target': '10.0.2.0/24', 'options': '-sn', 'ports': self.rng.randrange(1, 65535)}
+        response = self.task_control('broadcast', {
+            'task_names': [task['task_name'] for task in tasks], 'task_type': TASK_TYPE,
+            'instruct_command': 'run_scan', 'instruct_instance': 'bench', 'instruct_args': instruct_args
+        }, user=tasks[0]['user'])
+        outcomes = json.loads(response['body']).get('tasks', {})
+        for task in tasks:
+            if outcomes.get(task['task_name'], {}).get('outcome') == 'success':
+                self.complete(task, instruct_args)
+
+    def create_schedule(self):
+        task = self.rng.choice(self.tasks)
+        self.task_control('create_schedule', {
+            'task_name': task['task_name'], 'instruct_command': 'echo', 'instruct_instance': 'bench',
+            'instruct_args': {'heartbeat': 'yes'}, 'interval': 60,
+            'busy_policy': self.rng.choice(['queue', 'skip', 'defer'])
+        }, user=task['user'])
+
+    def run_schedules(self):
+        """
+        Lets a minute pass and runs the scheduler, sometimes with a task kept busy, then runs it again at the same
+        time to check that no occurrence fires twice
+        """
+        if not self.tasks:
+            return
+        if self.rng.random() < 0.3:
+            self.create_schedule()
+        busy = None
+        busy_args = {'target': '10.0.4.0/24', 'options': '-sV', 'ports': self.rng.randrange(1, 65535)}
+        if self.rng.random() < 0.3:
+            busy = self.rng.choice(self.tasks)
+            self.instruct(busy, busy_args)
+        self.clock.advance(60)
+        response = self.call('task_control', 'run_schedules', {'run_schedules': {}})
+        tasks = {task['task_name']: task for task in self.tasks}
+        queued = []
+        for outcome in response['schedules'].values():
+            task = tasks.get(outcome['task_name'])
+            if outcome['outcome'] != 'fired' or task is None:
+                continue
+            if outcome['status_code'] == 200:
+                self.complete(task, {'heartbeat': 'yes'})
+            elif outcome['status_code'] == 202:
+                queued.append(task)
+        if busy:
+            self.complete(busy, busy_args)
+        for task in queued:
+            # Sent by result delivery once the instruction it waited behind completed
+            self.complete(task, {'heartbeat': 'yes'})
+
+        start = time.perf_counter()
+        response = self.call('task_control', 'run_schedules.repeat', {'run_schedules': {}})
+        fired = [o for o in response['schedules'].values() if o['outcome'] == 'fired']
+        self.recorder.record('task_control', 'run_schedules.no_refire', time.perf_counter() - start, not fired)
+
+    def get_results(self):
+        if not self.tasks:
+            return
+        task_name = self.rng.choice(self.tasks)['task_name']
+        if self.rng.random() < 0.5:
+            self.task_control('get_results', {'task_name': task_name})
+            return
+        # Page through the results a few at a time and check that the pages join up in order
+        order = self.rng.choice(['ascending', 'descending'])
+        # Result timestamps run ahead of the wall clock, so the window reaches into tomorrow
+        end_time = (datetime.datetime.now() + datetime.timedelta(days=1)).strftime('%m/%d/%Y %H:%M:%S')
+        detail = {'task_name': task_name, 'limit': 3, 'order': order, 'end_time': end_time}
+        run_times = []
+        start = time.perf_counter()
+        while True:
+            body = json.loads(self.task_control('get_results', detail, label='get_results.page')['body'])
+            run_times.extend(int(entry['run_time']) for entry in body.get('queue', []))
+            if body['next_token'] is None:
+                break
+            detail = {'task_name': task_name, 'next_token': body['next_token']}
+        ok = run_times == sorted(set(run_times), reverse=order == 'descending')
+        self.recorder.record('task_control', 'get_results.paged', time.perf_counter() - start, ok)
+
+    def terminate(self):
+        if not self.tasks:
+            return
+        task = self.tasks.pop(self.rng.randrange(len(self.tasks)))
+        if task['task_name'].startswith('remote'):
+            self.remote_task('post_results', task['user'], results=result_payload(
+                task['user'], task, 'terminate', {'no_args': 'True'}, self.tick(task)
+            ))
+        elif self.rng.random() < 0.5:
+            self.manage('task', 'kill', {'task_name': task['task_name']}, user=task['user'])
+        else:
+            self.task_control('interact', {
+                'task_name': task['task_name'], 'instruct_command': 'terminate', 'instruct_instance': 'bench'
+            }, user=task['user'])
+            self.remote_task('get_commands', task['user'], detail={'task_name': task['task_name']})
+            self.deliver(task, 'terminate', {'no_args': 'True'})
+
+    def browse(self):
+        choice = self.rng.random()
+        if choice < 0.2:
+            self.manage('task', 'list', {})
+        elif choice < 0.35 and self.tasks:
+            self.manage('task', 'get', {'task_name': self.rng.choice(self.tasks)['task_name']})
+        elif choice < 0.45:
+            self.manage('task_type', 'list', {})
+        elif choice < 0.55 and self.portgroups:
+            self.manage('portgroup', 'get', {'portgroup_name': self.rng.choice(self.portgroups)})
+        elif choice < 0.65:
+            self.manage('domain', 'get', {'domain_name': DOMAIN_NAME})
+        elif choice < 0.75:
+            self.manage('user', 'list', {}, user=self.users[0])
+        elif choice < 0.85:
+            self.manage('workspace', 'list', {})
+        else:
+            filename = self.next_id('notes') + '.txt'
+            contents = base64.b64encode(b'notes\n' * 64).decode('utf-8')
+            self.manage('workspace', 'create', {'filename': filename, 'file_contents': contents})
+            self.manage('workspace', 'get', {'filename': filename})
+            self.manage('workspace', 'delete', {'filename': filename})
+
+    def round(self, task_count):
+        """One operator session: authorize every call, keep task_count tasks busy and poll their results"""
+        self.session()
+        missing = task_count - len(self.tasks)
+        if missing > 2 and self.rng.random() < 0.5:
+            self.authorize()
+            self.bulk_execute(missing // 2)
+        for _ in range(task_count - len(self.tasks)):
+            self.authorize()
+            if self.rng.random() < 0.75:
+                self.execute()
+            else:
+                self.register_remote()
+        for _ in range(task_count):
+            self.authorize()
+            self.interact()
+            self.authorize()
+            self.get_results()
+            self.authorize()
+            self.browse()
+        if self.rng.random() < 0.3:
+            self.authorize()
+            self.broadcast()
+        if self.rng.random() < 0.3:
+            self.authorize()
+            self.pipeline()
+        self.run_schedules()
+        self.authorize()
+        self.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--tasks', type=int, default=8, help='tasks kept running at once')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--portgroups', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='injected latency per AWS call in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency per call in milliseconds')
+    parser.add_argument('--provisioning-time', type=float, default=5.0,
+                        help='seconds (virtual) before a launched task has a public IP')
+    parser.add_argument('--dns-sync-time', type=float, default=30.0,
+                        help='seconds (virtual) before a Route53 change is INSYNC')
+    parser.add_argument('--standby-pool', type=int, default=2, help='standby pool size of the task type')
+    parser.add_argument('--post-launch-concurrency', type=int, default=5,
+                        help='threads for the steps after a task is reachable (1 runs them one after another)')
+    parser.add_argument('--bulk-tasks', type=int, default=4, help='tasks in the bulk launch made before the rounds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help='show what the handlers print')
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    os.environ['POST_LAUNCH_CONCURRENCY'] = str(args.post_launch_concurrency)
+    rng = random.Random(args.seed)
+    skipped_sleep = SkippedSleep()
+    latency = local_aws.Latency(args.latency / 1000, args.jitter / 1000, seed=args.seed)
+    backend = local_aws.LocalAWS(REGION, latency=latency, provisioning_time=args.provisioning_time,
+                                 dns_sync_time=args.dns_sync_time, clock=skipped_sleep.monotonic)
+    users = [
+        {'user_id': f'user{i}', 'api_key': f'apikey{i:06d}', 'secret': f'secret{i:018d}',
+         'admin': 'yes' if i == 0 else 'no'}
+        for i in range(args.users)
+    ]
+    seed(backend, users)
+    functions = {name: Function(name, backend, skipped_sleep) for name in FUNCTIONS}
+    recorder = Recorder()
+    workload = Workload(functions, backend, recorder, users, rng, skipped_sleep)
+
+    output = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        for _ in range(args.portgroups):
+            workload.create_portgroup()
+        if args.standby_pool:
+            workload.manage('task_type', 'update', {'task_type': TASK_TYPE, 'standby_pool_size': args.standby_pool},
+                            user=users[0])
+            backend.run_pending_invocations()
+        if args.bulk_tasks:
+            workload.fixed_bulk_execute(args.bulk_tasks)
+        for _ in range(args.rounds):
+            workload.round(args.tasks)
+        workload.revoke_session()
+    elapsed = time.perf_counter() - start
+
+    total_calls = sum(len(s) for s in recorder.samples.values())
+    aws_calls = sum(sum(s.calls.values()) for s in backend.services.values())
+    print(f'rounds: {args.rounds}, tasks: {args.tasks}, injected latency: {args.latency} ms (+{args.jitter} ms jitter)')
+    print(f'{total_calls} handler calls, {aws_calls} AWS calls in {elapsed:.2f} s ({total_calls / elapsed:,.0f} '
+          f'calls/s); skipped {skipped_sleep.seconds:,.0f} s of sleeps')
+    recorder.report()
+    if recorder.failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1215 @@
+"""
+In-memory stand-ins for the AWS services the havoc control API calls.
+
+LocalAWS imitates the DynamoDB tables of a campaign (including the ApiKeyIndex on the authorizer table), the S3
+workspace bucket, and enough of ECS, EC2, Route53 and Lambda for every code path in the five functions. Clients accept
+the same keyword arguments as their boto3 counterparts, return the same response shapes and raise
+botocore.exceptions.ClientError with the same error codes. Every call can be delayed by a configurable, optionally
+jittered latency to approximate network round trips.
+
+Install it into a function's aws_clients module with LocalAWS.install(aws_clients).
+"""
+import io
+import re
+import copy
+import functools
+import json
+import time
+import uuid
+import random
+import threading
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+ACCOUNT_ID = '123456789012'
+
+
+def client_error(code, message, operation_name, **extra):
+    error_response = {'Error': {'Code': code, 'Message': message}}
+    error_response.update(extra)
+    return ClientError(error_response, operation_name)
+
+
+class Latency:
+
+    def __init__(self, default=0.0, jitter=0.0, per_service=None, seed=None):
+        """
+        Injected call latency in seconds. per_service overrides default for individual services, and jitter adds a
+        uniformly distributed delay of up to jitter seconds to every call.
+        """
+        self.default = default
+        self.jitter = jitter
+        self.per_service = per_service or {}
+        self.rng = random.Random(seed)
+
+    def wait(self, service):
+        delay = self.per_service.get(service, self.default)
+        if self.jitter:
+            delay += self.rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def operation(operation_name):
+    """
+    Wraps a client method: counts the call, applies injected latency, raises any error queued with LocalAWS.fail_next
+    and adds the ResponseMetadata that boto3 includes in every response
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, **kwargs):
+            with self.lock:
+                self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+            self.backend.latency.wait(self.service_name)
+            self.backend.raise_injected_error(self.service_name, operation_name)
+            response = method(self, **kwargs)
+            response['ResponseMetadata'] = {'RequestId': uuid.uuid4().hex, 'HTTPStatusCode': 200, 'RetryAttempts': 0}
+            return response
+        return wrapper
+    return decorator
+
+
+class LocalService:
+
+    service_name = None
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.region = backend.region
+        self.lock = threading.RLock()
+        self.calls = {}
+
+
+# DynamoDB expressions
+
+TOKEN_PATTERN = re.compile(
+    r'\s*(?:(?P<number>\d+)|(?P<op><>|<=|>=|=|<|>|\(|\)|\[|\]|,|\.|\+|-)|(?P<value>:[A-Za-z0-9_]+)|'
+    r'(?P<name>#?[A-Za-z_][A-Za-z0-9_\-]*))'
+)
+UPDATE_CLAUSES = ['SET', 'REMOVE', 'ADD', 'DELETE']
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise ValueError(f'invalid expression near {expression[position:]!r}')
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+        while position < len(expression) and expression[position].isspace():
+            position += 1
+    return tokens
+
+
+def comparable(attribute):
+    """Returns a Python value that orders the way DynamoDB orders the attribute value"""
+    if attribute is None:
+        return None
+    tag, value = next(iter(attribute.items()))
+    if tag == 'N':
+        return Decimal(value)
+    if tag in ('SS', 'BS'):
+        return frozenset(value)
+    if tag == 'NS':
+        return frozenset(Decimal(v) for v in value)
+    if tag in ('M', 'L'):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+class Expression:
+
+    def __init__(self, expression, names=None, values=None):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token == (None, None):
+            raise ValueError('unexpected end of expression')
+        if expected is not None and token[1].upper() != expected:
+            raise ValueError(f'expected {expected}, found {token[1]}')
+        self.position += 1
+        return token
+
+    def keyword(self, word):
+        kind, text = self.peek()
+        return kind == 'name' and text.upper() == word
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    def resolve_name(self, text):
+        if text.startswith('#'):
+            if text not in self.names:
+                raise ValueError(f'{text} is not defined in ExpressionAttributeNames')
+            return self.names[text]
+        return text
+
+    def resolve_value(self, text):
+        if text not in self.values:
+            raise ValueError(f'{text} is not defined in ExpressionAttributeValues')
+        return self.values[text]
+
+    def parse_path(self):
+        kind, text = self.take()
+        if kind != 'name':
+            raise ValueError(f'expected an attribute name, found {text}')
+        path = [self.resolve_name(text)]
+        while self.peek()[1] in ('.', '['):
+            if self.take()[1] == '.':
+                path.append(self.resolve_name(self.take()[1]))
+            else:
+                path.append(int(self.take()[1]))
+                self.take(']')
+        return tuple(path)
+
+
+def get_path(item, path):
+    current = {'M': item}
+    for segment in path:
+        if isinstance(segment, int):
+            if 'L' not in current or segment >= len(current['L']):
+                return None
+            current = current['L'][segment]
+        else:
+            if 'M' not in current or segment not in current['M']:
+                return None
+            current = current['M'][segment]
+    return current
+
+
+def set_path(item, path, value):
+    parent = get_path(item, path[:-1]) if len(path) > 1 else {'M': item}
+    if parent is None:
+        raise ValueError('the document path provided in the update expression is invalid for update')
+    segment = path[-1]
+    if isinstance(segment, int):
+        if 'L' not in parent:
+            raise ValueError('the document path provided in the update expression is invalid for update')
+        if segment < len(parent['L']):
+            parent['L'][segment] = value
+        else:
+            parent['L'].append(value)
+    else:
+        if 'M' not in parent:
+            raise ValueError('the document path provided in the update expression is invalid for update')
+        parent['M'][segment] = value
+
+
+def remove_path(item, path):
+    parent = get_path(item, path[:-1]) if len(path) > 1 else {'M': item}
+    if parent is None:
+        return
+    segment = path[-1]
+    if isinstance(segment, int):
+        if 'L' in parent and segment < len(parent['L']):
+            del parent['L'][segment]
+    elif 'M' in parent:
+        parent['M'].pop(segment, None)
+
+
+class Condition(Expression):
+
+    def evaluate(self, item):
+        """Parses and evaluates the condition against item (which may be empty when the item does not exist)"""
+        self.position = 0
+        result = self.parse_or(item)
+        if not self.done():
+            raise ValueError(f'unexpected token {self.peek()[1]}')
+        return result
+
+    def parse_or(self, item):
+        result = self.parse_and(item)
+        while self.keyword('OR'):
+            self.take()
+            right = self.parse_and(item)
+            result = result or right
+        return result
+
+    def parse_and(self, item):
+        result = self.parse_not(item)
+        while self.keyword('AND'):
+            self.take()
+            right = self.parse_not(item)
+            result = result and right
+        return result
+
+    def parse_not(self, item):
+        if self.keyword('NOT'):
+            self.take()
+            return not self.parse_not(item)
+        return self.parse_primary(item)
+
+    def parse_primary(self, item):
+        if self.peek()[1] == '(':
+            self.take()
+            result = self.parse_or(item)
+            self.take(')')
+            return result
+        kind, text = self.peek()
+        if kind == 'name' and self.peek(1)[1] == '(' and text.lower() != 'size':
+            return self.parse_function(item)
+        left = self.parse_operand(item)
+        if self.keyword('BETWEEN'):
+            self.take()
+            low = self.parse_operand(item)
+            self.take('AND')
+            high = self.parse_operand(item)
+            if left is None or low is None or high is None:
+                return False
+            return comparable(low) <= comparable(left) <= comparable(high)
+        if self.keyword('IN'):
+            self.take()
+            self.take('(')
+            candidates = [self.parse_operand(item)]
+            while self.peek()[1] == ',':
+                self.take()
+                candidates.append(self.parse_operand(item))
+            self.take(')')
+            return left is not None and comparable(left) in [comparable(c) for c in candidates]
+        operator = self.take()[1]
+        right = self.parse_operand(item)
+        if operator == '=':
+            return left is not None and right is not None and comparable(left) == comparable(right)
+        if operator == '<>':
+            return left is None or right is None or comparable(left) != comparable(right)
+        if left is None or right is None:
+            return False
+        left, right = comparable(left), comparable(right)
+        return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+
+    def parse_function(self, item):
+        function = self.take()[1].lower()
+        self.take('(')
+        if function in ('attribute_exists', 'attribute_not_exists'):
+            exists = get_path(item, self.parse_path()) is not None
+            self.take(')')
+            return exists if function == 'attribute_exists' else not exists
+        first = self.parse_operand(item)
+        self.take(',')
+        second = self.parse_operand(item)
+        self.take(')')
+        if first is None or second is None:
+            return False
+        if function == 'attribute_type':
+            return next(iter(second.values())) in first
+        if function == 'begins_with':
+            return comparable(first).startswith(comparable(second))
+        if function == 'contains':
+            tag, value = next(iter(first.items()))
+            if tag == 'S':
+                return comparable(second) in value
+            if tag == 'L':
+                return comparable(second) in [comparable(v) for v in value]
+            return comparable(second) in comparable(first)
+        raise ValueError(f'unsupported function {function}')
+
+    def parse_operand(self, item):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.take()
+            return self.resolve_value(text)
+        if kind == 'name' and text.lower() == 'size' and self.peek(1)[1] == '(':
+            self.take()
+            self.take('(')
+            value = get_path(item, self.parse_path())
+            self.take(')')
+            if value is None:
+                return None
+            tag, inner = next(iter(value.items()))
+            return {'N': str(len(inner))}
+        return get_path(item, self.parse_path())
+
+
+class Update(Expression):
+
+    def apply(self, item):
+        """Applies the update expression to item in place"""
+        self.position = 0
+        paths = []
+        actions = []
+        while not self.done():
+            clause = self.take()[1].upper()
+            if clause not in UPDATE_CLAUSES:
+                raise ValueError(f'invalid update clause {clause}')
+            while True:
+                path = self.parse_path()
+                paths.append(path)
+                if clause == 'SET':
+                    self.take('=')
+                    actions.append((clause, path, self.parse_set_value(item)))
+                elif clause == 'REMOVE':
+                    actions.append((clause, path, None))
+                else:
+                    actions.append((clause, path, self.resolve_value(self.take()[1])))
+                if self.peek()[1] != ',':
+                    break
+                self.take()
+        for i, first in enumerate(paths):
+            for second in paths[i + 1:]:
+                shorter = min(len(first), len(second))
+                if first[:shorter] == second[:shorter]:
+                    raise ValueError(f'Two document paths overlap with each other; must remove or rewrite one of '
+                                     f'these paths; path one: {list(first)}, path two: {list(second)}')
+        for clause, path, value in actions:
+            if clause == 'SET':
+                set_path(item, path, copy.deepcopy(value))
+            elif clause == 'REMOVE':
+                remove_path(item, path)
+            elif clause == 'ADD':
+                self.add(item, path, value)
+            else:
+                self.delete(item, path, value)
+
+    def parse_set_value(self, item):
+        value = self.parse_set_operand(item)
+        if self.peek()[1] in ('+', '-'):
+            operator = self.take()[1]
+            right = self.parse_set_operand(item)
+            if value is None or right is None or 'N' not in value or 'N' not in right:
+                raise ValueError('an operand in the update expression has an incorrect data type')
+            if operator == '+':
+                value = {'N': str(Decimal(value['N']) + Decimal(right['N']))}
+            else:
+                value = {'N': str(Decimal(value['N']) - Decimal(right['N']))}
+        return value
+
+    def parse_set_operand(self, item):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.take()
+            return self.resolve_value(text)
+        if kind == 'name' and self.peek(1)[1] == '(':
+            function = self.take()[1].lower()
+            self.take('(')
+            if function == 'if_not_exists':
+                existing = get_path(item, self.parse_path())
+                self.take(',')
+                default = self.parse_set_operand(item)
+                self.take(')')
+                return existing if existing is not None else default
+            if function == 'list_append':
+                first = self.parse_set_operand(item)
+                self.take(',')
+                second = self.parse_set_operand(item)
+                self.take(')')
+                if first is None or second is None or 'L' not in first or 'L' not in second:
+                    raise ValueError('an operand in the update expression has an incorrect data type')
+                return {'L': first['L'] + second['L']}
+            raise ValueError(f'unsupported function {function}')
+        value = get_path(item, self.parse_path())
+        if value is None:
+            raise ValueError('the provided expression refers to an attribute that does not exist in the item')
+        return value
+
+    @staticmethod
+    def add(item, path, value):
+        existing = get_path(item, path)
+        tag = next(iter(value))
+        if existing is None:
+            set_path(item, path, copy.deepcopy(value))
+        elif tag == 'N' and 'N' in existing:
+            set_path(item, path, {'N': str(Decimal(existing['N']) + Decimal(value['N']))})
+        elif tag in ('SS', 'NS', 'BS') and tag in existing:
+            merged = list(existing[tag]) + [v for v in value[tag] if v not in existing[tag]]
+            set_path(item, path, {tag: merged})
+        else:
+            raise ValueError('an operand in the update expression has an incorrect data type')
+
+    @staticmethod
+    def delete(item, path, value):
+        existing = get_path(item, path)
+        tag = next(iter(value))
+        if existing is None:
+            return
+        if tag not in existing:
+            raise ValueError('an operand in the update expression has an incorrect data type')
+        remaining = [v for v in existing[tag] if v not in value[tag]]
+        if remaining:
+            set_path(item, path, {tag: remaining})
+        else:
+            remove_path(item, path)
+
+
+def item_size(item):
+    return len(json.dumps(item, default=str))
+
+
+class Table:
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None):
+        """
+        A DynamoDB table; indexes maps index names to (hash_key, range_key) tuples for global secondary indexes
+        """
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.items = {}
+
+    def key_of(self, item_or_key):
+        hash_value = item_or_key.get(self.hash_key)
+        if hash_value is None:
+            raise ValueError(f'missing the key {self.hash_key} in the item')
+        key = (self.hash_key, json.dumps(hash_value, sort_keys=True))
+        if self.range_key:
+            range_value = item_or_key.get(self.range_key)
+            if range_value is None:
+                raise ValueError(f'missing the key {self.range_key} in the item')
+            key += (json.dumps(range_value, sort_keys=True),)
+        return key
+
+    def key_attributes(self, item, index_name=None):
+        names = [self.hash_key] + ([self.range_key] if self.range_key else [])
+        if index_name:
+            names += [n for n in self.indexes[index_name] if n]
+        return {n: copy.deepcopy(item[n]) for n in names if n in item}
+
+    def sort_key(self, item, index_name=None):
+        range_key = self.indexes[index_name][1] if index_name else self.range_key
+        return comparable(item.get(range_key)) if range_key else 0
+
+
+class LocalDynamoDB(LocalService):
+
+    service_name = 'dynamodb'
+    PAGE_SIZE_LIMIT = 1024 * 1024
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.tables = {}
+
+    def create_table(self, name, hash_key, range_key=None, indexes=None):
+        self.tables[name] = Table(name, hash_key, range_key, indexes)
+        return self.tables[name]
+
+    def table(self, name, operation_name):
+        if name not in self.tables:
+            raise client_error('ResourceNotFoundException', 'Requested resource not found', operation_name)
+        return self.tables[name]
+
+    @staticmethod
+    def project(item, projection, names):
+        if not projection:
+            return copy.deepcopy(item)
+        projected = {}
+        for path in projection.split(','):
+            name = path.strip().split('.')[0].split('[')[0]
+            name = names.get(name, name) if names else name
+            if name in item:
+                projected[name] = copy.deepcopy(item[name])
+        return projected
+
+    def check_condition(self, kwargs, item, operation_name):
+        if 'ConditionExpression' not in kwargs:
+            return
+        condition = Condition(kwargs['ConditionExpression'], kwargs.get('ExpressionAttributeNames'),
+                              kwargs.get('ExpressionAttributeValues'))
+        try:
+            passed = condition.evaluate(item or {})
+        except ValueError as error:
+            raise client_error('ValidationException', str(error), operation_name)
+        if not passed:
+            extra = {}
+            if kwargs.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and item is not None:
+                extra['Item'] = copy.deepcopy(item)
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', operation_name,
+                               **extra)
+
+    @operation('GetItem')
+    def get_item(self, **kwargs):
+        with self.lock:
+            table = self.table(kwargs['TableName'], 'GetItem')
+            item = table.items.get(table.key_of(kwargs['Key']))
+            if item is None:
+                return {}
+            return {'Item': self.project(item, kwargs.get('ProjectionExpression'),
+                                         kwargs.get('ExpressionAttributeNames'))}
+
+    @operation('PutItem')
+    def put_item(self, **kwargs):
+        with self.lock:
+            return self.put(kwargs, 'PutItem')
+
+    def put(self, kwargs, operation_name):
+        table = self.table(kwargs['TableName'], operation_name)
+        key = table.key_of(kwargs['Item'])
+        existing = table.items.get(key)
+        self.check_condition(kwargs, existing, operation_name)
+        table.items[key] = copy.deepcopy(kwargs['Item'])
+        if kwargs.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+            return {'Attributes': existing}
+        return {}
+
+    @operation('UpdateItem')
+    def update_item(self, **kwargs):
+        with self.lock:
+            return self.update(kwargs, 'UpdateItem')
+
+    def update(self, kwargs, operation_name):
+        table = self.table(kwargs['TableName'], operation_name)
+        key = table.key_of(kwargs['Key'])
+        existing = table.items.get(key)
+        self.check_condition(kwargs, existing, operation_name)
+        item = copy.deepcopy(existing) if existing is not None else copy.deepcopy(kwargs['Key'])
+        if 'UpdateExpression' in kwargs:
+            try:
+                Update(kwargs['UpdateExpression'], kwargs.get('ExpressionAttributeNames'),
+                       kwargs.get('ExpressionAttributeValues')).apply(item)
+            except ValueError as error:
+                raise client_error('ValidationException', str(error), operation_name)
+        for key_name, key_value in kwargs['Key'].items():
+            if item.get(key_name) != key_value:
+                raise client_error('ValidationException', 'cannot update attribute that is part of the key',
+                                   operation_name)
+        table.items[key] = item
+        return_values = kwargs.get('ReturnValues', 'NONE')
+        if return_values in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': copy.deepcopy(item)}
+        if return_values in ('ALL_OLD', 'UPDATED_OLD') and existing is not None:
+            return {'Attributes': copy.deepcopy(existing)}
+        return {}
+
+    @operation('DeleteItem')
+    def delete_item(self, **kwargs):
+        with self.lock:
+            return self.delete(kwargs, 'DeleteItem')
+
+    def delete(self, kwargs, operation_name):
+        table = self.table(kwargs['TableName'], operation_name)
+        key = table.key_of(kwargs['Key'])
+        existing = table.items.get(key)
+        self.check_condition(kwargs, existing, operation_name)
+        table.items.pop(key, None)
+        if kwargs.get('ReturnValues') == 'ALL_OLD' and existing is not None:
+            return {'Attributes': existing}
+        return {}
+
+    def page(self, table, items, kwargs, index_name, operation_name):
+        """Applies ExclusiveStartKey, Limit, the 1 MB page size limit and FilterExpression to ordered items"""
+        start_key = kwargs.get('ExclusiveStartKey')
+        if start_key:
+            start = table.key_of(start_key)
+            for position, item in enumerate(items):
+                if table.key_of(item) == start:
+                    items = items[position + 1:]
+                    break
+            else:
+                items = []
+        limit = kwargs.get('Limit')
+        evaluated = []
+        size = 0
+        for item in items:
+            if limit is not None and len(evaluated) >= limit:
+                break
+            if size >= self.PAGE_SIZE_LIMIT:
+                break
+            evaluated.append(item)
+            size += item_size(item)
+        response = {}
+        if evaluated and len(evaluated) < len(items):
+            response['LastEvaluatedKey'] = table.key_attributes(evaluated[-1], index_name)
+        matched = evaluated
+        if 'FilterExpression' in kwargs:
+            condition = Condition(kwargs['FilterExpression'], kwargs.get('ExpressionAttributeNames'),
+                                  kwargs.get('ExpressionAttributeValues'))
+            try:
+                matched = [i for i in evaluated if condition.evaluate(i)]
+            except ValueError as error:
+                raise client_error('ValidationException', str(error), operation_name)
+        projection = kwargs.get('ProjectionExpression')
+        response['Items'] = [self.project(i, projection, kwargs.get('ExpressionAttributeNames')) for i in matched]
+        response['Count'] = len(matched)
+        response['ScannedCount'] = len(evaluated)
+        return response
+
+    @operation('Query')
+    def query(self, **kwargs):
+        with self.lock:
+            table = self.table(kwargs['TableName'], 'Query')
+            index_name = kwargs.get('IndexName')
+            if index_name and index_name not in table.indexes:
+                raise client_error('ValidationException', f'The table does not have the specified index: '
+                                                          f'{index_name}', 'Query')
+            condition = Condition(kwargs['KeyConditionExpression'], kwargs.get('ExpressionAttributeNames'),
+                                  kwargs.get('ExpressionAttributeValues'))
+            try:
+                items = [i for i in table.items.values() if condition.evaluate(i)]
+            except ValueError as error:
+                raise client_error('ValidationException', str(error), 'Query')
+            items.sort(key=lambda i: table.sort_key(i, index_name), reverse=not kwargs.get('ScanIndexForward', True))
+            return self.page(table, items, kwargs, index_name, 'Query')
+
+    @operation('Scan')
+    def scan(self, **kwargs):
+        with self.lock:
+            table = self.table(kwargs['TableName'], 'Scan')
+            return self.page(table, list(table.items.values()), kwargs, None, 'Scan')
+
+    @operation('BatchGetItem')
+    def batch_get_item(self, **kwargs):
+        with self.lock:
+            if sum(len(r['Keys']) for r in kwargs['RequestItems'].values()) > 100:
+                raise client_error('ValidationException', 'Too many items requested for the BatchGetItem call',
+                                   'BatchGetItem')
+            responses = {}
+            for table_name, request in kwargs['RequestItems'].items():
+                table = self.table(table_name, 'BatchGetItem')
+                responses[table_name] = [
+                    self.project(table.items[table.key_of(k)], request.get('ProjectionExpression'),
+                                 request.get('ExpressionAttributeNames'))
+                    for k in request['Keys'] if table.key_of(k) in table.items
+                ]
+            return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    @operation('BatchWriteItem')
+    def batch_write_item(self, **kwargs):
+        with self.lock:
+            if sum(len(r) for r in kwargs['RequestItems'].values()) > 25:
+                raise client_error('ValidationException', 'Too many items requested for the BatchWriteItem call',
+                                   'BatchWriteItem')
+            for table_name, requests in kwargs['RequestItems'].items():
+                for request in requests:
+                    if 'PutRequest' in request:
+                        self.put({'TableName': table_name, 'Item': request['PutRequest']['Item']}, 'BatchWriteItem')
+                    else:
+                        self.delete({'TableName': table_name, 'Key': request['DeleteRequest']['Key']},
+                                    'BatchWriteItem')
+            return {'UnprocessedItems': {}}
+
+    @operation('TransactWriteItems')
+    def transact_write_items(self, **kwargs):
+        with self.lock:
+            snapshot = {name: copy.deepcopy(t.items) for name, t in self.tables.items()}
+            reasons = []
+            failed = False
+            for action in kwargs['TransactItems']:
+                (kind, request), = action.items()
+                try:
+                    if kind == 'Put':
+                        self.put(request, 'TransactWriteItems')
+                    elif kind == 'Update':
+                        self.update(request, 'TransactWriteItems')
+                    elif kind == 'Delete':
+                        self.delete(request, 'TransactWriteItems')
+                    else:
+                        table = self.table(request['TableName'], 'TransactWriteItems')
+                        self.check_condition(request, table.items.get(table.key_of(request['Key'])),
+                                             'TransactWriteItems')
+                    reasons.append({'Code': 'None'})
+                except ClientError as error:
+                    failed = True
+                    reasons.append({'Code': error.response['Error']['Code'].replace('Exception', ''),
+                                    'Message': error.response['Error']['Message']})
+            if failed:
+                for name, items in snapshot.items():
+                    self.tables[name].items = items
+                raise client_error('TransactionCanceledException', 'Transaction cancelled', 'TransactWriteItems',
+                                   CancellationReasons=reasons)
+            return {}
+
+
+class StreamingBody:
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, amount=None):
+        return self.stream.read(amount)
+
+
+class LocalS3(LocalService):
+
+    service_name = 's3'
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.buckets = {}
+        self.put_listeners = []
+
+    def add_put_listener(self, listener):
+        """Calls listener(bucket, key, body) after every PutObject, as a container watching its workspace would"""
+        self.put_listeners.append(listener)
+
+    def create_bucket(self, name):
+        self.buckets.setdefault(name, {})
+
+    def bucket(self, name, operation_name):
+        if name not in self.buckets:
+            raise client_error('NoSuchBucket', 'The specified bucket does not exist', operation_name)
+        return self.buckets[name]
+
+    @operation('PutObject')
+    def put_object(self, **kwargs):
+        body = kwargs.get('Body', b'')
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with self.lock:
+            self.bucket(kwargs['Bucket'], 'PutObject')[kwargs['Key']] = bytes(body)
+        for listener in self.put_listeners:
+            listener(kwargs['Bucket'], kwargs['Key'], bytes(body))
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    @operation('GetObject')
+    def get_object(self, **kwargs):
+        with self.lock:
+            objects = self.bucket(kwargs['Bucket'], 'GetObject')
+            if kwargs['Key'] not in objects:
+                raise client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+            data = objects[kwargs['Key']]
+        return {'Body': StreamingBody(data), 'ContentLength': len(data)}
+
+    @operation('DeleteObject')
+    def delete_object(self, **kwargs):
+        with self.lock:
+            self.bucket(kwargs['Bucket'], 'DeleteObject').pop(kwargs['Key'], None)
+        return {}
+
+    @operation('DeleteObjects')
+    def delete_objects(self, **kwargs):
+        with self.lock:
+            objects = self.bucket(kwargs['Bucket'], 'DeleteObjects')
+            for entry in kwargs['Delete']['Objects']:
+                objects.pop(entry['Key'], None)
+        return {'Deleted': [{'Key': e['Key']} for e in kwargs['Delete']['Objects']]}
+
+    @operation('ListObjectsV2')
+    def list_objects_v2(self, **kwargs):
+        prefix = kwargs.get('Prefix', '')
+        max_keys = kwargs.get('MaxKeys', 1000)
+        with self.lock:
+            keys = sorted(k for k in self.bucket(kwargs['Bucket'], 'ListObjectsV2') if k.startswith(prefix))
+            sizes = {k: len(self.buckets[kwargs['Bucket']][k]) for k in keys}
+        start = kwargs.get('ContinuationToken') or kwargs.get('StartAfter')
+        if start:
+            keys = [k for k in keys if k > start]
+        page = keys[:max_keys]
+        response = {'KeyCount': len(page), 'Prefix': prefix, 'IsTruncated': len(keys) > max_keys}
+        if page:
+            response['Contents'] = [{'Key': k, 'Size': sizes[k]} for k in page]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+
+class LocalECS(LocalService):
+
+    service_name = 'ecs'
+    MAX_RUN_TASK_COUNT = 10
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.tasks = {}
+        self.task_definitions = {}
+
+    @operation('RegisterTaskDefinition')
+    def register_task_definition(self, **kwargs):
+        with self.lock:
+            revision = sum(1 for d in self.task_definitions.values() if d['family'] == kwargs['family']) + 1
+            arn = f'arn:aws:ecs:{self.region}:{ACCOUNT_ID}:task-definition/{kwargs["family"]}:{revision}'
+            definition = dict(copy.deepcopy(kwargs), taskDefinitionArn=arn, revision=revision, status='ACTIVE')
+            self.task_definitions[arn] = definition
+        return {'taskDefinition': copy.deepcopy(definition)}
+
+    @operation('DeregisterTaskDefinition')
+    def deregister_task_definition(self, **kwargs):
+        with self.lock:
+            definition = self.task_definitions.get(kwargs['taskDefinition'], {'taskDefinitionArn': kwargs[
+                'taskDefinition']})
+            definition['status'] = 'INACTIVE'
+        return {'taskDefinition': copy.deepcopy(definition)}
+
+    @operation('RunTask')
+    def run_task(self, **kwargs):
+        count = kwargs.get('count', 1)
+        if count > self.MAX_RUN_TASK_COUNT:
+            raise client_error('InvalidParameterException', 'count must be between 1 and 10', 'RunTask')
+        vpc_config = kwargs.get('networkConfiguration', {}).get('awsvpcConfiguration', {})
+        subnets = vpc_config.get('subnets') or ['subnet-local']
+        launched = []
+        failures = []
+        with self.lock:
+            for i in range(count):
+                task_id = uuid.uuid4().hex
+                subnet = subnets[i % len(subnets)]
+                arn = f'arn:aws:ecs:{self.region}:{ACCOUNT_ID}:task/{kwargs.get("cluster", "default")}/{task_id}'
+                if self.backend.ec2.free_ips(subnet) <= 0:
+                    failures.append({'arn': arn, 'reason': 'RESOURCE:ENI',
+                                     'detail': f'{subnet} has no free addresses'})
+                    continue
+                interface_id = self.backend.ec2.create_network_interface(subnet, vpc_config.get('securityGroups', []))
+                task = {
+                    'taskArn': arn,
+                    'clusterArn': f'arn:aws:ecs:{self.region}:{ACCOUNT_ID}:cluster/{kwargs.get("cluster", "default")}',
+                    'taskDefinitionArn': kwargs.get('taskDefinition'),
+                    'lastStatus': 'PROVISIONING',
+                    'desiredStatus': 'RUNNING',
+                    'launchType': kwargs.get('launchType', 'FARGATE'),
+                    'overrides': copy.deepcopy(kwargs.get('overrides', {})),
+                    'tags': copy.deepcopy(kwargs.get('tags', [])),
+                    'attachments': [{
+                        'id': uuid.uuid4().hex,
+                        'type': 'ElasticNetworkInterface',
+                        'status': 'PRECREATED',
+                        'details': [
+                            {'name': 'subnetId', 'value': subnet},
+                            {'name': 'networkInterfaceId', 'value': interface_id},
+                            {'name': 'macAddress', 'value': '0a:00:00:00:00:00'},
+                            {'name': 'privateIPv4Address', 'value': f'10.0.{random.randrange(256)}.'
+                                                                   f'{random.randrange(1, 255)}'}
+                        ]
+                    }],
+                    'launched_at': self.backend.clock()
+                }
+                self.tasks[arn] = task
+                launched.append(self.describe(task))
+        return {'tasks': launched, 'failures': failures}
+
+    def describe(self, task):
+        described = copy.deepcopy(task)
+        launched_at = described.pop('launched_at')
+        if self.backend.clock() - launched_at >= self.backend.provisioning_time and described['lastStatus'] != 'STOPPED':
+            described['lastStatus'] = 'RUNNING'
+            described['attachments'][0]['status'] = 'ATTACHED'
+        return described
+
+    @operation('DescribeTasks')
+    def describe_tasks(self, **kwargs):
+        if len(kwargs['tasks']) > 100:
+            raise client_error('InvalidParameterException', 'tasks can have at most 100 items', 'DescribeTasks')
+        described = []
+        failures = []
+        with self.lock:
+            for arn in kwargs['tasks']:
+                if arn in self.tasks:
+                    described.append(self.describe(self.tasks[arn]))
+                else:
+                    failures.append({'arn': arn, 'reason': 'MISSING'})
+        return {'tasks': described, 'failures': failures}
+
+    @operation('StopTask')
+    def stop_task(self, **kwargs):
+        with self.lock:
+            task = self.tasks.get(kwargs['task'])
+            if task is None:
+                raise client_error('InvalidParameterException', 'The referenced task was not found.', 'StopTask')
+            task['lastStatus'] = 'STOPPED'
+            task['desiredStatus'] = 'STOPPED'
+            task['stoppedReason'] = kwargs.get('reason', '')
+            return {'task': self.describe(task)}
+
+    @operation('ListTasks')
+    def list_tasks(self, **kwargs):
+        with self.lock:
+            arns = [a for a, t in self.tasks.items() if t['desiredStatus'] == kwargs.get('desiredStatus', 'RUNNING')]
+        return {'taskArns': arns}
+
+
+class LocalEC2(LocalService):
+
+    service_name = 'ec2'
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.network_interfaces = {}
+        self.security_groups = {}
+        self.subnets = {}
+
+    def create_subnet(self, subnet_id, availability_zone, available_ips=250):
+        self.subnets[subnet_id] = {
+            'SubnetId': subnet_id, 'AvailabilityZone': availability_zone, 'AvailableIpAddressCount': available_ips
+        }
+
+    def free_ips(self, subnet):
+        with self.lock:
+            return self.subnets[subnet]['AvailableIpAddressCount'] if subnet in self.subnets else 1
+
+    def create_network_interface(self, subnet, security_groups):
+        interface_id = f'eni-{uuid.uuid4().hex[:17]}'
+        with self.lock:
+            self.network_interfaces[interface_id] = {
+                'NetworkInterfaceId': interface_id,
+                'SubnetId': subnet,
+                'Groups': [{'GroupId': g} for g in security_groups],
+                'PrivateIpAddress': f'10.0.{random.randrange(256)}.{random.randrange(1, 255)}',
+                'Association': {'PublicIp': f'203.0.{random.randrange(256)}.{random.randrange(1, 255)}'},
+                'created_at': self.backend.clock()
+            }
+            if subnet in self.subnets:
+                self.subnets[subnet]['AvailableIpAddressCount'] -= 1
+        return interface_id
+
+    @operation('DescribeNetworkInterfaces')
+    def describe_network_interfaces(self, **kwargs):
+        described = []
+        with self.lock:
+            interface_ids = kwargs.get('NetworkInterfaceIds', [])
+            for interface_id in interface_ids:
+                if interface_id not in self.network_interfaces:
+                    raise client_error('InvalidNetworkInterfaceID.NotFound',
+                                       f"The networkInterface ID '{interface_id}' does not exist",
+                                       'DescribeNetworkInterfaces')
+            # Unlike NetworkInterfaceIds, a network-interface-id filter skips interfaces that do not exist
+            for interface_filter in kwargs.get('Filters', []):
+                if interface_filter['Name'] != 'network-interface-id':
+                    raise client_error('InvalidParameterValue',
+                                       f"The filter '{interface_filter['Name']}' is not supported",
+                                       'DescribeNetworkInterfaces')
+                interface_ids = [i for i in interface_filter['Values'] if i in self.network_interfaces]
+            for interface_id in interface_ids:
+                interface = copy.deepcopy(self.network_interfaces[interface_id])
+                if self.backend.clock() - interface.pop('created_at') < self.backend.provisioning_time:
+                    del interface['Association']
+                described.append(interface)
+        return {'NetworkInterfaces': described}
+
+    @operation('DescribeSubnets')
+    def describe_subnets(self, **kwargs):
+        with self.lock:
+            subnet_ids = kwargs.get('SubnetIds') or list(self.subnets)
+            return {'Subnets': [copy.deepcopy(self.subnets[s]) for s in subnet_ids if s in self.subnets]}
+
+    @operation('CreateSecurityGroup')
+    def create_security_group(self, **kwargs):
+        group_id = f'sg-{uuid.uuid4().hex[:17]}'
+        with self.lock:
+            self.security_groups[group_id] = {
+                'GroupId': group_id, 'GroupName': kwargs['GroupName'], 'Description': kwargs['Description'],
+                'VpcId': kwargs.get('VpcId'), 'IpPermissions': []
+            }
+        return {'GroupId': group_id}
+
+    def security_group(self, group_id, operation_name):
+        if group_id not in self.security_groups:
+            raise client_error('InvalidGroup.NotFound', f"The security group '{group_id}' does not exist",
+                               operation_name)
+        return self.security_groups[group_id]
+
+    @operation('DeleteSecurityGroup')
+    def delete_security_group(self, **kwargs):
+        with self.lock:
+            self.security_group(kwargs['GroupId'], 'DeleteSecurityGroup')
+            del self.security_groups[kwargs['GroupId']]
+        return {}
+
+    @operation('DescribeSecurityGroups')
+    def describe_security_groups(self, **kwargs):
+        with self.lock:
+            return {'SecurityGroups': [
+                copy.deepcopy(self.security_group(g, 'DescribeSecurityGroups')) for g in kwargs.get('GroupIds', [])
+            ]}
+
+    @operation('AuthorizeSecurityGroupIngress')
+    def authorize_security_group_ingress(self, **kwargs):
+        with self.lock:
+            group = self.security_group(kwargs['GroupId'], 'AuthorizeSecurityGroupIngress')
+            for permission in kwargs['IpPermissions']:
+                if permission in group['IpPermissions']:
+                    raise client_error('InvalidPermission.Duplicate', 'the specified rule already exists',
+                                       'AuthorizeSecurityGroupIngress')
+                group['IpPermissions'].append(copy.deepcopy(permission))
+        return {'Return': True}
+
+    @operation('RevokeSecurityGroupIngress')
+    def revoke_security_group_ingress(self, **kwargs):
+        with self.lock:
+            group = self.security_group(kwargs['GroupId'], 'RevokeSecurityGroupIngress')
+            for permission in kwargs['IpPermissions']:
+                if permission not in group['IpPermissions']:
+                    raise client_error('InvalidPermission.NotFound', 'the specified rule does not exist',
+                                       'RevokeSecurityGroupIngress')
+                group['IpPermissions'].remove(permission)
+        return {'Return': True}
+
+
+class LocalRoute53(LocalService):
+
+    service_name = 'route53'
+    MAX_CHANGES = 1000
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.hosted_zones = {}
+        self.changes = {}
+
+    def create_hosted_zone(self, zone_id, name):
+        self.hosted_zones[zone_id] = {'Id': f'/hostedzone/{zone_id}', 'Name': name, 'records': {}}
+
+    def zone(self, zone_id, operation_name):
+        zone_id = zone_id.split('/')[-1]
+        if zone_id not in self.hosted_zones:
+            raise client_error('NoSuchHostedZone', f'No hosted zone found with ID: {zone_id}', operation_name)
+        return self.hosted_zones[zone_id]
+
+    @operation('GetHostedZone')
+    def get_hosted_zone(self, **kwargs):
+        with self.lock:
+            zone = self.zone(kwargs['Id'], 'GetHostedZone')
+            return {'HostedZone': {'Id': zone['Id'], 'Name': zone['Name']}}
+
+    @operation('ChangeResourceRecordSets')
+    def change_resource_record_sets(self, **kwargs):
+        changes = kwargs['ChangeBatch']['Changes']
+        if not changes or len(changes) > self.MAX_CHANGES:
+            raise client_error('InvalidChangeBatch', 'a change batch must contain between 1 and 1000 changes',
+                               'ChangeResourceRecordSets')
+        with self.lock:
+            zone = self.zone(kwargs['HostedZoneId'], 'ChangeResourceRecordSets')
+            records = copy.deepcopy(zone['records'])
+            for change in changes:
+                record = change['ResourceRecordSet']
+                record_key = (record['Name'].rstrip('.'), record['Type'])
+                if change['Action'] == 'CREATE' and record_key in records:
+                    raise client_error('InvalidChangeBatch', f'{record["Name"]} already exists',
+                                       'ChangeResourceRecordSets')
+                if change['Action'] == 'DELETE':
+                    if records.get(record_key) != record:
+                        raise client_error('InvalidChangeBatch', f'{record["Name"]} was not found',
+                                           'ChangeResourceRecordSets')
+                    del records[record_key]
+                else:
+                    records[record_key] = copy.deepcopy(record)
+            zone['records'] = records
+            change_id = f'/change/C{uuid.uuid4().hex[:13].upper()}'
+            self.changes[change_id] = self.backend.clock()
+        return {'ChangeInfo': {'Id': change_id, 'Status': 'PENDING', 'SubmittedAt': time.time()}}
+
+    @operation('GetChange')
+    def get_change(self, **kwargs):
+        change_id = kwargs['Id'] if kwargs['Id'].startswith('/change/') else f'/change/{kwargs["Id"]}'
+        with self.lock:
+            if change_id not in self.changes:
+                raise client_error('NoSuchChange', f'A change with the specified change ID does not exist',
+                                   'GetChange')
+            submitted = self.changes[change_id]
+        status = 'INSYNC' if self.backend.clock() - submitted >= self.backend.dns_sync_time else 'PENDING'
+        return {'ChangeInfo': {'Id': change_id, 'Status': status}}
+
+    @operation('ListResourceRecordSets')
+    def list_resource_record_sets(self, **kwargs):
+        with self.lock:
+            zone = self.zone(kwargs['HostedZoneId'], 'ListResourceRecordSets')
+            return {'ResourceRecordSets': copy.deepcopy(list(zone['records'].values())), 'IsTruncated': False}
+
+
+class LocalLambda(LocalService):
+
+    service_name = 'lambda'
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.invocations = []
+        self.handlers = {}
+
+    def register_handler(self, function_name, handler):
+        """Routes invocations of function_name to handler(payload) so asynchronous work actually runs"""
+        self.handlers[function_name] = handler
+
+    @operation('Invoke')
+    def invoke(self, **kwargs):
+        payload = kwargs.get('Payload', b'{}')
+        if isinstance(payload, (bytes, bytearray)):
+            payload = payload.decode('utf-8')
+        payload = json.loads(payload)
+        function_name = kwargs['FunctionName'].split(':function:')[-1].split(':')[0]
+        invocation_type = kwargs.get('InvocationType', 'RequestResponse')
+        with self.lock:
+            self.invocations.append({'FunctionName': function_name, 'InvocationType': invocation_type,
+                                     'Payload': payload})
+        handler = self.handlers.get(function_name)
+        if invocation_type == 'Event':
+            if handler:
+                self.backend.pending_invocations.append((handler, payload))
+            return {'StatusCode': 202}
+        result = handler(payload) if handler else None
+        return {'StatusCode': 200, 'Payload': StreamingBody(json.dumps(result).encode('utf-8'))}
+
+
+class LocalAWS:
+
+    def __init__(self, region='us-east-1', latency=None, provisioning_time=0.0, dns_sync_time=0.0, clock=None):
+        """
+        A self-contained AWS account. provisioning_time is how long a launched ECS task takes to report RUNNING and
+        for its network interface to receive a public IP; dns_sync_time is how long Route53 changes stay PENDING. Both
+        are measured with clock (time.monotonic by default), so a benchmark can pass a virtual clock that its skipped
+        sleeps advance.
+        """
+        self.region = region
+        self.clock = clock or time.monotonic
+        self.latency = latency or Latency()
+        self.provisioning_time = provisioning_time
+        self.dns_sync_time = dns_sync_time
+        self.injected_errors = {}
+        self.pending_invocations = []
+        self.injected_lock = threading.Lock()
+        self.dynamodb = LocalDynamoDB(self)
+        self.s3 = LocalS3(self)
+        self.ecs = LocalECS(self)
+        self.ec2 = LocalEC2(self)
+        self.route53 = LocalRoute53(self)
+        self.lambda_ = LocalLambda(self)
+        self.services = {
+            'dynamodb': self.dynamodb, 's3': self.s3, 'ecs': self.ecs, 'ec2': self.ec2, 'route53': self.route53,
+            'lambda': self.lambda_
+        }
+
+    def client(self, service, region=None):
+        if service not in self.services:
+            raise ValueError(f'{service} is not available in LocalAWS')
+        return self.services[service]
+
+    def install(self, aws_clients_module):
+        """Makes a function's aws_clients registry hand out these stand-ins instead of boto3 clients"""
+        aws_clients_module.set_client_factory(self.client)
+
+    def fail_next(self, service, operation_name, code, times=1):
+        """Makes the next `times` calls of operation_name raise a ClientError with code (e.g. ThrottlingException)"""
+        with self.injected_lock:
+            self.injected_errors[(service, operation_name)] = (code, times)
+
+    def raise_injected_error(self, service, operation_name):
+        with self.injected_lock:
+            injected = self.injected_errors.get((service, operation_name))
+            if not injected:
+                return
+            code, times = injected
+            if times <= 1:
+                del self.injected_errors[(service, operation_name)]
+            else:
+                self.injected_errors[(service, operation_name)] = (code, times - 1)
+        raise client_error(code, 'injected by LocalAWS', operation_name)
+
+    def run_pending_invocations(self):
+        """Runs queued asynchronous Lambda invocations, including any they queue themselves"""
+        ran = 0
+        while self.pending_invocations:
+            handler, payload = self.pending_invocations.pop(0)
+            handler(payload)
+            ran += 1
+        return ran
+
+    def create_campaign(self, campaign_id):
+        """Creates the tables and workspace bucket that a campaign's functions expect"""
+        self.dynamodb.create_table(f'{campaign_id}-authorizer', 'user_id',
+                                   indexes={f'{campaign_id}-ApiKeyIndex': ('api_key', None)})
+        self.dynamodb.create_table(f'{campaign_id}-tasks', 'task_name')
+        self.dynamodb.create_table(f'{campaign_id}-queue', 'task_name', 'run_time')
+        self.dynamodb.create_table(f'{campaign_id}-portgroups', 'portgroup_name')
+        self.dynamodb.create_table(f'{campaign_id}-domains', 'domain_name')
+        self.dynamodb.create_table(f'{campaign_id}-task-types', 'task_type')
+        self.dynamodb.create_table(f'{campaign_id}-schedules', 'schedule_id')
+        self.s3.create_bucket(f'{campaign_id}-workspace')
@@ -1,5 +1,5 @@
 import json
-import boto3
+import aws_clients
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -36,14 +36,14 @@ class Domain:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_route53_client(self):
         """Returns the boto3 Route53 session (establishes one automatically if one does not already exist)"""
         if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53', region_name=self.region)
+            self.__aws_route53_client = aws_clients.get_client('route53', self.region)
         return self.__aws_route53_client
 
     def query_domains(self):
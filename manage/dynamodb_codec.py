@@ -0,0 +1,152 @@
+import math
+import base64
+from decimal import Decimal
+
+
+def marshal_string_set(value):
+    return {'SS': list(value)}
+
+
+def marshal_number_set(value):
+    return {'NS': [marshal_number(v)['N'] for v in value]}
+
+
+def marshal_binary_set(value):
+    return {'BS': [bytes(v) for v in value]}
+
+
+def marshal_number(value):
+    if isinstance(value, Decimal):
+        finite = value.is_finite()
+    else:
+        finite = not isinstance(value, float) or math.isfinite(value)
+    if not finite:
+        raise ValueError(f'{value} cannot be stored as a DynamoDB number')
+    return {'N': repr(value) if isinstance(value, float) else str(value)}
+
+
+def marshal_set(value):
+    if not value:
+        raise ValueError('empty sets cannot be stored in DynamoDB')
+    # Numbers of different Python types are all DynamoDB numbers, so int, float and Decimal share a number set
+    element_types = {SET_ELEMENT_TYPES.get(type(v)) for v in value}
+    if len(element_types) != 1 or None in element_types:
+        raise TypeError('sets must contain only str, int, float, Decimal or bytes values of a single type')
+    return SET_MARSHALLERS[element_types.pop()](value)
+
+
+MARSHALLERS = {
+    str: lambda v: {'S': v},
+    bool: lambda v: {'BOOL': v},
+    int: marshal_number,
+    float: marshal_number,
+    Decimal: marshal_number,
+    type(None): lambda v: {'NULL': True},
+    bytes: lambda v: {'B': v},
+    bytearray: lambda v: {'B': bytes(v)},
+    dict: lambda v: {'M': marshal_map(v)},
+    list: lambda v: {'L': [marshal(i) for i in v]},
+    tuple: lambda v: {'L': [marshal(i) for i in v]},
+    set: marshal_set,
+    frozenset: marshal_set
+}
+
+SET_ELEMENT_TYPES = {
+    str: 'SS',
+    int: 'NS',
+    float: 'NS',
+    Decimal: 'NS',
+    bytes: 'BS'
+}
+
+SET_MARSHALLERS = {
+    'SS': marshal_string_set,
+    'NS': marshal_number_set,
+    'BS': marshal_binary_set
+}
+
+
+def unmarshal_number(value):
+    if '.' in value or 'e' in value or 'E' in value:
+        return float(value)
+    return int(value)
+
+
+UNMARSHALLERS = {
+    'S': lambda v: v,
+    'N': unmarshal_number,
+    'BOOL': lambda v: v,
+    'NULL': lambda v: None,
+    'B': lambda v: v,
+    'M': lambda v: unmarshal_map(v),
+    'L': lambda v: [unmarshal(i) for i in v],
+    'SS': lambda v: set(v),
+    'NS': lambda v: {unmarshal_number(i) for i in v},
+    'BS': lambda v: set(v)
+}
+
+
+def marshal(value):
+    """Converts a Python value to a DynamoDB attribute value"""
+    marshaller = MARSHALLERS.get(type(value))
+    if marshaller is None:
+        for value_type in type(value).__mro__[1:]:
+            marshaller = MARSHALLERS.get(value_type)
+            if marshaller is not None:
+                break
+        else:
+            raise TypeError(f'{type(value).__name__} values cannot be stored in DynamoDB')
+    return marshaller(value)
+
+
+def unmarshal(attribute):
+    """Converts a DynamoDB attribute value to a Python value"""
+    # The common scalar types are tested first; everything else goes through the dispatch table
+    if 'S' in attribute:
+        return attribute['S']
+    if 'N' in attribute:
+        return unmarshal_number(attribute['N'])
+    if 'BOOL' in attribute:
+        return attribute['BOOL']
+    (tag, value), = attribute.items()
+    return UNMARSHALLERS[tag](value)
+
+
+def marshal_map(values: dict):
+    """Converts a dict to the contents of a DynamoDB M attribute value"""
+    attributes = {}
+    for k, v in values.items():
+        if type(v) is str:
+            attributes[k] = {'S': v}
+        else:
+            attributes[k] = marshal(v)
+    return attributes
+
+
+def unmarshal_map(attributes: dict):
+    """Converts the contents of a DynamoDB M attribute value to a dict"""
+    values = {}
+    for k, attribute in attributes.items():
+        if 'S' in attribute:
+            values[k] = attribute['S']
+        elif 'N' in attribute:
+            values[k] = unmarshal_number(attribute['N'])
+        elif 'BOOL' in attribute:
+            values[k] = attribute['BOOL']
+        else:
+            (tag, value), = attribute.items()
+            values[k] = UNMARSHALLERS[tag](value)
+    return values
+
+
+def to_json(value):
+    """Returns an unmarshalled value with its sets as sorted lists and its bytes as base64 strings, for json.dumps"""
+    if isinstance(value, dict):
+        return {k: to_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_json(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(to_json(v) for v in value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('ascii')
+    return value
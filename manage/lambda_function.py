@@ -3,6 +3,7 @@ import re
 import json
 import domains
 import portgroups
+import sessions
 import task_type
 import tasks
 import users
@@ -23,13 +24,14 @@ def format_response(status_code, result, message, log, **kwargs):
     return {'statusCode': status_code, 'body': json.dumps(response)}
 
 
-def action(resource, command, region, campaign_id, user_id, detail, log):
+def action(resource, command, region, campaign_id, user_id, detail, log, authorizer):
     resources = {
         'domain': domains.Domain(campaign_id, region, user_id, detail, log),
         'portgroup': portgroups.Portgroup(campaign_id, region, user_id, detail, log),
+        'session': sessions.Session(campaign_id, region, user_id, detail, log, authorizer),
         'task_type': task_type.Registration(campaign_id, region, user_id, detail, log),
         'task': tasks.Tasks(campaign_id, region, user_id, detail, log),
-        'user': users.Users(campaign_id, region, user_id, detail, log),
+        'user': users.Users(campaign_id, region, user_id, detail, log, authorizer.get('admin')),
         'workspace': workspace.Workspace(campaign_id, region, user_id, detail, log),
     }
     r = resources[resource]
@@ -47,7 +49,8 @@ def action(resource, command, region, campaign_id, user_id, detail, log):
 
 def lambda_handler(event, context):
     region = re.search('arn:aws:lambda:([^:]+):.*', context.invoked_function_arn).group(1)
-    user_id = event['requestContext']['authorizer']['user_id']
+    authorizer = event['requestContext']['authorizer']
+    user_id = authorizer['user_id']
     campaign_id = os.environ['CAMPAIGN_ID']
     log = {'event': event}
 
@@ -64,7 +67,7 @@ def lambda_handler(event, context):
         return format_response(400, 'failed', 'missing resource', log)
     resource = data['resource']
 
-    allowed_resources = ['domain', 'portgroup', 'task_type', 'task', 'user', 'workspace']
+    allowed_resources = ['domain', 'portgroup', 'session', 'task_type', 'task', 'user', 'workspace']
     if resource not in allowed_resources:
         return format_response(400, 'failed', 'invalid resource', log)
 
@@ -73,5 +76,5 @@ def lambda_handler(event, context):
     else:
         detail = {}
 
-    response = action(resource, command, region, campaign_id, user_id, detail, log)
+    response = action(resource, command, region, campaign_id, user_id, detail, log, authorizer)
     return response
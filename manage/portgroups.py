@@ -1,6 +1,6 @@
 import os
 import json
-import boto3
+import aws_clients
 import botocore
 import time as t
 from datetime import datetime
@@ -40,14 +40,14 @@ class Portgroup:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ec2_client(self):
         """Returns the boto3 EC2 session (establishes one automatically if one does not already exist)"""
         if self.__aws_ec2_client is None:
-            self.__aws_ec2_client = boto3.client('ec2', region_name=self.region)
+            self.__aws_ec2_client = aws_clients.get_client('ec2', self.region)
         return self.__aws_ec2_client
 
     def query_portgroups(self):
@@ -215,10 +215,11 @@ class Portgroup:
         if 'Item' not in portgroup_entry:
             return format_response(404, 'failed', f'portgroup {self.portgroup_name} does not exist', self.log)
         securitygroup_id = portgroup_entry['Item']['securitygroup_id']['S']
-        tasks = portgroup_entry['Item']['tasks']['SS']
+        # Members are added and removed in place, so the set can hold the 'None' placeholder or be gone entirely
+        tasks = [task for task in portgroup_entry['Item'].get('tasks', {'SS': []})['SS'] if task != 'None']
 
         # Verify that portgroup is not associated with active tasks
-        if 'None' not in tasks:
+        if tasks:
             return format_response(409, 'failed', 'cannot delete portgroup that is assigned to active tasks', self.log)
 
         # Delete security group
@@ -241,7 +242,9 @@ class Portgroup:
 
         securitygroup_id = portgroup_entry['Item']['securitygroup_id']['S']
         portgroup_description = portgroup_entry['Item']['portgroup_description']['S']
-        associated_tasks = portgroup_entry['Item']['tasks']['SS']
+        associated_tasks = [task for task in portgroup_entry['Item'].get('tasks', {'SS': []})['SS'] if task != 'None']
+        if not associated_tasks:
+            associated_tasks = ['None']
         portgroup_creator_id = portgroup_entry['Item']['user_id']['S']
         create_time = portgroup_entry['Item']['create_time']['S']
         portgroup_rules = []
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import hmac
+import aws_clients
+import base64
+import hashlib
+from users import revoke_sessions
+
+# Shared with the authorizer, which verifies the tokens issued here
+SESSION_TOKEN_KEY = os.environ.get('SESSION_TOKEN_KEY')
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', 900))
+SESSION_TOKEN_MAX_TTL = int(os.environ.get('SESSION_TOKEN_MAX_TTL', 3600))
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+def encode_segment(segment: bytes):
+    return base64.urlsafe_b64encode(segment).decode('utf-8').rstrip('=')
+
+
+class Session:
+
+    def __init__(self, campaign_id, region, user_id, detail: dict, log, authorizer: dict):
+        """
+        Issue and revoke short-lived session tokens that the authorizer verifies without a DynamoDB lookup
+        """
+        self.region = region
+        self.campaign_id = campaign_id
+        self.user_id = user_id
+        self.detail = detail
+        self.log = log
+        self.api_key = authorizer.get('api_key')
+        self.admin = authorizer.get('admin', 'no')
+        # Only a request the authorizer verified by its signature may create a session token
+        self.auth_type = authorizer.get('auth_type')
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    def issue_token(self, issued_at, expires_at):
+        claims = {
+            'user_id': self.user_id, 'api_key': self.api_key, 'admin': self.admin, 'iat': issued_at, 'exp': expires_at
+        }
+        payload = encode_segment(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        signature = encode_segment(
+            hmac.new(SESSION_TOKEN_KEY.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+        )
+        return f'{payload}.{signature}'
+
+    def create(self):
+        if not SESSION_TOKEN_KEY:
+            return format_response(405, 'failed', 'session tokens are not enabled', self.log)
+        if self.auth_type != 'signature':
+            return format_response(403, 'failed', 'session tokens must be requested with a signed request', self.log)
+        session_ttl = SESSION_TOKEN_TTL
+        if 'session_ttl' in self.detail:
+            try:
+                session_ttl = int(self.detail['session_ttl'])
+            except (ValueError, TypeError):
+                return format_response(400, 'failed', 'invalid detail: session_ttl must be a number', self.log)
+            if session_ttl <= 0 or session_ttl > SESSION_TOKEN_MAX_TTL:
+                return format_response(
+                    400, 'failed', f'invalid detail: session_ttl must be between 1 and {SESSION_TOKEN_MAX_TTL}',
+                    self.log
+                )
+        issued_at = int(time.time())
+        expires_at = issued_at + session_ttl
+        session_token = self.issue_token(issued_at, expires_at)
+        return format_response(
+            200, 'success', 'create session succeeded', None, session_token=session_token, expires=str(expires_at)
+        )
+
+    def delete(self):
+        revoke_sessions(self.aws_dynamodb_client, self.campaign_id, self.user_id)
+        return format_response(200, 'success', 'delete session succeeded', self.log)
+
+    def get(self):
+        return format_response(405, 'failed', 'command not accepted for this resource', self.log)
+
+    def kill(self):
+        return format_response(405, 'failed', 'command not accepted for this resource', self.log)
+
+    def list(self):
+        return format_response(405, 'failed', 'command not accepted for this resource', self.log)
+
+    def update(self):
+        return format_response(405, 'failed', 'command not accepted for this resource', self.log)
@@ -1,5 +1,13 @@
+import os
 import json
-import boto3
+import aws_clients
+
+
+# Item in the task-types table whose task_types_version attribute is incremented whenever a task_type is created, updated
+# or deleted; task_control and remote_task drop their cached task_type entries when it changes.
+TASK_TYPES_VERSION_ID = '__task_types_version__'
+# Function that keeps the standby pools filled; the pools fill on the first execute of the task_type if it is unset
+TASK_CONTROL_FUNCTION = os.environ.get('TASK_CONTROL_FUNCTION')
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -32,23 +40,32 @@ class Registration:
         self.capabilities = None
         self.cpu = None
         self.memory = None
+        self.standby_pool_size = '0'
         self.__aws_dynamodb_client = None
         self.__aws_ecs_client = None
+        self.__aws_lambda_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = aws_clients.get_client('ecs', self.region)
         return self.__aws_ecs_client
 
+    @property
+    def aws_lambda_client(self):
+        """Returns the boto3 Lambda session (establishes one automatically if one does not already exist)"""
+        if self.__aws_lambda_client is None:
+            self.__aws_lambda_client = aws_clients.get_client('lambda', self.region)
+        return self.__aws_lambda_client
+
     def query_task_types(self):
         task_types = {'Items': []}
         scan_kwargs = {'TableName': f'{self.campaign_id}-task-types'}
@@ -59,12 +76,15 @@ class Registration:
                 scan_kwargs['ExclusiveStartKey'] = start_key
             response = self.aws_dynamodb_client.scan(**scan_kwargs)
             for item in response['Items']:
-                task_types['Items'].append(item)
+                if item['task_type']['S'] != TASK_TYPES_VERSION_ID:
+                    task_types['Items'].append(item)
             start_key = response.get('LastEvaluatedKey', None)
             done = start_key is None
         return task_types
 
     def get_task_type_entry(self):
+        if self.task_type == TASK_TYPES_VERSION_ID:
+            return {}
         return self.aws_dynamodb_client.get_item(
             TableName=f'{self.campaign_id}-task-types',
             Key={
@@ -80,7 +100,7 @@ class Registration:
             },
             UpdateExpression='set task_type=:task_type, source_image=:source_image, created_by=:created_by, '
                              'task_definition_arn=:task_definition_arn, capabilities=:capabilities, cpu=:cpu, '
-                             'memory=:memory',
+                             'memory=:memory, standby_pool_size=:standby_pool_size',
             ExpressionAttributeValues={
                 ':task_type': {'S': self.task_type},
                 ':source_image': {'S': self.source_image},
@@ -88,12 +108,73 @@ class Registration:
                 ':task_definition_arn': {'S': task_definition_arn},
                 ':capabilities': {'SS': self.capabilities},
                 ':cpu': {'N': self.cpu},
-                ':memory': {'N': self.memory}
+                ':memory': {'N': self.memory},
+                ':standby_pool_size': {'N': self.standby_pool_size}
             }
         )
         assert response, f"add_task_type_entry failed for task_type {self.task_type}"
         return True
 
+    def bump_task_types_version(self):
+        response = self.aws_dynamodb_client.update_item(
+            TableName=f'{self.campaign_id}-task-types',
+            Key={
+                'task_type': {'S': TASK_TYPES_VERSION_ID}
+            },
+            UpdateExpression='add task_types_version :one',
+            ExpressionAttributeValues={
+                ':one': {'N': '1'}
+            }
+        )
+        assert response, f"bump_task_types_version failed for task_type {self.task_type}"
+        return True
+
+    def update_standby_pool_size(self):
+        response = self.aws_dynamodb_client.update_item(
+            TableName=f'{self.campaign_id}-task-types',
+            Key={
+                'task_type': {'S': self.task_type}
+            },
+            UpdateExpression='set standby_pool_size=:standby_pool_size',
+            ExpressionAttributeValues={
+                ':standby_pool_size': {'N': self.standby_pool_size}
+            }
+        )
+        assert response, f"update_standby_pool_size failed for task_type {self.task_type}"
+        return True
+
+    def invoke_replenish(self):
+        """Asks task_control to bring the standby pool to its new size"""
+        if not TASK_CONTROL_FUNCTION:
+            return False
+        response = self.aws_lambda_client.invoke(
+            FunctionName=TASK_CONTROL_FUNCTION,
+            InvocationType='Event',
+            Payload=json.dumps({'replenish_pool': {'task_type': self.task_type}}).encode('utf-8')
+        )
+        assert response, f"invoke_replenish failed for task_type {self.task_type}"
+        return True
+
+    def stop_standby_tasks(self, task_type_entry):
+        for standby_name, standby_task in task_type_entry['Item'].get('standby_tasks', {}).get('M', {}).items():
+            response = self.aws_ecs_client.stop_task(
+                cluster=f'{self.campaign_id}-cluster',
+                task=standby_task['M']['ecs_task_id']['S'],
+                reason=f'task_type {self.task_type} was deleted'
+            )
+            assert response, f"stop_standby_tasks failed for task_type {self.task_type}, standby task {standby_name}"
+        return True
+
+    def parse_standby_pool_size(self):
+        """Reads the optional standby_pool_size from detail, returning an error response if it is invalid"""
+        standby_pool_size = self.detail.get('standby_pool_size', 0)
+        if not str(standby_pool_size).isdigit() or int(standby_pool_size) > 25:
+            return format_response(
+                400, 'failed', 'invalid detail: standby_pool_size must be a whole number from 0 to 25', self.log
+            )
+        self.standby_pool_size = str(int(standby_pool_size))
+        return None
+
     def remove_task_type_entry(self):
         response = self.aws_dynamodb_client.delete_item(
             TableName=f'{self.campaign_id}-task-types',
@@ -161,10 +242,15 @@ class Registration:
             if i not in self.detail:
                 return format_response(400, 'failed', 'invalid detail', self.log)
         self.task_type = self.detail['task_type']
+        if self.task_type == TASK_TYPES_VERSION_ID:
+            return format_response(400, 'failed', f'invalid task_type {self.task_type}', self.log)
         self.source_image = self.detail['source_image']
         self.capabilities = self.detail['capabilities']
         self.cpu = self.detail['cpu']
         self.memory = self.detail['memory']
+        invalid = self.parse_standby_pool_size()
+        if invalid:
+            return invalid
 
         # Verify that the task_type is unique
         conflict = self.get_task_type_entry()
@@ -178,6 +264,9 @@ class Registration:
         else:
             return format_response(500, 'failed', f'create task_type failed for {self.task_type}', None)
         self.add_task_type_entry(task_definition_arn)
+        self.bump_task_types_version()
+        if self.standby_pool_size != '0':
+            self.invoke_replenish()
 
         # Send response
         return format_response(200, 'success', 'create task_type succeeded', None)
@@ -198,6 +287,8 @@ class Registration:
         if not remove_ecs_task:
             return format_response(500, 'failed', f'delete task_type failed for {self.task_type}', None)
         self.remove_task_type_entry()
+        self.bump_task_types_version()
+        self.stop_standby_tasks(exists)
 
         # Send response
         return format_response(200, 'success', 'delete task_type succeeded', None)
@@ -213,11 +304,14 @@ class Registration:
         created_by = task_type_entry['Item']['created_by']['S']
         cpu = task_type_entry['Item']['cpu']['N']
         memory = task_type_entry['Item']['memory']['N']
+        standby_pool_size = task_type_entry['Item'].get('standby_pool_size', {'N': '0'})['N']
+        standby_tasks = str(len(task_type_entry['Item'].get('standby_tasks', {}).get('M', {})))
 
         # Send response
         return format_response(
             200, 'success', 'get task_type succeeded', None, task_type=task_type,
-            capabilities=capabilities, source_image=source_image, created_by=created_by, cpu=cpu, memory=memory
+            capabilities=capabilities, source_image=source_image, created_by=created_by, cpu=cpu, memory=memory,
+            standby_pool_size=standby_pool_size, standby_tasks=standby_tasks
         )
 
     def list(self):
@@ -234,6 +328,24 @@ class Registration:
         return format_response(405, 'failed', 'command not accepted for this resource', self.log)
 
     def update(self):
-        return format_response(405, 'failed', 'command not accepted for this resource', self.log)
+        if 'task_type' not in self.detail or 'standby_pool_size' not in self.detail:
+            return format_response(400, 'failed', 'invalid detail', self.log)
+        self.task_type = self.detail['task_type']
+        invalid = self.parse_standby_pool_size()
+        if invalid:
+            return invalid
+
+        # Verify that the task_type exists
+        exists = self.get_task_type_entry()
+        if 'Item' not in exists:
+            return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
+
+        # The replenish job launches or reaps standby tasks to match the new size
+        self.update_standby_pool_size()
+        self.bump_task_types_version()
+        self.invoke_replenish()
+
+        # Send response
+        return format_response(200, 'success', 'update task_type succeeded', None)
 
 
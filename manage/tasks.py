@@ -1,5 +1,8 @@
 import json
-import boto3
+import aws_clients
+import dns_changes
+import dynamodb_codec
+from botocore.exceptions import ClientError
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -27,29 +30,21 @@ class Tasks:
         self.task_name = None
         self.__aws_dynamodb_client = None
         self.__aws_ecs_client = None
-        self.__aws_route53_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = aws_clients.get_client('ecs', self.region)
         return self.__aws_ecs_client
 
-    @property
-    def aws_route53_client(self):
-        """Returns the boto3 Route53 session (establishes one automatically if one does not already exist)"""
-        if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53', region_name=self.region)
-        return self.__aws_route53_client
-
     def get_domain_entry(self, domain_name):
         return self.aws_dynamodb_client.get_item(
             TableName=f'{self.campaign_id}-domains',
@@ -74,49 +69,29 @@ class Tasks:
         return True
 
     def delete_resource_record_set(self, hosted_zone, host_name, domain_name, ip_address):
-        response = self.aws_route53_client.change_resource_record_sets(
-            HostedZoneId=hosted_zone,
-            ChangeBatch={
-                'Changes': [
-                    {
-                        'Action': 'DELETE',
-                        'ResourceRecordSet': {
-                            'Name': f'{host_name}.{domain_name}',
-                            'Type': 'A',
-                            'TTL': 300,
-                            'ResourceRecords': [
-                                {
-                                    'Value': ip_address
-                                }
-                            ]
-                        }
-                    }
-                ]
-            }
-        )
-        if response:
-            return True
-
-    def get_portgroup_entry(self, portgroup_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            }
+        """Deletes the task's A record through the shared change coalescer; returns its change id and status"""
+        change, = dns_changes.coalescer.change(
+            hosted_zone, [dns_changes.a_record_change('DELETE', f'{host_name}.{domain_name}', ip_address)]
         )
-
-    def update_portgroup_entry(self, portgroup_name, portgroup_tasks):
-        response = self.aws_dynamodb_client.update_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            },
-            UpdateExpression='set tasks=:tasks',
-            ExpressionAttributeValues={
-                ':tasks': {'SS': portgroup_tasks}
-            }
-        )
-        assert response, f"update_portgroup_entry failed for portgroup_name {portgroup_name}"
+        return change
+
+    def remove_portgroup_task(self, portgroup_name):
+        """Removes the task from a portgroup's task set in place, leaving other members untouched"""
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-portgroups',
+                Key={
+                    'portgroup_name': {'S': portgroup_name}
+                },
+                UpdateExpression='delete tasks :task_name',
+                ConditionExpression='attribute_exists(portgroup_name)',
+                ExpressionAttributeValues={
+                    ':task_name': {'SS': [self.task_name]}
+                }
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
         return True
 
     def query_tasks(self):
@@ -197,17 +172,9 @@ class Tasks:
         last_instruct_user_id = task_item['last_instruct_user_id']['S']
         last_instruct_instance = task_item['last_instruct_instance']['S']
         last_instruct_command = task_item['last_instruct_command']['S']
-        last_instruct_args = task_item['last_instruct_args']['M']
-        last_instruct_args_fixup = {}
-        for key, value in last_instruct_args.items():
-            if 'S' in value:
-                last_instruct_args_fixup[key] = value['S']
-            if 'N' in value:
-                last_instruct_args_fixup[key] = value['N']
-            if 'BOOL' in value:
-                last_instruct_args_fixup[key] = value['BOOL']
-            if 'B' in value:
-                last_instruct_args_fixup[key] = value['B']
+        last_instruct_args_fixup = dynamodb_codec.to_json(
+            dynamodb_codec.unmarshal_map(task_item['last_instruct_args']['M'])
+        )
         last_instruct_time = task_item['last_instruct_time']['S']
         task_creator_user_id = task_item['user_id']['S']
         create_time = task_item['create_time']['S']
@@ -242,12 +209,7 @@ class Tasks:
             portgroups = task_entry['Item']['portgroups']['SS']
             for portgroup in portgroups:
                 if portgroup != 'None':
-                    portgroup_entry = self.get_portgroup_entry(portgroup)
-                    tasks = portgroup_entry['Item']['tasks']['SS']
-                    tasks.remove(self.task_name)
-                    if not tasks:
-                        tasks.append('None')
-                    self.update_portgroup_entry(portgroup, tasks)
+                    self.remove_portgroup_task(portgroup)
             self.stop_ecs_task(ecs_task_id)
             if task_entry['Item']['task_domain_name']['S'] != 'None':
                 task_attack_ip = task_entry['Item']['attack_ip']['S']
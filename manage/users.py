@@ -1,7 +1,13 @@
 import json
-import boto3
+import aws_clients
+import time
 import string, random
 
+# Reserved authorizer table item holding the counter the authorizer polls to invalidate its credential cache
+CREDENTIALS_VERSION_ID = '__credentials_version__'
+# Prefix of the per-user attributes on that item recording when the user's session tokens were last revoked
+SESSION_REVOKED_PREFIX = 'session_revoked_'
+
 
 def format_response(status_code, result, message, log, **kwargs):
     response = {'outcome': result}
@@ -27,15 +33,37 @@ def generate_string(length, punctuation=False):
     return rand_string
 
 
+def revoke_sessions(dynamodb_client, campaign_id, user_id):
+    """
+    Revokes all session tokens issued to user_id so far and bumps the credentials version so that warm authorizers
+    drop their cached credentials
+    """
+    response = dynamodb_client.update_item(
+        TableName=f'{campaign_id}-authorizer',
+        Key={
+            'user_id': {'S': CREDENTIALS_VERSION_ID}
+        },
+        UpdateExpression='set #revoked = :now add credentials_version :one',
+        ExpressionAttributeNames={'#revoked': f'{SESSION_REVOKED_PREFIX}{user_id}'},
+        ExpressionAttributeValues={
+            ':now': {'N': str(int(time.time()))},
+            ':one': {'N': '1'}
+        }
+    )
+    assert response, f"revoke_sessions failed for {user_id}"
+
+
 class Users:
 
-    def __init__(self, campaign_id, region, user_id, detail: dict, log):
+    def __init__(self, campaign_id, region, user_id, detail: dict, log, admin=None):
         """
-        Create, update and delete users
+        Create, update and delete users. admin is the calling user's admin flag as reported by the authorizer; it is
+        looked up in the authorizer table only when the authorizer did not supply it.
         """
         self.region = region
         self.campaign_id = campaign_id
         self.user_id = user_id
+        self.admin = admin
         self.detail = detail
         self.log = log
         self.manage_user_id = None
@@ -45,7 +73,7 @@ class Users:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def query_api_keys(self, api_key):
@@ -73,13 +101,16 @@ class Users:
                 scan_kwargs['ExclusiveStartKey'] = start_key
             response = self.aws_dynamodb_client.scan(**scan_kwargs)
             for item in response['Items']:
-                users['Items'].append(item)
+                if item['user_id']['S'] != CREDENTIALS_VERSION_ID:
+                    users['Items'].append(item)
             start_key = response.get('LastEvaluatedKey', None)
             done = start_key is None
         return users
 
     def get_user_details(self, user_id):
         """Returns details of a user"""
+        if user_id == CREDENTIALS_VERSION_ID:
+            return {}
         response = self.aws_dynamodb_client.get_item(
             TableName=f'{self.campaign_id}-authorizer',
             Key={
@@ -89,6 +120,13 @@ class Users:
         if response:
             return response
 
+    def calling_user_is_admin(self):
+        """Returns True if the calling user is an admin"""
+        if self.admin is None:
+            calling_user = self.get_user_details(self.user_id)
+            self.admin = calling_user['Item']['admin']['S']
+        return self.admin == 'yes'
+
     def add_user_attribute(self, attributes):
         """Add details to user, create the user if it does not exist"""
         for k, v in attributes.items():
@@ -102,6 +140,22 @@ class Users:
             )
             assert response, f"add_user_attribute failed for {self.manage_user_id}"
 
+    def bump_credentials_version(self):
+        """Signals warm authorizer containers to drop their cached credentials"""
+        response = self.aws_dynamodb_client.update_item(
+            TableName=f'{self.campaign_id}-authorizer',
+            Key={
+                'user_id': {'S': CREDENTIALS_VERSION_ID}
+            },
+            UpdateExpression='add credentials_version :one',
+            ExpressionAttributeValues={':one': {'N': '1'}}
+        )
+        assert response, f"bump_credentials_version failed for {self.manage_user_id}"
+
+    def revoke_sessions(self):
+        """Revokes all session tokens issued to the managed user so far and invalidates cached credentials"""
+        revoke_sessions(self.aws_dynamodb_client, self.campaign_id, self.manage_user_id)
+
     def delete_user_id(self):
         """Deletes a user"""
         response = self.aws_dynamodb_client.delete_item(
@@ -113,11 +167,10 @@ class Users:
         assert response, f'delete_user_id for {self.manage_user_id} failed'
 
     def create(self):
-        calling_user = self.get_user_details(self.user_id)
-        if calling_user['Item']['admin']['S'] != 'yes':
+        if not self.calling_user_is_admin():
             response = format_response(403, 'failed', 'not allowed', self.log)
             return response
-        if 'user_id' in self.detail:
+        if 'user_id' in self.detail and self.detail['user_id'] != CREDENTIALS_VERSION_ID:
             self.manage_user_id = self.detail['user_id']
         else:
             response = format_response(400, 'failed', 'invalid detail', self.log)
@@ -140,6 +193,7 @@ class Users:
             admin = 'no'
         user_attributes = {'api_key': api_key, 'secret': secret, 'admin': admin}
         self.add_user_attribute(user_attributes)
+        self.bump_credentials_version()
         response = format_response(
             200, 'success', 'create user succeeded', self.log, user_id=self.manage_user_id, api_key=api_key,
             secret=secret, admin=admin
@@ -147,8 +201,7 @@ class Users:
         return response
 
     def delete(self):
-        calling_user = self.get_user_details(self.user_id)
-        if calling_user['Item']['admin']['S'] != 'yes':
+        if not self.calling_user_is_admin():
             response = format_response(403, 'failed', 'not allowed', self.log)
             return response
         self.manage_user_id = self.detail['user_id']
@@ -160,12 +213,12 @@ class Users:
             response = format_response(404, 'failed', f'user_id {self.manage_user_id} does not exist', self.log)
             return response
         self.delete_user_id()
+        self.revoke_sessions()
         response = format_response(200, 'success', 'delete user succeeded', self.log)
         return response
 
     def get(self):
-        calling_user = self.get_user_details(self.user_id)
-        if calling_user['Item']['admin']['S'] != 'yes':
+        if not self.calling_user_is_admin():
             response = format_response(403, 'failed', 'not allowed', self.log)
             return response
         if 'user_id' not in self.detail:
@@ -195,8 +248,7 @@ class Users:
         if 'user_id' not in self.detail:
             return format_response(400, 'failed', 'invalid detail - missing user_id', self.log)
         self.manage_user_id = self.detail['user_id']
-        calling_user = self.get_user_details(self.user_id)
-        if calling_user['Item']['admin']['S'] != 'yes':
+        if not self.calling_user_is_admin():
             if 'reset_keys' in self.detail and self.detail['reset_keys'].lower() == 'yes' and self.user_id == self.manage_user_id:
                 user_attributes = {}
                 api_key = None
@@ -210,6 +262,7 @@ class Users:
                 user_attributes['api_key'] = api_key
                 user_attributes['secret'] = secret
                 self.add_user_attribute(user_attributes)
+                self.revoke_sessions()
                 response = format_response(
                     200, 'success', 'update user succeeded', self.log, user_id=self.manage_user_id, api_key=api_key,
                     secret=secret
@@ -251,6 +304,7 @@ class Users:
             response = format_response(400, 'failed', 'invalid detail', self.log)
             return response
         self.add_user_attribute(user_attributes)
+        self.revoke_sessions()
         response = format_response(
             200, 'success', 'update user succeeded', self.log, user_id=new_user_id, api_key=api_key, secret=secret,
             admin=admin
@@ -1,7 +1,7 @@
 import re
 import sys
 import json
-import boto3
+import aws_clients
 import base64
 
 
@@ -36,14 +36,14 @@ class Workspace:
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = aws_clients.get_client('s3', self.region)
         return self.__aws_s3_client
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def upload_object(self):
@@ -1,6 +1,6 @@
 import re
 import json
-import boto3
+import aws_clients
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -32,14 +32,14 @@ class Retrieve:
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = aws_clients.get_client('s3', self.region)
         return self.__aws_s3_client
 
     @property
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def get_task_entry(self):
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import uuid
+import aws_clients
+import dynamodb_codec
+import instruction_queue
+from botocore.exceptions import ClientError
+
+MAX_PIPELINE_STEPS = int(os.environ.get('MAX_PIPELINE_STEPS', 10))
+# Largest step output kept for later steps to bind to. Outputs are stored on the task entry, which DynamoDB limits to
+# 400 KB, so a pipeline whose output is larger fails instead of the delivery that records it
+MAX_PIPELINE_OUTPUT_BYTES = int(os.environ.get('MAX_PIPELINE_OUTPUT_BYTES', 16384))
+# {{step.N.path}} in an instruct_args value is replaced with the value at path in the output of step N; path is a
+# dot separated list of keys and list indexes. A value that is exactly one binding takes the output value as is.
+BINDING = re.compile(r'\{\{step\.(\d+)((?:\.[^.{}]+)*)\}\}')
+
+
+def bindings(value):
+    """Yields (step, path) for every binding in an instruct_args value"""
+    if isinstance(value, str):
+        for match in BINDING.finditer(value):
+            yield int(match.group(1)), match.group(2).split('.')[1:]
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from bindings(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from bindings(v)
+
+
+def referenced_steps(steps):
+    return {step for s in steps for step, _ in bindings(s.get('instruct_args', {}))}
+
+
+def lookup(output, path):
+    for key in path:
+        if isinstance(output, list):
+            output = output[int(key)]
+        else:
+            output = output[key]
+    return output
+
+
+def resolve(value, outputs):
+    """Returns value with its bindings replaced from outputs; raises LookupError if a bound path is missing"""
+    if isinstance(value, str):
+        match = BINDING.fullmatch(value)
+        if match:
+            return lookup(outputs[int(match.group(1))], match.group(2).split('.')[1:])
+        return BINDING.sub(
+            lambda m: str(lookup(outputs[int(m.group(1))], m.group(2).split('.')[1:])), value
+        )
+    if isinstance(value, dict):
+        return {k: resolve(v, outputs) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, outputs) for v in value]
+    return value
+
+
+class Pipeline:
+
+    def __init__(self, campaign_id, task_name, region):
+        """
+        Ordered instructions run on one task without client round trips. The pipeline is kept in the pipeline
+        attribute of the task entry and the task's running_pipeline_step says which step is in flight; each step is
+        sent through the task's InstructionQueue, and result delivery advances the pipeline when a step's result lands.
+        """
+        self.campaign_id = campaign_id
+        self.task_name = task_name
+        self.region = region
+        self.queue = instruction_queue.InstructionQueue(campaign_id, task_name, region)
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    @staticmethod
+    def validate(steps, capabilities):
+        """Returns an error message for an invalid pipeline definition, or None"""
+        if not isinstance(steps, list) or not steps:
+            return 'pipeline must be a non-empty list of instructions'
+        if len(steps) > MAX_PIPELINE_STEPS:
+            return f'pipeline is limited to {MAX_PIPELINE_STEPS} steps'
+        for i, step in enumerate(steps):
+            if not isinstance(step, dict) or not step.get('instruct_command'):
+                return f'pipeline step {i} must contain instruct_command'
+            if step['instruct_command'] not in capabilities:
+                return f'pipeline step {i}: {step["instruct_command"]} not valid for this task'
+            if step['instruct_command'] == 'terminate' and i != len(steps) - 1:
+                return 'terminate can only be the last pipeline step'
+            if not isinstance(step.get('instruct_args', {}), dict):
+                return f'pipeline step {i} instruct_args must be a map'
+            try:
+                dynamodb_codec.marshal(step.get('instruct_args', {}))
+            except (TypeError, ValueError) as error:
+                return f'pipeline step {i} instruct_args cannot be stored: {error}'
+            for bound_step, _ in bindings(step.get('instruct_args', {})):
+                if bound_step >= i:
+                    return f'pipeline step {i} can only bind results of earlier steps'
+        return None
+
+    def update_pipeline(self, **kwargs):
+        """Runs a conditional update_item on the task entry; returns False if the condition did not hold"""
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-tasks',
+                Key={
+                    'task_name': {'S': self.task_name}
+                },
+                **kwargs
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def start(self, steps, instruct_user_id, end_time, task_item):
+        """
+        Stores the pipeline on the task and submits its first step. Returns (pipeline_id, outcome, queue_position) as
+        in InstructionQueue.submit; pipeline_id is None if the task already runs a pipeline.
+        """
+        pipeline_id = uuid.uuid4().hex
+        steps = [{
+            'instruct_command': step['instruct_command'],
+            'instruct_instance': step.get('instruct_instance') or 'havoc',
+            'instruct_args': step.get('instruct_args') or {'no_args': 'True'}
+        } for step in steps]
+        pipeline = {
+            'pipeline_id': pipeline_id, 'steps': steps, 'outputs': [], 'instruct_user_id': instruct_user_id,
+            'end_time': end_time
+        }
+        started = self.update_pipeline(
+            UpdateExpression='set pipeline=:pipeline',
+            ConditionExpression='attribute_exists(task_name) AND attribute_not_exists(pipeline)',
+            ExpressionAttributeValues={
+                ':pipeline': dynamodb_codec.marshal(pipeline)
+            }
+        )
+        if not started:
+            return None, None, None
+        instruction = self.step_instruction(pipeline, 0, steps[0]['instruct_args'])
+        outcome, queue_position = self.queue.submit(instruction, task_item)
+        if outcome not in ['sent', 'queued']:
+            self.finish(pipeline_id, 'failed', f'first step not sent: {outcome}')
+        return pipeline_id, outcome, queue_position
+
+    def step_instruction(self, pipeline, step, instruct_args):
+        return self.queue.new_instruction(
+            pipeline['instruct_user_id'], pipeline['steps'][step]['instruct_instance'],
+            pipeline['steps'][step]['instruct_command'], instruct_args, pipeline['end_time'],
+            pipeline_id=pipeline['pipeline_id'], pipeline_step=step
+        )
+
+    def finish(self, pipeline_id, outcome, message=None):
+        """Removes the pipeline from the task; returns False if the task is not running pipeline_id"""
+        finished = self.update_pipeline(
+            UpdateExpression='remove pipeline',
+            ConditionExpression='pipeline.pipeline_id = :pipeline_id',
+            ExpressionAttributeValues={
+                ':pipeline_id': {'S': pipeline_id}
+            }
+        )
+        if not finished:
+            return False
+        log = {'task_name': self.task_name, 'pipeline_id': pipeline_id, 'outcome': outcome}
+        if message:
+            log['message'] = message
+        print({'pipeline_finished': log})
+        return True
+
+    def cancel(self, pipeline_id):
+        """
+        Ends the pipeline and takes its step off the queue if it is still waiting there. A step that was already sent
+        runs to completion, but no step follows it. Returns False if the task is not running pipeline_id.
+        """
+        if not self.finish(pipeline_id, 'cancelled'):
+            return False
+        _, pending = self.queue.get_pending()
+        for instruction in pending:
+            if instruction.get('pipeline_id') == pipeline_id:
+                self.queue.cancel(instruction['instruction_id'])
+        return True
+
+    def record_output(self, pipeline_id, step, output):
+        """Appends a step's output; returns False if it was already recorded, such as for a repeated delivery"""
+        return self.update_pipeline(
+            UpdateExpression='set pipeline.outputs=list_append(pipeline.outputs, :output)',
+            ConditionExpression='pipeline.pipeline_id = :pipeline_id AND size(pipeline.outputs) = :step',
+            ExpressionAttributeValues={
+                ':output': {'L': [dynamodb_codec.marshal(output)]},
+                ':pipeline_id': {'S': pipeline_id},
+                ':step': {'N': str(step)}
+            }
+        )
+
+    def advance(self, task_item, output):
+        """
+        Called with the task entry written when the task went idle and the output of the instruction it completed.
+        If that instruction was the running step of the task's pipeline, records its output and submits the next
+        step with its bindings resolved. The step goes ahead of any instructions queued for the task meanwhile, so
+        nothing runs between two steps. Returns True if the next step was sent to the task.
+        """
+        if 'running_pipeline_step' not in task_item or 'pipeline' not in task_item:
+            return False
+        running = dynamodb_codec.unmarshal(task_item['running_pipeline_step'])
+        pipeline = dynamodb_codec.unmarshal(task_item['pipeline'])
+        step = running['pipeline_step']
+        if running['pipeline_id'] != pipeline['pipeline_id'] or step != len(pipeline['outputs']):
+            return False
+
+        # Only outputs that later steps bind to are kept, so the task entry stays small
+        next_step = step + 1
+        if step not in referenced_steps(pipeline['steps'][next_step:]):
+            output = None
+        if next_step == len(pipeline['steps']):
+            self.finish(pipeline['pipeline_id'], 'completed')
+            return False
+        if output is not None:
+            try:
+                dynamodb_codec.marshal(output)
+                output_bytes = len(json.dumps(output).encode('utf-8'))
+            except (TypeError, ValueError) as error:
+                self.finish(pipeline['pipeline_id'], 'failed', f'step {step} output cannot be stored: {error}')
+                return False
+            if output_bytes > MAX_PIPELINE_OUTPUT_BYTES:
+                self.finish(pipeline['pipeline_id'], 'failed', f'step {step} output is {output_bytes} bytes; outputs '
+                                                               f'bound by later steps are limited to '
+                                                               f'{MAX_PIPELINE_OUTPUT_BYTES} bytes')
+                return False
+        outputs = pipeline['outputs'] + [output]
+        try:
+            instruct_args = resolve(pipeline['steps'][next_step]['instruct_args'], outputs)
+        except (LookupError, TypeError, ValueError) as error:
+            self.finish(pipeline['pipeline_id'], 'failed', f'step {next_step} binding could not be resolved: {error!r}')
+            return False
+        if not self.record_output(pipeline['pipeline_id'], step, output):
+            return False
+
+        instruction = self.step_instruction(pipeline, next_step, instruct_args)
+        outcome, _ = self.queue.submit(instruction, task_item)
+        print({'pipeline_advanced': {
+            'task_name': self.task_name, 'pipeline_id': pipeline['pipeline_id'], 'step': next_step,
+            'instruct_command': instruction['instruct_command'], 'outcome': outcome
+        }})
+        if outcome not in ['sent', 'queued']:
+            self.finish(pipeline['pipeline_id'], 'failed', f'step {next_step} not sent: {outcome}')
+        return outcome == 'sent'
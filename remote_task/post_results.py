@@ -1,6 +1,9 @@
 import json
 import copy
-import boto3
+import aws_clients
+import dynamodb_codec
+import instruction_pipeline
+from botocore.exceptions import ClientError
 from datetime import datetime, timedelta
 
 
@@ -36,7 +39,7 @@ class Deliver:
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def add_queue_attribute(self, stime, expire_time, task_instruct_instance, task_instruct_command,
@@ -92,10 +95,11 @@ class Deliver:
                 ':task_status': {'S': task_status},
                 ':last_instruct_time': {'S': stime},
                 ':scheduled_end_time': {'S': task_end_time}
-            }
+            },
+            ReturnValues='ALL_NEW'
         )
         assert response, f"update_task_entry failed for task_name {self.task_name}"
-        return True
+        return response
 
     def delete_task_entry(self):
         response = self.aws_dynamodb_client.delete_item(
@@ -107,26 +111,23 @@ class Deliver:
         assert response, f"delete_task_entry failed for task_name {self.task_name}"
         return True
 
-    def get_portgroup_entry(self, portgroup_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            }
-        )
-
-    def update_portgroup_entry(self, portgroup_name, portgroup_tasks):
-        response = self.aws_dynamodb_client.update_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            },
-            UpdateExpression='set tasks=:tasks',
-            ExpressionAttributeValues={
-                ':tasks': {'SS': portgroup_tasks}
-            }
-        )
-        assert response, f"update_portgroup_entry failed for portgroup_name {portgroup_name}"
+    def remove_portgroup_task(self, portgroup_name):
+        """Removes the task from a portgroup's task set in place, leaving other members untouched"""
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-portgroups',
+                Key={
+                    'portgroup_name': {'S': portgroup_name}
+                },
+                UpdateExpression='delete tasks :task_name',
+                ConditionExpression='attribute_exists(portgroup_name)',
+                ExpressionAttributeValues={
+                    ':task_name': {'SS': [self.task_name]}
+                }
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
         return True
 
     def deliver_result(self):
@@ -184,29 +185,19 @@ class Deliver:
         del db_payload['timestamp']
         del db_payload['user_id']
         json_payload = json.dumps(db_payload['instruct_command_output'])
-        task_instruct_args_fixup = {}
-        for k, v in task_instruct_args.items():
-            if isinstance(v, str):
-                task_instruct_args_fixup[k] = {'S': v}
-            if isinstance(v, int) and not isinstance(v, bool):
-                task_instruct_args_fixup[k] = {'N': str(v)}
-            if isinstance(v, bool):
-                task_instruct_args_fixup[k] = {'BOOL': v}
-            if isinstance(v, bytes):
-                task_instruct_args_fixup[k] = {'B': v}
+        task_instruct_args_fixup = dynamodb_codec.marshal_map(task_instruct_args)
         self.add_queue_attribute(stime, expiration_stime, task_instruct_instance, task_instruct_command,
                                  task_instruct_args_fixup, task_attack_ip, task_local_ip, json_payload)
         if task_instruct_command == 'terminate':
             for portgroup in portgroups:
                 if portgroup != 'None':
-                    portgroup_entry = self.get_portgroup_entry(portgroup)
-                    tasks = portgroup_entry['Item']['tasks']['SS']
-                    tasks.remove(self.task_name)
-                    if not tasks:
-                        tasks.append('None')
-                    self.update_portgroup_entry(portgroup, tasks)
+                    self.remove_portgroup_task(portgroup)
             self.delete_task_entry()
         else:
-            self.update_task_entry(stime, 'idle', task_end_time)
+            task_entry = self.update_task_entry(stime, 'idle', task_end_time)
+            # Now that the task is idle, send it the next step of its pipeline or the next instruction in its queue
+            pipeline = instruction_pipeline.Pipeline(self.campaign_id, self.task_name, self.region)
+            if not pipeline.advance(task_entry['Attributes'], self.results['instruct_command_output']):
+                pipeline.queue.dispatch_next(task_entry['Attributes'])
 
         return format_response(200, 'success', 'post_results succeeded', None)
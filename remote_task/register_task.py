@@ -1,5 +1,7 @@
 import json
-import boto3
+import aws_clients
+import dynamodb_codec
+import task_type_cache
 from datetime import datetime
 
 
@@ -38,23 +40,19 @@ class Task:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = aws_clients.get_client('s3', self.region)
         return self.__aws_s3_client
 
     def get_task_type_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-task-types',
-            Key={
-                'task_type': {'S': self.task_type}
-            }
-        )
+        task_type_entry, _ = task_type_cache.lookup(self.campaign_id, self.region, self.task_type)
+        return task_type_entry
 
     def get_task_entry(self):
         return self.aws_dynamodb_client.get_item(
@@ -167,7 +165,7 @@ class Task:
         timestamp = datetime.now().strftime('%s')
         self.upload_object(instruct_user_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time)
 
-        instruct_args_fixup = {'no_args': {'S': 'True'}}
+        instruct_args_fixup = dynamodb_codec.marshal_map(instruct_args)
         # Add task entry to tasks table in DynamoDB
         self.add_task_entry(instruct_user_id, instruct_instance, instruct_command, instruct_args_fixup,
                             attack_ip, local_ip, portgroups, ecs_task_id, timestamp, end_time)
@@ -0,0 +1,57 @@
+import os
+import boto3
+import threading
+from botocore.config import Config
+
+# Tuned for Lambda: keep connections alive between warm invocations and let botocore back off adaptively when a
+# service throttles instead of failing the request.
+CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', 25)),
+    tcp_keepalive=True,
+    connect_timeout=int(os.environ.get('AWS_CONNECT_TIMEOUT', 5)),
+    read_timeout=int(os.environ.get('AWS_READ_TIMEOUT', 30)),
+    retries={'mode': 'adaptive', 'total_max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', 5))}
+)
+
+# Clients live at module scope, keyed by (service, region), so every class and every warm invocation shares them
+clients = {}
+client_factory = None
+clients_lock = threading.Lock()
+
+
+def get_client(service, region=None):
+    """Returns the shared client for service in region, creating it on first use"""
+    client_key = (service, region)
+    client = clients.get(client_key)
+    if client is None:
+        with clients_lock:
+            client = clients.get(client_key)
+            if client is None:
+                if client_factory is not None:
+                    client = client_factory(service, region)
+                else:
+                    client = boto3.client(service, region_name=region, config=CLIENT_CONFIG)
+                clients[client_key] = client
+    return client
+
+
+def set_client(service, region, client):
+    """Registers a client (for example a local stand-in) to be returned for service in region"""
+    with clients_lock:
+        clients[(service, region)] = client
+
+
+def set_client_factory(factory):
+    """
+    Replaces boto3 as the source of new clients. factory is called as factory(service, region); passing None restores
+    boto3. Clients created so far are discarded.
+    """
+    global client_factory
+    with clients_lock:
+        client_factory = factory
+        clients.clear()
+
+
+def reset_clients():
+    with clients_lock:
+        clients.clear()
@@ -0,0 +1,212 @@
+import os
+import json
+import aws_clients
+import interact
+import instruction_queue
+import task_type_cache
+from concurrent.futures import ThreadPoolExecutor
+
+BROADCAST_MAX_TASKS = int(os.environ.get('BROADCAST_MAX_TASKS', 100))
+# Each selected task gets its own conditional write and S3 object, so these go out in parallel
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 10))
+BATCH_GET_SIZE = 100
+TASK_STATUSES = ['starting', 'idle', 'busy', 'finished']
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+def chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class Tasks:
+
+    def __init__(self, campaign_id, region, detail: dict, user_id, log):
+        """
+        Send one instruction to many tasks, selected by task_names, task_type and/or task_status. Each task is
+        handled as interact would: idle tasks get the instruction at once and busy or starting tasks queue it.
+        """
+        self.campaign_id = campaign_id
+        self.region = region
+        self.detail = detail
+        self.user_id = user_id
+        self.log = log
+        self.outcomes = {}
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    def fail(self, task_name, message):
+        self.outcomes[task_name] = {'outcome': 'failed', 'message': message}
+
+    def get_named_task_entries(self, task_names):
+        task_entries = {}
+        for chunk in chunks(task_names, BATCH_GET_SIZE):
+            request_items = {
+                f'{self.campaign_id}-tasks': {
+                    'Keys': [{'task_name': {'S': task_name}} for task_name in chunk],
+                    'ProjectionExpression': 'task_name, task_type, task_status'
+                }
+            }
+            while request_items:
+                response = self.aws_dynamodb_client.batch_get_item(RequestItems=request_items)
+                for item in response['Responses'].get(f'{self.campaign_id}-tasks', []):
+                    task_entries[item['task_name']['S']] = item
+                request_items = response.get('UnprocessedKeys')
+        return task_entries
+
+    def query_task_entries(self, task_type, task_status):
+        """Scans the tasks table for the tasks matching task_type and task_status (either may be None)"""
+        filters = []
+        expression_attribute_values = {}
+        if task_type:
+            filters.append('task_type = :task_type')
+            expression_attribute_values[':task_type'] = {'S': task_type}
+        if task_status:
+            filters.append('task_status = :task_status')
+            expression_attribute_values[':task_status'] = {'S': task_status}
+        scan_kwargs = {
+            'TableName': f'{self.campaign_id}-tasks',
+            'ProjectionExpression': 'task_name, task_type, task_status',
+            'FilterExpression': ' AND '.join(filters),
+            'ExpressionAttributeValues': expression_attribute_values
+        }
+        task_entries = {}
+        done = False
+        start_key = None
+        while not done:
+            if start_key:
+                scan_kwargs['ExclusiveStartKey'] = start_key
+            response = self.aws_dynamodb_client.scan(**scan_kwargs)
+            for item in response['Items']:
+                task_entries[item['task_name']['S']] = item
+            start_key = response.get('LastEvaluatedKey', None)
+            done = start_key is None
+        return task_entries
+
+    def select_tasks(self, task_names, task_type, task_status):
+        """Returns the task entries to instruct; named tasks that are missing or do not match are failed here"""
+        if not task_names:
+            return self.query_task_entries(task_type, task_status)
+        task_entries = self.get_named_task_entries(task_names)
+        selected = {}
+        for task_name in task_names:
+            task_entry = task_entries.get(task_name)
+            if task_entry is None:
+                self.fail(task_name, f'task_name {task_name} not found')
+            elif task_type and task_entry['task_type']['S'] != task_type:
+                self.fail(task_name, f'task_name {task_name} is not of task_type {task_type}')
+            elif task_status and task_entry['task_status']['S'] != task_status:
+                self.fail(task_name, f'task_name {task_name} is not {task_status}')
+            else:
+                selected[task_name] = task_entry
+        return selected
+
+    def send(self, task_name, task_item, instruction_fields):
+        queue = instruction_queue.InstructionQueue(self.campaign_id, task_name, self.region)
+        instruction = queue.new_instruction(self.user_id, *instruction_fields)
+        try:
+            outcome, queue_position = queue.submit(instruction, task_item)
+        except Exception as error:
+            # One task's error fails that task only; the outcomes of the others are still reported
+            print({'broadcast_send_failed': {'task_name': task_name, 'error': f'{type(error).__name__}: {error}'}})
+            return {'outcome': 'failed', 'message': f'{type(error).__name__}: {error}'}
+        if outcome == 'sent':
+            return {'outcome': 'success'}
+        if outcome == 'queued':
+            return {'outcome': 'queued', 'instruction_id': instruction['instruction_id'],
+                    'queue_position': queue_position}
+        messages = {
+            'queue_full': f'instruction queue for task {task_name} is full',
+            'not_found': f'task_name {task_name} not found',
+            'not_running': f'task {task_name} no longer running',
+            'conflict': f'task {task_name} is changing state, try again'
+        }
+        return {'outcome': 'failed', 'message': messages[outcome]}
+
+    def instruct(self):
+        if 'instruct_command' not in self.detail:
+            return format_response(400, 'failed', 'missing instruct_command', self.log)
+        instruct_command = self.detail['instruct_command']
+        if 'instruct_instance' in self.detail and self.detail['instruct_instance']:
+            instruct_instance = self.detail['instruct_instance']
+        else:
+            instruct_instance = 'havoc'
+        if 'instruct_args' in self.detail and self.detail['instruct_args']:
+            instruct_args = self.detail['instruct_args']
+        else:
+            instruct_args = {'no_args': 'True'}
+        if 'end_time' in self.detail and self.detail['end_time']:
+            end_time = self.detail['end_time']
+        else:
+            end_time = 'None'
+        invalid = interact.invalid_instruct_args(instruct_args)
+        if invalid:
+            return format_response(400, 'failed', invalid, self.log)
+
+        task_names = self.detail.get('task_names') or []
+        task_type = self.detail.get('task_type')
+        task_status = self.detail.get('task_status')
+        if not isinstance(task_names, list):
+            return format_response(400, 'failed', 'task_names must be a list', self.log)
+        if not (task_names or task_type or task_status):
+            return format_response(400, 'failed', 'request detail must contain task_names, task_type or task_status',
+                                   self.log)
+        if task_status and task_status not in TASK_STATUSES:
+            return format_response(400, 'failed', f'task_status must be one of {", ".join(TASK_STATUSES)}', self.log)
+        if len(set(task_names)) > BROADCAST_MAX_TASKS:
+            return format_response(400, 'failed', f'broadcast is limited to {BROADCAST_MAX_TASKS} tasks', self.log)
+
+        selected = self.select_tasks(list(dict.fromkeys(task_names)), task_type, task_status)
+        if not selected and not self.outcomes:
+            return format_response(404, 'failed', 'no tasks matched the broadcast selection', self.log)
+        if len(selected) > BROADCAST_MAX_TASKS:
+            return format_response(400, 'failed', f'{len(selected)} tasks selected; broadcast is limited to '
+                                                  f'{BROADCAST_MAX_TASKS} tasks', self.log)
+
+        # Validate instruct_command once per task_type
+        valid_task_types = {}
+        targets = []
+        for task_name, task_entry in selected.items():
+            selected_task_type = task_entry['task_type']['S']
+            if selected_task_type not in valid_task_types:
+                _, capabilities = task_type_cache.lookup(self.campaign_id, self.region, selected_task_type)
+                valid_task_types[selected_task_type] = instruct_command in capabilities
+            if valid_task_types[selected_task_type]:
+                targets.append((task_name, task_entry))
+            else:
+                self.fail(task_name, f'{instruct_command} not valid for task_name {task_name}')
+
+        instruction_fields = (instruct_instance, instruct_command, instruct_args, end_time)
+        if targets:
+            with ThreadPoolExecutor(max_workers=min(BROADCAST_CONCURRENCY, len(targets))) as executor:
+                results = executor.map(lambda target: self.send(target[0], target[1], instruction_fields), targets)
+                for (task_name, _), result in zip(targets, results):
+                    self.outcomes[task_name] = result
+
+        counts = {}
+        for outcome in self.outcomes.values():
+            counts[outcome['outcome']] = counts.get(outcome['outcome'], 0) + 1
+        if not counts.get('success') and not counts.get('queued'):
+            return format_response(409, 'failed', 'instruction was not sent to any task', self.log,
+                                   tasks=self.outcomes, counts=counts)
+        return format_response(200, 'success', f'broadcast {instruct_command} to {len(self.outcomes)} tasks', None,
+                               tasks=self.outcomes, counts=counts)
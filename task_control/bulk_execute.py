@@ -0,0 +1,444 @@
+import os
+import re
+import json
+import random
+import aws_clients
+import dns_changes
+import dynamodb_codec
+import execute
+import task_type_cache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import time as t
+
+BULK_EXECUTE_MAX_TASKS = int(os.environ.get('BULK_EXECUTE_MAX_TASKS', 50))
+# run_task cannot launch several tasks with different TASK_NAME overrides in one call, so launches go out in parallel
+BULK_EXECUTE_CONCURRENCY = int(os.environ.get('BULK_EXECUTE_CONCURRENCY', 10))
+DESCRIBE_BATCH_SIZE = 100
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_ATTEMPTS = 5
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+def chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class Tasks:
+
+    def __init__(self, campaign_id, subnet, region, detail: dict, user_id, log, remaining_time=None):
+        """
+        Launch many tasks of one task_type in a single request. Shared reads and writes (task type, portgroups, domain,
+        DNS and task entries) are batched; each task is still launched with its own run_task call.
+        """
+        self.campaign_id = campaign_id
+        self.task_context = f'{self.campaign_id}-{region}'
+        self.subnet = subnet
+        self.region = region
+        self.detail = detail
+        self.user_id = user_id
+        self.log = log
+        self.remaining_time = remaining_time
+        self.task_type = None
+        self.portgroups = ['None']
+        self.end_time = 'None'
+        self.task_domain_name = 'None'
+        self.outcomes = {}
+        self.__aws_dynamodb_client = None
+        self.__aws_ecs_client = None
+        self.__aws_ec2_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    @property
+    def aws_ecs_client(self):
+        """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
+        if self.__aws_ecs_client is None:
+            self.__aws_ecs_client = aws_clients.get_client('ecs', self.region)
+        return self.__aws_ecs_client
+
+    @property
+    def aws_ec2_client(self):
+        """Returns the boto3 EC2 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_ec2_client is None:
+            self.__aws_ec2_client = aws_clients.get_client('ec2', self.region)
+        return self.__aws_ec2_client
+
+    def fail(self, task_name, message):
+        self.outcomes[task_name] = {'task_name': task_name, 'outcome': 'failed', 'message': message}
+
+    def batch_get(self, table, key_name, key_values, projection):
+        """Returns the items of table whose key_name is in key_values, keyed by that value"""
+        items = {}
+        for chunk in chunks(key_values, BATCH_GET_SIZE):
+            request_items = {
+                f'{self.campaign_id}-{table}': {
+                    'Keys': [{key_name: {'S': v}} for v in chunk],
+                    'ProjectionExpression': projection
+                }
+            }
+            while request_items:
+                response = self.aws_dynamodb_client.batch_get_item(RequestItems=request_items)
+                for item in response['Responses'].get(f'{self.campaign_id}-{table}', []):
+                    items[item[key_name]['S']] = item
+                request_items = response.get('UnprocessedKeys')
+        return items
+
+    def batch_write(self, items):
+        request_items = [{'PutRequest': {'Item': item}} for item in items]
+        for chunk in chunks(request_items, BATCH_WRITE_SIZE):
+            unprocessed = {f'{self.campaign_id}-tasks': chunk}
+            attempts = 0
+            while unprocessed:
+                attempts += 1
+                response = self.aws_dynamodb_client.batch_write_item(RequestItems=unprocessed)
+                unprocessed = response.get('UnprocessedItems')
+                if unprocessed:
+                    assert attempts < BATCH_WRITE_MAX_ATTEMPTS, 'batch_write failed for task entries'
+                    t.sleep(0.05 * 2 ** attempts)
+        return True
+
+    def get_task_type_entry(self):
+        task_type_entry, _ = task_type_cache.lookup(self.campaign_id, self.region, self.task_type)
+        return task_type_entry
+
+    def get_domain_entry(self):
+        return self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-domains',
+            Key={
+                'domain_name': {'S': self.task_domain_name}
+            }
+        )
+
+    def update_domain_entry(self, domain_tasks, host_names):
+        response = self.aws_dynamodb_client.update_item(
+            TableName=f'{self.campaign_id}-domains',
+            Key={
+                'domain_name': {'S': self.task_domain_name}
+            },
+            UpdateExpression='set tasks=:tasks, host_names=:host_names',
+            ExpressionAttributeValues={
+                ':tasks': {'SS': domain_tasks},
+                ':host_names': {'SS': host_names}
+            }
+        )
+        assert response, f"update_domain_entry failed for domain_name {self.task_domain_name}"
+        return True
+
+    def create_resource_records(self, hosted_zone, host_names):
+        """Submits the A records of every task at once; returns the change id and status of each host name"""
+        changes = dns_changes.coalescer.change(hosted_zone, [
+            dns_changes.a_record_change('UPSERT', f'{host_name}.{self.task_domain_name}', ip_address)
+            for host_name, ip_address in host_names.items()
+        ], str(self.detail.get('wait_for_dns', 'no')).lower() in ['yes', 'true'], window=0)
+        return dict(zip(host_names, changes))
+
+    def describe_tasks(self, ecs_task_ids):
+        ecs_tasks = []
+        for chunk in chunks(ecs_task_ids, DESCRIBE_BATCH_SIZE):
+            response = self.aws_ecs_client.describe_tasks(cluster=f'{self.campaign_id}-cluster', tasks=chunk)
+            ecs_tasks.extend(response['tasks'])
+        return ecs_tasks
+
+    def describe_public_ips(self, interface_ids):
+        """Returns the public IPs of the interfaces that have one; the filter skips interfaces EC2 does not know yet"""
+        public_ips = {}
+        for chunk in chunks(interface_ids, DESCRIBE_BATCH_SIZE):
+            response = self.aws_ec2_client.describe_network_interfaces(
+                Filters=[{'Name': 'network-interface-id', 'Values': chunk}]
+            )
+            for interface in response['NetworkInterfaces']:
+                public_ip = interface.get('Association', {}).get('PublicIp')
+                if public_ip:
+                    public_ips[interface['NetworkInterfaceId']] = public_ip
+        return public_ips
+
+    def wait_for_attack_ips(self, launched):
+        """
+        Polls all launched tasks together until each has a public IP, has stopped, or the time budget runs out.
+        launched maps ECS task ARNs to task names; returns task names mapped to public IPs.
+        """
+        start = t.monotonic()
+        deadline = start + execute.READINESS_TIMEOUT
+        delay = execute.READINESS_INITIAL_DELAY
+        pending = dict(launched)
+        attack_ips = {}
+        polls = 0
+        while pending:
+            polls += 1
+            interfaces = {}
+            for ecs_task in self.describe_tasks(list(pending)):
+                task_name = pending[ecs_task['taskArn']]
+                if ecs_task.get('lastStatus') == 'STOPPED':
+                    self.fail(task_name, f'task stopped during launch: {ecs_task.get("stoppedReason", "unknown")}')
+                    del pending[ecs_task['taskArn']]
+                    continue
+                interface_id = execute.get_interface_id(ecs_task)
+                if interface_id:
+                    interfaces[interface_id] = ecs_task['taskArn']
+            for interface_id, public_ip in self.describe_public_ips(list(interfaces)).items():
+                attack_ips[pending.pop(interfaces[interface_id])] = public_ip
+            if not pending:
+                break
+            pause = delay / 2 + random.uniform(0, delay / 2)
+            seconds_left = deadline - t.monotonic()
+            if self.remaining_time is not None:
+                seconds_left = min(seconds_left, self.remaining_time() / 1000 - execute.READINESS_SAFETY_MARGIN)
+            if seconds_left < pause:
+                break
+            t.sleep(pause)
+            delay = min(delay * 2, execute.READINESS_MAX_DELAY)
+        print({'bulk_provisioning': {'polls': polls, 'provisioning_seconds': round(t.monotonic() - start, 3),
+                                     'ready': len(attack_ips), 'not_ready': len(pending)}})
+        return attack_ips, pending
+
+    def task_item(self, task_name, host_name, attack_ip, ecs_task_id, timestamp):
+        instruct_args_fixup = dynamodb_codec.marshal_map({'no_args': 'True'})
+        return {
+            'task_name': {'S': task_name},
+            'task_type': {'S': self.task_type},
+            'task_context': {'S': self.task_context},
+            'task_status': {'S': 'starting'},
+            'task_host_name': {'S': host_name},
+            'task_domain_name': {'S': self.task_domain_name if host_name != 'None' else 'None'},
+            'attack_ip': {'S': attack_ip},
+            'local_ip': {'SS': ['None']},
+            'portgroups': {'SS': self.portgroups},
+            'instruct_instances': {'SS': ['None']},
+            'last_instruct_user_id': {'S': 'None'},
+            'last_instruct_instance': {'S': 'None'},
+            'last_instruct_command': {'S': 'Initialize'},
+            'last_instruct_args': {'M': instruct_args_fixup},
+            'last_instruct_time': {'S': 'None'},
+            'create_time': {'S': timestamp},
+            'scheduled_end_time': {'S': self.end_time},
+            'user_id': {'S': self.user_id},
+            'ecs_task_id': {'S': ecs_task_id}
+        }
+
+    def validate_tasks(self, requested):
+        """Returns the requested tasks that can be launched as (task_name, host_name) pairs, failing the others"""
+        valid_host_name = re.compile(
+            '^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*'
+            '([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+        )
+        existing = self.batch_get('tasks', 'task_name', list({r['task_name'] for r in requested}), 'task_name')
+        taken_host_names = set()
+        if self.task_domain_name != 'None':
+            taken_host_names = set(self.domain_entry['Item']['host_names']['SS'])
+        # A task_name requested more than once is not launched at all, so no later entry can replace its failure
+        requested_names = [r['task_name'] for r in requested]
+        duplicates = {n for n in requested_names if requested_names.count(n) > 1}
+        valid = []
+        for r in requested:
+            task_name = r['task_name']
+            host_name = r.get('task_host_name') or 'None'
+            if task_name in duplicates:
+                self.fail(task_name, f'{task_name} is requested more than once')
+                continue
+            if task_name in existing:
+                self.fail(task_name, f'{task_name} already exists')
+                continue
+            if host_name != 'None':
+                if self.task_domain_name == 'None':
+                    self.fail(task_name, 'task_host_name requires task_domain_name')
+                    continue
+                fqdn = f'{host_name}.{self.task_domain_name}'
+                if len(fqdn) > 253:
+                    self.fail(task_name, f'{fqdn} cannot exceed 253 characters')
+                    continue
+                if not valid_host_name.match(fqdn):
+                    self.fail(task_name, f'{fqdn} is not DNS compliant')
+                    continue
+                if host_name in taken_host_names:
+                    self.fail(task_name, f'{host_name} already exists')
+                    continue
+                taken_host_names.add(host_name)
+            valid.append((task_name, host_name))
+        return valid
+
+    def delete_resource_records(self, hosted_zone, host_names):
+        """Deletes the A records of every task at once"""
+        return dns_changes.coalescer.change(hosted_zone, [
+            dns_changes.a_record_change('DELETE', f'{host_name}.{self.task_domain_name}', ip_address)
+            for host_name, ip_address in host_names.items()
+        ], window=0)
+
+    def compensate(self, tasks, ready, attack_ips, started):
+        """
+        Undoes the post-launch steps that were started for the ready tasks when one of them failed, and stops their
+        containers, the way execute cleans up a single launch. Every task is failed.
+        """
+        dns_names = {tasks[n].task_host_name: attack_ips[n] for n in ready if tasks[n].task_host_name != 'None'}
+        if 'host_record' in started and dns_names:
+            # The records were created in one batch and are removed in one
+            try:
+                self.delete_resource_records(self.domain_entry['Item']['hosted_zone']['S'], dns_names)
+            except Exception as error:
+                print({'compensation_failed': {'task_names': list(ready), 'step': 'host_record', 'error': str(error)}})
+        for task_name, ecs_task_id in ready.items():
+            task = tasks[task_name]
+            completed = [s for s in started if s != 'host_record']
+            if task.task_host_name == 'None' and 'domain_entry' in completed:
+                completed.remove('domain_entry')
+            task.compensate(completed, ecs_task_id, attack_ips[task_name])
+            self.fail(task_name, 'bulk execute failed while setting up the task; it was stopped and cleaned up')
+
+    def run_tasks(self):
+        requested = self.detail.get('tasks')
+        if not isinstance(requested, list) or not requested:
+            return format_response(400, 'failed', 'invalid detail: tasks must be a non-empty list', self.log)
+        if len(requested) > BULK_EXECUTE_MAX_TASKS:
+            return format_response(400, 'failed', f'tasks limit of {BULK_EXECUTE_MAX_TASKS} exceeded', self.log)
+        if not all(isinstance(r, dict) and r.get('task_name') and isinstance(r['task_name'], str) for r in requested):
+            return format_response(400, 'failed', 'invalid detail: each task must have a task_name string', self.log)
+        if not all(isinstance(r.get('task_host_name') or '', str) for r in requested):
+            return format_response(400, 'failed', 'invalid detail: task_host_name must be a string', self.log)
+
+        # Options shared by every task are validated the same way execute validates them
+        template = execute.Task(self.campaign_id, requested[0]['task_name'], self.subnet, self.region, self.detail,
+                                self.user_id, self.log)
+        invalid = template.parse_detail()
+        if invalid:
+            return invalid
+        self.task_type = template.task_type
+        self.portgroups = template.portgroups
+        self.end_time = template.end_time
+        self.task_domain_name = self.detail.get('task_domain_name') or 'None'
+
+        if 'Item' not in self.get_task_type_entry():
+            return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
+        if self.task_domain_name != 'None':
+            self.domain_entry = self.get_domain_entry()
+            if 'Item' not in self.domain_entry:
+                return format_response(
+                    404, 'failed', f'domain_name {self.task_domain_name} does not exist', self.log
+                )
+        portgroup_entries = {}
+        if 'None' not in self.portgroups:
+            portgroup_entries = self.batch_get('portgroups', 'portgroup_name', list(set(self.portgroups)),
+                                               'portgroup_name, securitygroup_id')
+            for portgroup in self.portgroups:
+                if portgroup not in portgroup_entries:
+                    return format_response(404, 'failed', f'portgroup_name: {portgroup} does not exist', self.log)
+        # Portgroups can share a security group, which run_task must only be given once
+        securitygroups = list(dict.fromkeys(portgroup_entries[p]['securitygroup_id']['S'] for p in portgroup_entries))
+
+        valid = self.validate_tasks(requested)
+        host_names = dict(valid)
+
+        # Launch every task
+        tasks = {}
+        for task_name, _ in valid:
+            tasks[task_name] = execute.Task(self.campaign_id, task_name, self.subnet, self.region, self.detail,
+                                            self.user_id, self.log)
+            tasks[task_name].task_type = self.task_type
+            tasks[task_name].portgroups = self.portgroups
+            tasks[task_name].end_time = self.end_time
+            if host_names[task_name] != 'None':
+                tasks[task_name].task_host_name = host_names[task_name]
+                tasks[task_name].task_domain_name = self.task_domain_name
+                tasks[task_name].domain_entry = self.domain_entry
+
+        def launch(task):
+            try:
+                task.run_attack_task(securitygroups, self.end_time)
+            except Exception as error:
+                return task.task_name, None, str(error)
+            return task.task_name, task.run_task_response['tasks'][0]['taskArn'], None
+
+        launched = {}
+        with ThreadPoolExecutor(max_workers=BULK_EXECUTE_CONCURRENCY) as pool:
+            for task_name, ecs_task_id, error in pool.map(launch, tasks.values()):
+                if ecs_task_id:
+                    launched[ecs_task_id] = task_name
+                else:
+                    self.fail(task_name, f'run_task failed: {error}')
+
+        # Wait for the whole batch, then stop anything that did not become reachable
+        attack_ips, not_ready = self.wait_for_attack_ips(launched) if launched else ({}, {})
+        for ecs_task_id, task_name in not_ready.items():
+            tasks[task_name].stop_ecs_task(ecs_task_id, f'Task did not become reachable for {self.user_id}')
+            self.fail(task_name, 'task did not receive a public IP in time and was stopped')
+        ready = {name: ecs_task_id for ecs_task_id, name in launched.items() if name in attack_ips}
+        timestamp = datetime.now().strftime('%s')
+
+        if ready:
+            # Steps are recorded as they start, so a failure part way can be undone for every ready task
+            started = []
+            host_dns_changes = {}
+            try:
+                # One set update per portgroup and one read-modify-write for the domain, covering every ready task
+                started.append('portgroups')
+                for portgroup in portgroup_entries:
+                    template.add_portgroup_tasks(portgroup, list(ready))
+                dns_names = {host_names[n]: attack_ips[n] for n in ready if host_names[n] != 'None'}
+                if dns_names:
+                    started.append('host_record')
+                    hosted_zone = self.domain_entry['Item']['hosted_zone']['S']
+                    host_dns_changes = self.create_resource_records(hosted_zone, dns_names)
+                    started.append('domain_entry')
+                    domain_entry = self.get_domain_entry()
+                    domain_tasks = [d for d in domain_entry['Item']['tasks']['SS'] if d != 'None']
+                    domain_host_names = [h for h in domain_entry['Item']['host_names']['SS'] if h != 'None']
+                    dns_tasks = [n for n in ready if host_names[n] != 'None']
+                    self.update_domain_entry(domain_tasks + dns_tasks, domain_host_names + list(dns_names))
+
+                # Task entries, then the Initialize instructions, so a task's first result finds its entry
+                started.append('task_entry')
+                self.batch_write([
+                    self.task_item(n, host_names[n], attack_ips[n], ready[n], timestamp) for n in ready
+                ])
+                started.append('initialize')
+                with ThreadPoolExecutor(max_workers=BULK_EXECUTE_CONCURRENCY) as pool:
+                    list(pool.map(
+                        lambda n: tasks[n].upload_object('None', 'None', 'Initialize', {'no_args': 'True'}, timestamp,
+                                                         self.end_time),
+                        ready
+                    ))
+            except Exception as error:
+                error = f'{type(error).__name__}: {error}'
+                print({'bulk_execute_failed': {'task_names': list(ready), 'step': started[-1], 'error': error}})
+                self.compensate(tasks, ready, attack_ips, started)
+                outcomes = [self.outcomes[n] for n in dict.fromkeys(r['task_name'] for r in requested)]
+                return format_response(
+                    500, 'failed', 'bulk execute failed; the launched tasks were stopped and cleaned up', self.log,
+                    tasks=outcomes, errors={started[-1]: error}
+                )
+            for task_name in ready:
+                self.outcomes[task_name] = {
+                    'task_name': task_name, 'outcome': 'success', 'attack_ip': attack_ips[task_name]
+                }
+                if host_names[task_name] in host_dns_changes:
+                    self.outcomes[task_name]['dns_change'] = host_dns_changes[host_names[task_name]]
+
+        print({'bulk_executed': {
+            'user_id': self.user_id, 'task_type': self.task_type, 'task_context': self.task_context,
+            'requested': len(requested), 'launched': len(ready)
+        }})
+        outcomes = [self.outcomes[n] for n in dict.fromkeys(r['task_name'] for r in requested) if n in self.outcomes]
+        if not ready:
+            return format_response(409, 'failed', 'bulk execute launched no tasks', self.log, tasks=outcomes)
+        return format_response(
+            200, 'success', f'bulk execute launched {len(ready)} of {len(requested)} tasks', None, tasks=outcomes
+        )
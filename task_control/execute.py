@@ -1,8 +1,30 @@
+import os
 import re
 import json
-import boto3
+import random
+import aws_clients
+import dns_changes
+import dynamodb_codec
+import launch_scheduler
+import standby_pool
+import task_type_cache
+from botocore.exceptions import ClientError
 from datetime import datetime
 import time as t
+from concurrent.futures import ThreadPoolExecutor
+
+# Fargate usually reports the task's network interface and public IP within a few seconds of run_task, so poll for
+# them with exponential backoff instead of waiting a fixed interval
+READINESS_INITIAL_DELAY = float(os.environ.get('READINESS_INITIAL_DELAY', 1))
+READINESS_MAX_DELAY = float(os.environ.get('READINESS_MAX_DELAY', 8))
+READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT', 60))
+# Time to leave for the rest of execute (DNS, workspace and task entry) when the Lambda deadline is near
+READINESS_SAFETY_MARGIN = float(os.environ.get('READINESS_SAFETY_MARGIN', 5))
+# Threads for the independent steps that follow a launch (portgroups, DNS, domain entry, task entry)
+POST_LAUNCH_CONCURRENCY = int(os.environ.get('POST_LAUNCH_CONCURRENCY', 5))
+# How long a claimed standby task has to report the result of its Initialize before execute stops it and launches a
+# new task instead
+STANDBY_ACK_TIMEOUT = float(os.environ.get('STANDBY_ACK_TIMEOUT', 15))
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -19,11 +41,25 @@ def format_response(status_code, result, message, log, **kwargs):
     return {'statusCode': status_code, 'body': json.dumps(response)}
 
 
+def get_interface_id(ecs_task):
+    """Returns the id of the task's network interface, or None if it has not been attached yet"""
+    for attachment in ecs_task.get('attachments', []):
+        if attachment.get('type') != 'ElasticNetworkInterface':
+            continue
+        for detail in attachment.get('details', []):
+            if detail.get('name') == 'networkInterfaceId':
+                return detail.get('value')
+    return None
+
+
 class Task:
 
-    def __init__(self, campaign_id, task_name, subnet, region, detail: dict, user_id, log):
+    def __init__(self, campaign_id, task_name, subnet, region, detail: dict, user_id, log, remaining_time=None,
+                 function_name=None):
         """
-        Instantiate a Task instance
+        Instantiate a Task instance. remaining_time is the Lambda context's get_remaining_time_in_millis, used to stop
+        waiting for the task's public IP before the function times out; function_name is the function that runs the
+        launch job of an asynchronous execute.
         """
         self.campaign_id = campaign_id
         self.task_name = task_name
@@ -33,48 +69,58 @@ class Task:
         self.detail = detail
         self.user_id = user_id
         self.log = log
+        self.remaining_time = remaining_time
+        self.function_name = function_name
         self.task_type = None
+        self.portgroups = ['None']
+        self.end_time = 'None'
+        self.task_host_name = 'None'
+        self.task_domain_name = 'None'
+        self.domain_entry = None
+        self.dns_change = None
+        self.task_type_entry = None
+        self.securitygroups = []
         self.run_task_response = None
         self.__aws_dynamodb_client = None
         self.__aws_ecs_client = None
         self.__aws_ec2_client = None
         self.__aws_s3_client = None
-        self.__aws_route53_client = None
+        self.__aws_lambda_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = aws_clients.get_client('ecs', self.region)
         return self.__aws_ecs_client
 
     @property
     def aws_ec2_client(self):
         """Returns the boto3 EC2 session (establishes one automatically if one does not already exist)"""
         if self.__aws_ec2_client is None:
-            self.__aws_ec2_client = boto3.client('ec2', region_name=self.region)
+            self.__aws_ec2_client = aws_clients.get_client('ec2', self.region)
         return self.__aws_ec2_client
 
     @property
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = aws_clients.get_client('s3', self.region)
         return self.__aws_s3_client
 
     @property
-    def aws_route53_client(self):
-        """Returns the boto3 Route53 session for this project (establishes one automatically if one does not already exist)"""
-        if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53')
-        return self.__aws_route53_client
+    def aws_lambda_client(self):
+        """Returns the boto3 Lambda session (establishes one automatically if one does not already exist)"""
+        if self.__aws_lambda_client is None:
+            self.__aws_lambda_client = aws_clients.get_client('lambda', self.region)
+        return self.__aws_lambda_client
 
     def get_domain_entry(self, domain_name):
         return self.aws_dynamodb_client.get_item(
@@ -84,31 +130,12 @@ class Task:
             }
         )
 
-    def create_resource_record(self, hosted_zone, host_name, domain_name, ip_address):
-        response = self.aws_route53_client.change_resource_record_sets(
-            HostedZoneId=hosted_zone,
-            ChangeBatch={
-                'Changes': [
-                    {
-                        'Action': 'UPSERT',
-                        'ResourceRecordSet':{
-                            'Name': f'{host_name}.{domain_name}',
-                            'Type': 'A',
-                            'TTL': 300,
-                            'ResourceRecords': [
-                                {
-                                    'Value': ip_address
-                                }
-                            ]
-                        }
-                    }
-                ]
-            }
+    def create_resource_record(self, hosted_zone, host_name, domain_name, ip_address, wait_insync=False):
+        """Upserts the task's A record through the shared change coalescer; returns its change id and status"""
+        change, = dns_changes.coalescer.change(
+            hosted_zone, [dns_changes.a_record_change('UPSERT', f'{host_name}.{domain_name}', ip_address)], wait_insync
         )
-        if response:
-            return True
-        else:
-            return False
+        return change
 
     def update_domain_entry(self, domain_name, domain_tasks, host_names):
         response = self.aws_dynamodb_client.update_item(
@@ -126,12 +153,8 @@ class Task:
         return True
 
     def get_task_type_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-task-types',
-            Key={
-                'task_type': {'S': self.task_type}
-            }
-        )
+        task_type_entry, _ = task_type_cache.lookup(self.campaign_id, self.region, self.task_type)
+        return task_type_entry
 
     def get_task_entry(self):
         return self.aws_dynamodb_client.get_item(
@@ -141,29 +164,48 @@ class Task:
             }
         )
 
-    def get_portgroup_entry(self, portgroup_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            }
-        )
-
-    def update_portgroup_entry(self, portgroup_name, portgroup_tasks):
-        response = self.aws_dynamodb_client.update_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            },
-            UpdateExpression='set tasks=:tasks',
-            ExpressionAttributeValues={
-                ':tasks': {'SS': portgroup_tasks}
+    def get_portgroup_entries(self, portgroup_names):
+        """Reads the security groups of all portgroups with one BatchGetItem; returns the items found by name"""
+        portgroup_entries = {}
+        request_items = {
+            f'{self.campaign_id}-portgroups': {
+                'Keys': [{'portgroup_name': {'S': p}} for p in set(portgroup_names)],
+                'ProjectionExpression': 'portgroup_name, securitygroup_id'
             }
-        )
-        assert response, f"update_portgroup_entry failed for portgroup_name {portgroup_name}"
+        }
+        while request_items:
+            response = self.aws_dynamodb_client.batch_get_item(RequestItems=request_items)
+            for item in response['Responses'].get(f'{self.campaign_id}-portgroups', []):
+                portgroup_entries[item['portgroup_name']['S']] = item
+            request_items = response.get('UnprocessedKeys')
+        return portgroup_entries
+
+    def add_portgroup_tasks(self, portgroup_name, task_names):
+        """
+        Adds tasks to a portgroup's task set in place, so concurrent launches and terminations cannot overwrite each
+        other. Returns False if the portgroup no longer exists.
+        """
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-portgroups',
+                Key={
+                    'portgroup_name': {'S': portgroup_name}
+                },
+                UpdateExpression='add tasks :task_names',
+                ConditionExpression='attribute_exists(portgroup_name)',
+                ExpressionAttributeValues={
+                    ':task_names': {'SS': task_names}
+                }
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                print({'portgroup_removed': {'portgroup_name': portgroup_name, 'tasks': task_names}})
+                return False
+            raise
         return True
 
-    def upload_object(self, instruct_user_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time):
+    def upload_object(self, instruct_user_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time,
+                      task_name=None):
         payload = {
             'instruct_user_id': instruct_user_id, 'instruct_instance': instruct_instance,
             'instruct_command': instruct_command, 'instruct_args': instruct_args, 'timestamp': timestamp,
@@ -173,19 +215,20 @@ class Task:
         response = self.aws_s3_client.put_object(
             Body=payload_bytes,
             Bucket=f'{self.campaign_id}-workspace',
-            Key=self.task_name + '/init.txt'
+            Key=(task_name or self.task_name) + '/init.txt'
         )
         assert response, f"Failed to initialize workspace for task_name {self.task_name}"
         return True
 
     def run_attack_task(self, securitygroups, end_time):
-        response = self.aws_ecs_client.run_task(
+        # The scheduler picks the subnet and paces the call
+        response = launch_scheduler.get_scheduler(self.region, self.subnet).run_task(
             cluster=f'{self.campaign_id}-cluster',
             count=1,
             launchType='FARGATE',
             networkConfiguration={
                 'awsvpcConfiguration': {
-                    'subnets': [self.subnet],
+                    'subnets': [],
                     'securityGroups': securitygroups,
                     'assignPublicIp': 'ENABLED'
                 }
@@ -230,147 +273,314 @@ class Task:
         assert response, f"get_interface_details failed for task_name {self.task_name}"
         return response
 
+    def stop_ecs_task(self, ecs_task_id, reason):
+        response = self.aws_ecs_client.stop_task(
+            cluster=f'{self.campaign_id}-cluster',
+            task=ecs_task_id,
+            reason=reason
+        )
+        assert response, f"stop_ecs_task failed for task_name {self.task_name}, ecs_task_id {ecs_task_id}"
+        return True
+
+    def seconds_left(self, deadline):
+        """Returns how long the readiness poller may keep waiting"""
+        seconds = deadline - t.monotonic()
+        if self.remaining_time is not None:
+            seconds = min(seconds, self.remaining_time() / 1000 - READINESS_SAFETY_MARGIN)
+        return seconds
+
+    def wait_for_attack_ip(self, ecs_task_id):
+        """
+        Polls the task and its network interface until the public IP is known, backing off exponentially with jitter.
+        Returns (attack_ip, ecs_task_details, provisioning details); attack_ip is None if the task stopped or the time
+        budget ran out first.
+        """
+        start = t.monotonic()
+        deadline = start + READINESS_TIMEOUT
+        delay = READINESS_INITIAL_DELAY
+        polls = 0
+        ecs_task_details = None
+        while True:
+            polls += 1
+            ecs_task_details = self.get_ecstask_details(ecs_task_id)
+            ecs_task = ecs_task_details['tasks'][0] if ecs_task_details['tasks'] else {}
+            if ecs_task.get('lastStatus') == 'STOPPED':
+                return None, ecs_task_details, {'polls': polls, 'stopped_reason': ecs_task.get('stoppedReason')}
+            interface_id = get_interface_id(ecs_task)
+            if interface_id:
+                try:
+                    interface_details = self.get_interface_details(interface_id)
+                except ClientError as error:
+                    # The interface can be listed on the task before EC2 will describe it
+                    if error.response['Error']['Code'] != 'InvalidNetworkInterfaceID.NotFound':
+                        raise
+                else:
+                    association = interface_details['NetworkInterfaces'][0].get('Association', {})
+                    if association.get('PublicIp'):
+                        provisioning = {'polls': polls, 'provisioning_seconds': round(t.monotonic() - start, 3)}
+                        return association['PublicIp'], ecs_task_details, provisioning
+            pause = delay / 2 + random.uniform(0, delay / 2)
+            if self.seconds_left(deadline) < pause:
+                return None, ecs_task_details, {'polls': polls, 'provisioning_seconds': round(t.monotonic() - start, 3)}
+            t.sleep(pause)
+            delay = min(delay * 2, READINESS_MAX_DELAY)
+
     def add_task_entry(self, instruct_user_id, instruct_instance, instruct_command, instruct_args, task_host_name,
-                       task_domain_name, attack_ip, portgroups, ecs_task_id, timestamp, end_time):
+                       task_domain_name, attack_ip, portgroups, ecs_task_id, timestamp, end_time, launch_status=None):
         task_status = 'starting'
+        update_expression = 'set task_type=:task_type, task_context=:task_context, task_status=:task_status, ' \
+                            'task_host_name=:task_host_name, task_domain_name=:task_domain_name, attack_ip=:attack_ip,' \
+                            'local_ip=:local_ip, portgroups=:portgroups, instruct_instances=:instruct_instances, ' \
+                            'last_instruct_user_id=:last_instruct_user_id, ' \
+                            'last_instruct_instance=:last_instruct_instance, ' \
+                            'last_instruct_command=:last_instruct_command, last_instruct_args=:last_instruct_args, ' \
+                            'last_instruct_time=:last_instruct_time, create_time=:create_time, ' \
+                            'scheduled_end_time=:scheduled_end_time, user_id=:user_id, ecs_task_id=:ecs_task_id'
+        expression_attribute_values = {
+            ':task_type': {'S': self.task_type},
+            ':task_context': {'S': self.task_context},
+            ':task_status': {'S': task_status},
+            ':task_host_name': {'S': task_host_name},
+            ':task_domain_name': {'S': task_domain_name},
+            ':attack_ip': {'S': attack_ip},
+            ':local_ip': {'SS': ['None']},
+            ':portgroups': {'SS': portgroups},
+            ':instruct_instances': {'SS': [instruct_instance]},
+            ':last_instruct_user_id': {'S': instruct_user_id},
+            ':last_instruct_instance': {'S': instruct_instance},
+            ':last_instruct_command': {'S': instruct_command},
+            ':last_instruct_args': {'M': instruct_args},
+            ':last_instruct_time': {'S': 'None'},
+            ':create_time': {'S': timestamp},
+            ':scheduled_end_time': {'S': end_time},
+            ':user_id': {'S': self.user_id},
+            ':ecs_task_id': {'S': ecs_task_id}
+        }
+        if launch_status:
+            update_expression += ', launch_status=:launch_status'
+            expression_attribute_values[':launch_status'] = {'S': launch_status}
         response = self.aws_dynamodb_client.update_item(
             TableName=f'{self.campaign_id}-tasks',
             Key={
                 'task_name': {'S': self.task_name}
             },
-            UpdateExpression='set task_type=:task_type, task_context=:task_context, task_status=:task_status, '
-                             'task_host_name=:task_host_name, task_domain_name=:task_domain_name, attack_ip=:attack_ip,'
-                             'local_ip=:local_ip, portgroups=:portgroups, instruct_instances=:instruct_instances, '
-                             'last_instruct_user_id=:last_instruct_user_id, '
-                             'last_instruct_instance=:last_instruct_instance, '
-                             'last_instruct_command=:last_instruct_command, last_instruct_args=:last_instruct_args, '
-                             'last_instruct_time=:last_instruct_time, create_time=:create_time, '
-                             'scheduled_end_time=:scheduled_end_time, user_id=:user_id, ecs_task_id=:ecs_task_id',
-            ExpressionAttributeValues={
-                ':task_type': {'S': self.task_type},
-                ':task_context': {'S': self.task_context},
-                ':task_status': {'S': task_status},
-                ':task_host_name': {'S': task_host_name},
-                ':task_domain_name': {'S': task_domain_name},
-                ':attack_ip': {'S': attack_ip},
-                ':local_ip': {'SS': ['None']},
-                ':portgroups': {'SS': portgroups},
-                ':instruct_instances': {'SS': [instruct_instance]},
-                ':last_instruct_user_id': {'S': instruct_user_id},
-                ':last_instruct_instance': {'S': instruct_instance},
-                ':last_instruct_command': {'S': instruct_command},
-                ':last_instruct_args': {'M': instruct_args},
-                ':last_instruct_time': {'S': 'None'},
-                ':create_time': {'S': timestamp},
-                ':scheduled_end_time': {'S': end_time},
-                ':user_id': {'S': self.user_id},
-                ':ecs_task_id': {'S': ecs_task_id}
-            }
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=expression_attribute_values
         )
         assert response, f"add_task_entry failed for task_name {self.task_name}"
         return True
 
-    def run_task(self):
+    def update_launch_entry(self, launch_status, attributes=None):
+        """
+        Records launch progress on the task entry. Only succeeds while the entry exists, so a task that was killed
+        during its launch is not recreated; returns False in that case.
+        """
+        update_expression = 'set launch_status=:launch_status'
+        expression_attribute_values = {':launch_status': {'S': launch_status}}
+        for k, v in (attributes or {}).items():
+            update_expression += f', {k}=:{k}'
+            expression_attribute_values[f':{k}'] = v
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-tasks',
+                Key={
+                    'task_name': {'S': self.task_name}
+                },
+                UpdateExpression=update_expression,
+                ConditionExpression='attribute_exists(task_name)',
+                ExpressionAttributeValues=expression_attribute_values
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def invoke_launch_job(self, ecs_task_id):
+        """Hands the rest of an asynchronous launch to a new invocation of this function"""
+        launch_job = {
+            'task_name': self.task_name, 'user_id': self.user_id, 'detail': self.detail, 'ecs_task_id': ecs_task_id
+        }
+        response = self.aws_lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'launch_job': launch_job}).encode('utf-8')
+        )
+        assert response, f"invoke_launch_job failed for task_name {self.task_name}"
+        return True
+
+    def parse_detail(self):
+        """Reads the launch options from detail, returning an error response if they are invalid"""
         if 'task_type' not in self.detail:
             return format_response(400, 'failed', 'invalid detail', self.log)
         self.task_type = self.detail['task_type']
 
-        task_type_entry = self.get_task_type_entry()
-        if 'Item' not in task_type_entry:
-            return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
-
         # If portgroups are requested, do some sanity checks.
         if 'portgroups' in self.detail:
-            portgroups = self.detail['portgroups']
-            if not isinstance(portgroups, list):
+            self.portgroups = self.detail['portgroups']
+            if not isinstance(self.portgroups, list):
                 return format_response(400, 'failed', 'portgroups must be type list', self.log)
-            if len(portgroups) > 5:
+            if len(self.portgroups) > 5:
                 return format_response(400, 'failed', 'portgroups limit exceeded', self.log)
         else:
-            portgroups = ['None']
+            self.portgroups = ['None']
 
         if 'end_time' in self.detail and self.detail['end_time']:
-            end_time = self.detail['end_time']
+            self.end_time = self.detail['end_time']
         else:
-            end_time = 'None'
-        if end_time != 'None':
+            self.end_time = 'None'
+        if self.end_time != 'None':
             try:
-                datetime.strptime(end_time, "%m/%d/%Y %H:%M:%S %z")
+                datetime.strptime(self.end_time, "%m/%d/%Y %H:%M:%S %z")
             except:
                 return format_response(
                     400, 'failed', 'invalid detail: end_time must be formatted as "%m/%d/%Y %H:%M:%S %z"', self.log
                 )
 
+        self.task_host_name = 'None'
+        self.task_domain_name = 'None'
+        if 'task_domain_name' in self.detail and 'task_host_name' in self.detail:
+            self.task_domain_name = self.detail['task_domain_name']
+            self.task_host_name = self.detail['task_host_name']
+        return None
+
+    def validate_request(self):
+        """
+        Checks the request against the campaign's tables and collects the task's security groups. Returns an error
+        response if the task cannot be launched.
+        """
+        invalid = self.parse_detail()
+        if invalid:
+            return invalid
+
+        task_type_entry = self.task_type_entry = self.get_task_type_entry()
+        if 'Item' not in task_type_entry:
+            return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
+
         # Verify that the task_name is unique.
         conflict = self.get_task_entry()
         if 'Item' in conflict:
             return format_response(409, 'failed', f'{self.task_name} already exists', self.log)
 
-        task_host_name = 'None'
-        task_domain_name = 'None'
-        task_hosted_zone = None
-        domain_entry = None
         # If host_name and domain_name are present in the run_task request, make sure the domain_name exists
         # and the host_name does not already exist for another task.
-        if 'task_domain_name' in self.detail and 'task_host_name' in self.detail:
-            task_domain_name = self.detail['task_domain_name']
-            task_host_name = self.detail['task_host_name']
-            if task_domain_name != 'None':
-                length = len(f'{task_host_name}.{task_domain_name}')
-                if length > 253:
-                    return format_response(
-                        400, 'failed', f'{task_host_name}.{task_domain_name} cannot exceed 253 characters', self.log
-                    )
-                valid_host_name = re.compile(
-                    '^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*'
-                    '([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+        task_host_name = self.task_host_name
+        task_domain_name = self.task_domain_name
+        if task_domain_name != 'None':
+            length = len(f'{task_host_name}.{task_domain_name}')
+            if length > 253:
+                return format_response(
+                    400, 'failed', f'{task_host_name}.{task_domain_name} cannot exceed 253 characters', self.log
                 )
-                host_name_match = valid_host_name.match(f'{task_host_name}.{task_domain_name}')
-                if not host_name_match:
-                    return format_response(
-                        400, 'failed', f'{task_host_name}.{task_domain_name} is not DNS compliant', self.log
-                    )
-                domain_entry = self.get_domain_entry(task_domain_name)
-                if 'Item' not in domain_entry:
-                    return format_response(404, 'failed', f'domain_name {task_domain_name} does not exist', self.log)
-                if task_host_name in domain_entry['Item']['host_names']['SS']:
-                    return format_response(409, 'failed', f'{task_host_name} already exists', self.log)
-                task_hosted_zone = domain_entry['Item']['hosted_zone']['S']
-
-        securitygroups = []
-        if 'None' not in portgroups:
-            for portgroup in portgroups:
-                portgroup_entry = self.get_portgroup_entry(portgroup)
-                if 'Item' in portgroup_entry:
-                    securitygroup_id = portgroup_entry['Item']['securitygroup_id']['S']
-                    securitygroups.append(securitygroup_id)
-                    if 'None' in portgroup_entry['Item']['tasks']['SS']:
-                        portgroup_tasks = []
-                    else:
-                        portgroup_tasks = portgroup_entry['Item']['tasks']['SS']
-                    portgroup_tasks.append(self.task_name)
-                    self.update_portgroup_entry(portgroup, portgroup_tasks)
-                else:
+            valid_host_name = re.compile(
+                '^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*'
+                '([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+            )
+            host_name_match = valid_host_name.match(f'{task_host_name}.{task_domain_name}')
+            if not host_name_match:
+                return format_response(
+                    400, 'failed', f'{task_host_name}.{task_domain_name} is not DNS compliant', self.log
+                )
+            self.domain_entry = self.get_domain_entry(task_domain_name)
+            if 'Item' not in self.domain_entry:
+                return format_response(404, 'failed', f'domain_name {task_domain_name} does not exist', self.log)
+            if task_host_name in self.domain_entry['Item']['host_names']['SS']:
+                return format_response(409, 'failed', f'{task_host_name} already exists', self.log)
+
+        if 'None' not in self.portgroups:
+            portgroup_entries = self.get_portgroup_entries(self.portgroups)
+            for portgroup in self.portgroups:
+                if portgroup not in portgroup_entries:
                     return format_response(404, 'failed', f'portgroup_name: {portgroup} does not exist', self.log)
-        self.run_attack_task(securitygroups, end_time)
-        # Log task execution details
-        ecs_task_id = self.run_task_response['tasks'][0]['taskArn']
-        t.sleep(15)
-        ecs_task_details = self.get_ecstask_details(ecs_task_id)
-        interface_id = ecs_task_details['tasks'][0]['attachments'][0]['details'][1]['value']
-        interface_details = self.get_interface_details(interface_id)
-        attack_ip = interface_details['NetworkInterfaces'][0]['Association']['PublicIp']
+                securitygroup_id = portgroup_entries[portgroup]['securitygroup_id']['S']
+                if securitygroup_id not in self.securitygroups:
+                    self.securitygroups.append(securitygroup_id)
+        return None
+
+    def associate_portgroups(self):
+        """Adds the task to its portgroups"""
+        if 'None' in self.portgroups:
+            return
+        for portgroup in set(self.portgroups):
+            self.add_portgroup_tasks(portgroup, [self.task_name])
+
+    def register_host_name(self, attack_ip):
+        """
+        Creates the task's Route53 record and adds it to its domain entry. With wait_for_dns in detail, waits until the
+        record is INSYNC so the host name resolves once execute returns.
+        """
+        self.add_host_record(attack_ip)
+        self.add_domain_host()
+
+    def add_host_record(self, attack_ip):
+        domain_entry = self.domain_entry or self.get_domain_entry(self.task_domain_name)
+        task_hosted_zone = domain_entry['Item']['hosted_zone']['S']
+        wait_insync = str(self.detail.get('wait_for_dns', 'no')).lower() in ['yes', 'true']
+        self.dns_change = self.create_resource_record(
+            task_hosted_zone, self.task_host_name, self.task_domain_name, attack_ip, wait_insync
+        )
+
+    def add_domain_host(self):
+        domain_entry = self.domain_entry or self.get_domain_entry(self.task_domain_name)
+        if 'None' in domain_entry['Item']['tasks']['SS']:
+            domain_tasks = []
+        else:
+            domain_tasks = domain_entry['Item']['tasks']['SS']
+        domain_tasks.append(self.task_name)
+        if 'None' in domain_entry['Item']['host_names']['SS']:
+            domain_host_names = []
+        else:
+            domain_host_names = domain_entry['Item']['host_names']['SS']
+        domain_host_names.append(self.task_host_name)
+        self.update_domain_entry(self.task_domain_name, domain_tasks, domain_host_names)
+
+    def record_execution(self, ecs_task_details, attack_ip, provisioning):
         recorded_info = {
             'task_executed': {
                 'user_id': self.user_id, 'task_name': self.task_name, 'task_context': self.task_context,
-                'task_type': self.task_type, 'task_domain_name': task_domain_name, 'task_host_name': task_host_name
+                'task_type': self.task_type, 'task_domain_name': self.task_domain_name,
+                'task_host_name': self.task_host_name
             },
             'task_details': ecs_task_details,
-            'interface_details': attack_ip
+            'interface_details': attack_ip,
+            'provisioning': provisioning
         }
         print(recorded_info)
 
-        # Send Initialize command to the task
+    def run_task(self):
+        invalid = self.validate_request()
+        if invalid:
+            return invalid
+        if str(self.detail.get('async', 'no')).lower() in ['yes', 'true']:
+            return self.start_task()
+
+        standby_task = self.claim_standby_task()
+        if standby_task:
+            response = self.assign_standby_task(standby_task)
+            if response:
+                return response
+            # The standby task was stopped and cleaned up; the setup is repeated for a new task below
+            self.domain_entry = None
+            self.dns_change = None
+
+        try:
+            self.run_attack_task(self.securitygroups, self.end_time)
+        except launch_scheduler.PlacementError as error:
+            return format_response(503, 'failed', f'task {self.task_name} could not be launched: {error}', self.log)
+        ecs_task_id = self.run_task_response['tasks'][0]['taskArn']
+
+        # Wait for the task's network interface to get a public IP
+        attack_ip, ecs_task_details, provisioning = self.wait_for_attack_ip(ecs_task_id)
+        if not attack_ip:
+            self.stop_ecs_task(ecs_task_id, f'Task did not become reachable for {self.user_id}')
+            print({'task_not_ready': {'task_name': self.task_name, 'ecs_task_id': ecs_task_id, **provisioning}})
+            return format_response(
+                504, 'failed', f'task {self.task_name} did not receive a public IP in time and was stopped', self.log
+            )
+
+        # Log task execution details
+        self.record_execution(ecs_task_details, attack_ip, provisioning)
+
         instruct_user_id = 'None'
         instruct_instance = 'None'
         instruct_command = 'Initialize'
@@ -380,27 +590,331 @@ class Task:
         else:
             end_time = 'None'
         timestamp = datetime.now().strftime('%s')
-        self.upload_object(instruct_user_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time)
-
+        instruct_args_fixup = dynamodb_codec.marshal_map(instruct_args)
+
+        # None of these steps needs another's result, so they run side by side
+        steps = {
+            # Associate the task with its portgroups now that it is running
+            'portgroups': self.associate_portgroups,
+            # Add task entry to tasks table in DynamoDB
+            'task_entry': lambda: self.add_task_entry(
+                instruct_user_id, instruct_instance, instruct_command, instruct_args_fixup, self.task_host_name,
+                self.task_domain_name, attack_ip, self.portgroups, ecs_task_id, timestamp, end_time
+            )
+        }
         # Create a Route53 resource record if a host_name/domain_name is requested for the task.
-        if task_host_name != 'None' and task_domain_name != 'None':
-            self.create_resource_record(task_hosted_zone, task_host_name, task_domain_name, attack_ip)
-            if 'None' in domain_entry['Item']['tasks']['SS']:
-                domain_tasks = []
-            else:
-                domain_tasks = domain_entry['Item']['tasks']['SS']
-            domain_tasks.append(self.task_name)
-            if 'None' in domain_entry['Item']['host_names']['SS']:
-                domain_host_names = []
-            else:
-                domain_host_names = domain_entry['Item']['host_names']['SS']
-            domain_host_names.append(task_host_name)
-            self.update_domain_entry(task_domain_name, domain_tasks, domain_host_names)
-
-        # Add task entry to tasks table in DynamoDB
-        instruct_args_fixup = {'no_args': {'S': 'True'}}
-        self.add_task_entry(instruct_user_id, instruct_instance, instruct_command, instruct_args_fixup, task_host_name,
-                            task_domain_name, attack_ip, portgroups, ecs_task_id, timestamp, end_time)
+        if self.task_host_name != 'None' and self.task_domain_name != 'None':
+            steps['host_record'] = lambda: self.add_host_record(attack_ip)
+            steps['domain_entry'] = self.add_domain_host
+        completed, errors = self.run_steps(steps)
+        if not errors:
+            # Send Initialize command to the task once its entry exists, so its first result finds the entry
+            initialized, errors = self.run_steps({'initialize': lambda: self.upload_object(
+                instruct_user_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time
+            )})
+            completed += initialized
+        if errors:
+            self.compensate(completed, ecs_task_id, attack_ip)
+            return format_response(
+                500, 'failed', f'execute task failed for {self.task_name}; the task was stopped and cleaned up',
+                self.log, errors=errors
+            )
 
         # Send response
-        return format_response(200, 'success', 'execute task succeeded', None, attack_ip=attack_ip)
+        return format_response(
+            200, 'success', 'execute task succeeded', None, attack_ip=attack_ip, dns_change=self.dns_change
+        )
+
+    def run_steps(self, steps):
+        """
+        Runs independent steps concurrently. Returns the names of the steps that completed and the error of each step
+        that raised, by name.
+        """
+        start = t.monotonic()
+        completed = []
+        errors = {}
+        with ThreadPoolExecutor(max_workers=max(1, POST_LAUNCH_CONCURRENCY)) as pool:
+            futures = {name: pool.submit(step) for name, step in steps.items()}
+            for name, future in futures.items():
+                error = future.exception()
+                if error:
+                    errors[name] = f'{type(error).__name__}: {error}'
+                else:
+                    completed.append(name)
+        print({'post_launch': {
+            'task_name': self.task_name, 'steps': list(steps), 'concurrency': POST_LAUNCH_CONCURRENCY,
+            'seconds': round(t.monotonic() - start, 3), 'errors': errors
+        }})
+        return completed, errors
+
+    def compensate(self, completed, ecs_task_id, attack_ip):
+        """
+        Undoes the post-launch steps that completed when another one failed, then stops the container. Undo failures
+        are logged and do not stop the remaining cleanup.
+        """
+        undo = {
+            'portgroups': lambda: [self.remove_portgroup_task(p) for p in set(self.portgroups) if p != 'None'],
+            'initialize': self.delete_init_object,
+            'task_entry': self.delete_task_entry,
+            'host_record': lambda: self.delete_host_record(attack_ip),
+            'domain_entry': self.remove_domain_host
+        }
+        for name in completed:
+            try:
+                undo[name]()
+            except Exception as error:
+                print({'compensation_failed': {'task_name': self.task_name, 'step': name, 'error': str(error)}})
+        self.stop_ecs_task(ecs_task_id, f'Launch of task {self.task_name} failed')
+
+    def remove_portgroup_task(self, portgroup_name):
+        """Removes the task from a portgroup's task set in place; does not recreate a portgroup deleted meanwhile"""
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-portgroups',
+                Key={
+                    'portgroup_name': {'S': portgroup_name}
+                },
+                UpdateExpression='delete tasks :task_name',
+                ConditionExpression='attribute_exists(portgroup_name)',
+                ExpressionAttributeValues={
+                    ':task_name': {'SS': [self.task_name]}
+                }
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        return True
+
+    def delete_init_object(self, task_name=None):
+        response = self.aws_s3_client.delete_object(
+            Bucket=f'{self.campaign_id}-workspace',
+            Key=(task_name or self.task_name) + '/init.txt'
+        )
+        assert response, f"delete_init_object failed for task_name {self.task_name}"
+        return True
+
+    def delete_task_entry(self):
+        response = self.aws_dynamodb_client.delete_item(
+            TableName=f'{self.campaign_id}-tasks',
+            Key={
+                'task_name': {'S': self.task_name}
+            }
+        )
+        assert response, f"delete_task_entry failed for task_name {self.task_name}"
+        return True
+
+    def delete_host_record(self, attack_ip):
+        domain_entry = self.domain_entry or self.get_domain_entry(self.task_domain_name)
+        dns_changes.coalescer.change(domain_entry['Item']['hosted_zone']['S'], [
+            dns_changes.a_record_change('DELETE', f'{self.task_host_name}.{self.task_domain_name}', attack_ip)
+        ])
+        return True
+
+    def remove_domain_host(self):
+        domain_entry = self.get_domain_entry(self.task_domain_name)
+        domain_tasks = [d for d in domain_entry['Item']['tasks']['SS'] if d != self.task_name] or ['None']
+        domain_host_names = [h for h in domain_entry['Item']['host_names']['SS'] if h != self.task_host_name]
+        self.update_domain_entry(self.task_domain_name, domain_tasks, domain_host_names or ['None'])
+        return True
+
+    def claim_standby_task(self):
+        """
+        Takes a running task from the task_type's standby pool, if it has one. Standby tasks are launched without
+        security groups, which cannot be changed on a Fargate task afterwards, so tasks with portgroups never use it.
+        """
+        pool_size = int(self.task_type_entry['Item'].get('standby_pool_size', {'N': '0'})['N'])
+        if not pool_size or 'None' not in self.portgroups:
+            return None
+        pool = standby_pool.Pool(self.campaign_id, self.task_type, self.subnet, self.region, self.log,
+                                 function_name=self.function_name)
+        standby_task = pool.claim()
+        # Replace the claimed task, or fill the pool if it ran dry
+        pool.invoke_replenish()
+        return standby_task
+
+    def wait_for_standby_ack(self):
+        """
+        Polls the task entry until the claimed standby task has reported its Initialize result, which moves the entry
+        out of starting. Returns the task status, 'starting' if STANDBY_ACK_TIMEOUT ran out first, or None if the entry
+        was removed meanwhile.
+        """
+        deadline = t.monotonic() + STANDBY_ACK_TIMEOUT
+        delay = READINESS_INITIAL_DELAY
+        while True:
+            response = self.aws_dynamodb_client.get_item(
+                TableName=f'{self.campaign_id}-tasks',
+                Key={
+                    'task_name': {'S': self.task_name}
+                },
+                ProjectionExpression='task_status',
+                ConsistentRead=True
+            )
+            if 'Item' not in response:
+                return None
+            task_status = response['Item']['task_status']['S']
+            if task_status != 'starting':
+                return task_status
+            pause = delay / 2 + random.uniform(0, delay / 2)
+            if self.seconds_left(deadline) < pause:
+                return task_status
+            t.sleep(pause)
+            delay = min(delay * 2, READINESS_MAX_DELAY)
+
+    def assign_standby_task(self, standby_task):
+        """
+        Completes execute with a claimed standby task. The container is still waiting on its standby name, so the
+        Initialize instruction is written there and carries the task_name it should adopt. The container must then
+        report the Initialize result under that task_name; if it does not within STANDBY_ACK_TIMEOUT, the standby
+        task is stopped and cleaned up and None is returned, so execute launches a new task instead.
+        """
+        ecs_task_id = standby_task['ecs_task_id']
+        attack_ip = standby_task['attack_ip']
+        self.record_execution({'standby_name': standby_task['standby_name'], 'ecs_task_id': ecs_task_id}, attack_ip,
+                              {'polls': 0, 'provisioning_seconds': 0})
+
+        instruct_args = {'task_name': self.task_name}
+        timestamp = datetime.now().strftime('%s')
+        steps = {
+            'task_entry': lambda: self.add_task_entry(
+                'None', 'None', 'Initialize', dynamodb_codec.marshal_map(instruct_args), self.task_host_name,
+                self.task_domain_name, attack_ip, self.portgroups, ecs_task_id, timestamp, self.end_time
+            )
+        }
+        if self.task_host_name != 'None' and self.task_domain_name != 'None':
+            steps['host_record'] = lambda: self.add_host_record(attack_ip)
+            steps['domain_entry'] = self.add_domain_host
+        completed, errors = self.run_steps(steps)
+        if not errors:
+            # The container adopts its task_name from Initialize, so it goes out once the task entry exists
+            initialized, errors = self.run_steps({'initialize': lambda: self.upload_object(
+                'None', 'None', 'Initialize', instruct_args, timestamp, self.end_time,
+                task_name=standby_task['standby_name']
+            )})
+            completed += initialized
+        if errors:
+            self.compensate(completed, ecs_task_id, attack_ip)
+            return format_response(
+                500, 'failed', f'execute task failed for {self.task_name}; the task was stopped and cleaned up',
+                self.log, errors=errors
+            )
+
+        task_status = self.wait_for_standby_ack()
+        if task_status is None:
+            # Killed while it was being assigned; the kill found a complete entry and cleaned up the task
+            return format_response(410, 'failed', f'task {self.task_name} was removed during launch', self.log)
+        if task_status == 'starting':
+            print({'standby_task_unacknowledged': {
+                'task_name': self.task_name, 'standby_name': standby_task['standby_name'], 'ecs_task_id': ecs_task_id,
+                'timeout': STANDBY_ACK_TIMEOUT
+            }})
+            try:
+                self.delete_init_object(standby_task['standby_name'])
+            except Exception as error:
+                print({'compensation_failed': {'task_name': self.task_name, 'step': 'initialize', 'error': str(error)}})
+            self.compensate([name for name in completed if name != 'initialize'], ecs_task_id, attack_ip)
+            return None
+        return format_response(
+            200, 'success', 'execute task succeeded', None, attack_ip=attack_ip, dns_change=self.dns_change
+        )
+
+    def start_task(self):
+        """
+        Asynchronous launch: starts the container, records a starting task entry and hands IP discovery, portgroups,
+        DNS and the Initialize instruction to a launch job
+        """
+        if not self.function_name:
+            return format_response(400, 'failed', 'asynchronous execute is not available', self.log)
+        try:
+            self.run_attack_task(self.securitygroups, self.end_time)
+        except launch_scheduler.PlacementError as error:
+            return format_response(503, 'failed', f'task {self.task_name} could not be launched: {error}', self.log)
+        ecs_task_id = self.run_task_response['tasks'][0]['taskArn']
+
+        # Portgroups and the host name are recorded on the entry by the launch job once they have been set up, so a
+        # task killed while it launches has nothing to clean up besides the container
+        instruct_args_fixup = dynamodb_codec.marshal_map({'no_args': 'True'})
+        timestamp = datetime.now().strftime('%s')
+        self.add_task_entry('None', 'None', 'Initialize', instruct_args_fixup, 'None', 'None', 'None', ['None'],
+                            ecs_task_id, timestamp, self.end_time, launch_status='launching')
+        self.invoke_launch_job(ecs_task_id)
+        return format_response(
+            202, 'success', 'execute task started', None, task_name=self.task_name, launch_status='launching'
+        )
+
+    def finish_launch(self, ecs_task_id):
+        """Completes an asynchronous launch started by start_task"""
+        invalid = self.parse_detail()
+        if invalid:
+            return invalid
+
+        attack_ip, ecs_task_details, provisioning = self.wait_for_attack_ip(ecs_task_id)
+        if not attack_ip:
+            self.stop_ecs_task(ecs_task_id, f'Task did not become reachable for {self.user_id}')
+            print({'task_not_ready': {'task_name': self.task_name, 'ecs_task_id': ecs_task_id, **provisioning}})
+            self.update_launch_entry('failed', {
+                'task_status': {'S': 'finished'},
+                'launch_error': {'S': provisioning.get('stopped_reason') or 'task did not receive a public IP in time'}
+            })
+            return format_response(504, 'failed', f'launch of task {self.task_name} failed', self.log)
+
+        if not self.update_launch_entry('configuring', {'attack_ip': {'S': attack_ip}}):
+            # The task was killed while it was launching
+            self.stop_ecs_task(ecs_task_id, f'Task {self.task_name} was removed during launch')
+            return format_response(410, 'failed', f'task {self.task_name} was removed during launch', self.log)
+
+        self.record_execution(ecs_task_details, attack_ip, provisioning)
+        steps = {'portgroups': self.associate_portgroups}
+        if self.task_host_name != 'None' and self.task_domain_name != 'None':
+            steps['host_record'] = lambda: self.add_host_record(attack_ip)
+            steps['domain_entry'] = self.add_domain_host
+        completed, errors = self.run_steps(steps)
+        if errors:
+            self.compensate(completed, ecs_task_id, attack_ip)
+            self.update_launch_entry('failed', {
+                'task_status': {'S': 'finished'},
+                'launch_error': {'S': f'post-launch setup failed: {errors}'}
+            })
+            return format_response(
+                500, 'failed', f'launch of task {self.task_name} failed; the task was stopped and cleaned up',
+                self.log, errors=errors
+            )
+
+        # A kill during configuring found no portgroups or host name on the entry and removed it, so when this update
+        # finds no entry the setup above is undone here and the task never receives Initialize
+        ready = self.update_launch_entry('ready', {
+            'portgroups': {'SS': self.portgroups},
+            'task_host_name': {'S': self.task_host_name},
+            'task_domain_name': {'S': self.task_domain_name},
+            'provisioning_seconds': {'N': str(provisioning['provisioning_seconds'])}
+        })
+        if not ready:
+            self.compensate(completed, ecs_task_id, attack_ip)
+            return format_response(410, 'failed', f'task {self.task_name} was removed during launch', self.log)
+
+        # The Initialize instruction goes out last so the task's first result finds a complete entry
+        timestamp = datetime.now().strftime('%s')
+        self.upload_object('None', 'None', 'Initialize', {'no_args': 'True'}, timestamp, self.end_time)
+        return format_response(
+            200, 'success', 'launch task succeeded', None, attack_ip=attack_ip, dns_change=self.dns_change
+        )
+
+    def launch_status(self):
+        """Reports the progress of a launch from the task entry alone"""
+        response = self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-tasks',
+            Key={
+                'task_name': {'S': self.task_name}
+            },
+            ProjectionExpression='task_status, launch_status, attack_ip, launch_error, provisioning_seconds'
+        )
+        if 'Item' not in response:
+            return format_response(404, 'failed', f'task_name {self.task_name} not found', self.log)
+        item = response['Item']
+        # Tasks launched synchronously are ready as soon as their entry exists
+        launch_status = item.get('launch_status', {'S': 'ready'})['S']
+        return format_response(
+            200, 'success', 'launch_status succeeded', None, task_name=self.task_name, launch_status=launch_status,
+            task_status=item['task_status']['S'], attack_ip=item['attack_ip']['S'],
+            launch_error=item.get('launch_error', {}).get('S'),
+            provisioning_seconds=item.get('provisioning_seconds', {}).get('N')
+        )
@@ -0,0 +1,297 @@
+import os
+import json
+import uuid
+import aws_clients
+import dynamodb_codec
+from botocore.exceptions import ClientError
+from datetime import datetime
+
+# Most instructions that may wait on one task; interact answers 429 once the queue is full
+MAX_PENDING_INSTRUCTIONS = int(os.environ.get('MAX_PENDING_INSTRUCTIONS', 25))
+# Attempts for queue updates that can lose a race with a concurrent dispatch or cancel
+QUEUE_UPDATE_ATTEMPTS = 3
+
+
+class InstructionQueue:
+
+    def __init__(self, campaign_id, task_name, region):
+        """
+        FIFO of instructions waiting for a busy or starting task, kept in the pending_instructions list of the task
+        entry. interact adds to it, and result delivery dispatches its head once the task reports back and is idle.
+        """
+        self.campaign_id = campaign_id
+        self.task_name = task_name
+        self.region = region
+        self.__aws_dynamodb_client = None
+        self.__aws_s3_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    @property
+    def aws_s3_client(self):
+        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_s3_client is None:
+            self.__aws_s3_client = aws_clients.get_client('s3', self.region)
+        return self.__aws_s3_client
+
+    @staticmethod
+    def new_instruction(instruct_user_id, instruct_instance, instruct_command, instruct_args, end_time,
+                        pipeline_id=None, pipeline_step=None):
+        instruction = {
+            'instruction_id': uuid.uuid4().hex, 'instruct_user_id': instruct_user_id,
+            'instruct_instance': instruct_instance, 'instruct_command': instruct_command,
+            'instruct_args': instruct_args, 'end_time': end_time, 'queued_time': datetime.now().strftime('%s')
+        }
+        if pipeline_id:
+            # Step of an instruction pipeline; the task entry remembers which step is running once it is sent
+            instruction['pipeline_id'] = pipeline_id
+            instruction['pipeline_step'] = pipeline_step
+        return instruction
+
+    def get_pending(self):
+        response = self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-tasks',
+            Key={
+                'task_name': {'S': self.task_name}
+            },
+            ProjectionExpression='task_status, pending_instructions',
+            ConsistentRead=True
+        )
+        if 'Item' not in response:
+            return None, []
+        pending = [dynamodb_codec.unmarshal(i) for i in response['Item'].get('pending_instructions', {'L': []})['L']]
+        return response['Item']['task_status']['S'], pending
+
+    def conditional_update(self, **kwargs):
+        """
+        Runs a conditional update_item on the task entry. Returns (True, the updated attributes), or (False, the entry
+        as it stood) if the condition failed; that entry is None if the task no longer exists.
+        """
+        try:
+            response = self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-tasks',
+                Key={
+                    'task_name': {'S': self.task_name}
+                },
+                ReturnValuesOnConditionCheckFailure='ALL_OLD',
+                **kwargs
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False, error.response.get('Item')
+            raise
+        return True, response.get('Attributes', {})
+
+    def enqueue(self, instruction, at_head=False):
+        """
+        Appends instruction to the queue of a task that is busy or starting, or idle with instructions still queued.
+        The status and the queue limit are checked in the same conditional write. With at_head, the instruction is a
+        later pipeline step and goes to the front of the queue instead, as long as the task still runs its pipeline.
+        Returns the queue position (0 if the queue is full, None if the task cannot queue it) and the task entry as the
+        update found it.
+        """
+        if at_head:
+            update_expression = 'set pending_instructions=list_append(:instruction, ' \
+                                'if_not_exists(pending_instructions, :empty))'
+        else:
+            update_expression = 'set pending_instructions=list_append(if_not_exists(pending_instructions, :empty), ' \
+                                ':instruction)'
+        condition_expression = '(task_status IN (:busy, :starting) OR ' \
+                               '(task_status = :idle AND attribute_exists(pending_instructions[0]))) AND ' \
+                               '(attribute_not_exists(pending_instructions) OR ' \
+                               'size(pending_instructions) < :max_pending)'
+        expression_attribute_values = {
+            ':empty': {'L': []},
+            ':instruction': {'L': [dynamodb_codec.marshal(instruction)]},
+            ':busy': {'S': 'busy'},
+            ':starting': {'S': 'starting'},
+            ':idle': {'S': 'idle'},
+            ':max_pending': {'N': str(MAX_PENDING_INSTRUCTIONS)}
+        }
+        if at_head:
+            condition_expression += ' AND pipeline.pipeline_id = :pipeline_id'
+            expression_attribute_values[':pipeline_id'] = {'S': instruction['pipeline_id']}
+        queued, task_item = self.conditional_update(
+            UpdateExpression=update_expression,
+            ConditionExpression=condition_expression,
+            ExpressionAttributeValues=expression_attribute_values,
+            ReturnValues='UPDATED_NEW'
+        )
+        if not queued:
+            if task_item and len(task_item.get('pending_instructions', {'L': []})['L']) >= MAX_PENDING_INSTRUCTIONS:
+                return 0, task_item
+            return None, task_item
+        if at_head:
+            return 1, task_item
+        return len(task_item['pending_instructions']['L']), task_item
+
+    def dispatch(self, instruction, from_queue=False, ahead_of_queue=False):
+        """
+        Moves an idle task to busy and sends it instruction. The status check, the busy update and adding the
+        instruct_instance to instruct_instances are one conditional write, so concurrent callers cannot both send to
+        the task. With from_queue, instruction must be the head of the queue and is removed from it in the same write.
+        With ahead_of_queue, instruction is a later step of the pipeline the task runs and is sent while the task still
+        holds that pipeline, whatever is queued. Otherwise the queue must be empty, so an instruction sent directly
+        never overtakes queued ones. Returns (True, the updated task entry), or (False, the entry as it stood) without
+        sending anything.
+        """
+        timestamp = datetime.now().strftime('%s')
+        set_expression = 'set task_status=:busy, last_instruct_user_id=:last_instruct_user_id, ' \
+                         'last_instruct_instance=:last_instruct_instance, ' \
+                         'last_instruct_command=:last_instruct_command, last_instruct_args=:last_instruct_args, ' \
+                         'last_instruct_time=:last_instruct_time'
+        remove_paths = []
+        condition_expression = 'task_status = :idle'
+        expression_attribute_values = {
+            ':busy': {'S': 'busy'},
+            ':idle': {'S': 'idle'},
+            ':instruct_instance': {'SS': [instruction['instruct_instance']]},
+            ':last_instruct_user_id': {'S': instruction['instruct_user_id']},
+            ':last_instruct_instance': {'S': instruction['instruct_instance']},
+            ':last_instruct_command': {'S': instruction['instruct_command']},
+            ':last_instruct_args': {'M': dynamodb_codec.marshal_map(instruction['instruct_args'])},
+            ':last_instruct_time': {'S': timestamp}
+        }
+        if from_queue:
+            remove_paths.append('pending_instructions[0]')
+            condition_expression += ' AND pending_instructions[0].instruction_id = :instruction_id'
+            expression_attribute_values[':instruction_id'] = {'S': instruction['instruction_id']}
+        elif ahead_of_queue:
+            condition_expression += ' AND pipeline.pipeline_id = :pipeline_id'
+            expression_attribute_values[':pipeline_id'] = {'S': instruction['pipeline_id']}
+        else:
+            condition_expression += ' AND attribute_not_exists(pending_instructions[0])'
+        if 'pipeline_id' in instruction:
+            set_expression += ', running_pipeline_step=:running_pipeline_step'
+            expression_attribute_values[':running_pipeline_step'] = {'M': {
+                'pipeline_id': {'S': instruction['pipeline_id']},
+                'pipeline_step': {'N': str(instruction['pipeline_step'])}
+            }}
+        else:
+            remove_paths.append('running_pipeline_step')
+        update_expression = f'{set_expression} add instruct_instances :instruct_instance'
+        if remove_paths:
+            update_expression += f" remove {', '.join(remove_paths)}"
+        dispatched, task_item = self.conditional_update(
+            UpdateExpression=update_expression,
+            ConditionExpression=condition_expression,
+            ExpressionAttributeValues=expression_attribute_values,
+            ReturnValues='ALL_NEW'
+        )
+        if not dispatched:
+            return False, task_item
+        if 'None' in task_item['instruct_instances']['SS']:
+            # First instruction for the task: drop the placeholder the entry was created with
+            self.remove_instance_placeholder()
+        self.upload_object(instruction, timestamp)
+        return True, task_item
+
+    def remove_instance_placeholder(self):
+        response = self.aws_dynamodb_client.update_item(
+            TableName=f'{self.campaign_id}-tasks',
+            Key={
+                'task_name': {'S': self.task_name}
+            },
+            UpdateExpression='delete instruct_instances :placeholder',
+            ConditionExpression='attribute_exists(task_name)',
+            ExpressionAttributeValues={
+                ':placeholder': {'SS': ['None']}
+            }
+        )
+        assert response, f"remove_instance_placeholder failed for task_name {self.task_name}"
+        return True
+
+    def submit(self, instruction, task_item):
+        """
+        Sends instruction straight to an idle task with an empty queue, or queues it behind the instructions already
+        waiting for the task. A pipeline step after the first runs ahead of them instead: it is sent to an idle task
+        whatever is queued, or put at the head of the queue. task_item is the task entry as last read. Both paths are
+        conditional writes; when one fails because the task changed state, the entry it returns is used for the next
+        attempt instead of reading the task again. Returns (outcome, queue_position) with outcome one of sent, queued,
+        queue_full, not_running, not_found or conflict.
+        """
+        ahead_of_queue = bool(instruction.get('pipeline_step'))
+        for _ in range(QUEUE_UPDATE_ATTEMPTS):
+            task_status = task_item['task_status']['S']
+            pending = task_item.get('pending_instructions', {'L': []})['L']
+            if ahead_of_queue and task_item.get('pipeline', {}).get('M', {}).get('pipeline_id', {}).get('S') != \
+                    instruction['pipeline_id']:
+                # The pipeline was cancelled or has ended
+                return 'not_running', None
+            if task_status == 'idle' and (not pending or ahead_of_queue):
+                dispatched, task_item = self.dispatch(instruction, ahead_of_queue=ahead_of_queue)
+                if dispatched:
+                    return 'sent', None
+            elif task_status in ['idle', 'busy', 'starting']:
+                queue_position, task_item = self.enqueue(instruction, at_head=ahead_of_queue)
+                if task_status == 'idle' and task_item:
+                    # No result is on its way to move the queue of an idle task on, so its head is sent now
+                    sent = self.dispatch_next(task_item)
+                    if sent and sent['instruction_id'] == instruction['instruction_id']:
+                        return 'sent', None
+                if queue_position == 0:
+                    return 'queue_full', None
+                if queue_position:
+                    return 'queued', queue_position
+            else:
+                return 'not_running', None
+            if task_item is None:
+                return 'not_found', None
+        return 'conflict', None
+
+    def dispatch_next(self, task_item):
+        """
+        Sends the oldest pending instruction to a task that has just gone idle. task_item is the task entry as it was
+        written when the task went idle. Returns the instruction sent, or None.
+        """
+        pending = task_item.get('pending_instructions', {'L': []})['L']
+        if not pending:
+            return None
+        instruction = dynamodb_codec.unmarshal(pending[0])
+        dispatched, _ = self.dispatch(instruction, from_queue=True)
+        if not dispatched:
+            # An interact or another delivery got to the task first; the instruction stays queued
+            return None
+        print({'instruction_dispatched': {
+            'task_name': self.task_name, 'instruction_id': instruction['instruction_id'],
+            'instruct_command': instruction['instruct_command'], 'pending': len(pending) - 1
+        }})
+        return instruction
+
+    def cancel(self, instruction_id):
+        """Removes a pending instruction; returns False if it is not (or no longer) queued"""
+        for _ in range(QUEUE_UPDATE_ATTEMPTS):
+            _, pending = self.get_pending()
+            position = next((i for i, p in enumerate(pending) if p['instruction_id'] == instruction_id), None)
+            if position is None:
+                return False
+            removed, _ = self.conditional_update(
+                UpdateExpression=f'remove pending_instructions[{position}]',
+                ConditionExpression=f'pending_instructions[{position}].instruction_id = :instruction_id',
+                ExpressionAttributeValues={
+                    ':instruction_id': {'S': instruction_id}
+                }
+            )
+            if removed:
+                return True
+        return False
+
+    def upload_object(self, instruction, timestamp):
+        payload = {
+            'instruct_user_id': instruction['instruct_user_id'], 'instruct_instance': instruction['instruct_instance'],
+            'instruct_command': instruction['instruct_command'], 'instruct_args': instruction['instruct_args'],
+            'timestamp': timestamp, 'end_time': instruction['end_time']
+        }
+        payload_bytes = json.dumps(payload).encode('utf-8')
+        response = self.aws_s3_client.put_object(
+            Body=payload_bytes,
+            Bucket=f'{self.campaign_id}-workspace',
+            Key=self.task_name + '/' + timestamp
+        )
+        assert response, f"Failed to upload object to workspace for task_name {self.task_name}"
+        return True
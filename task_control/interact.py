@@ -1,7 +1,9 @@
 import json
-import boto3
-
-from datetime import datetime
+import aws_clients
+import dynamodb_codec
+import task_type_cache
+import instruction_queue
+import instruction_pipeline
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -18,6 +20,17 @@ def format_response(status_code, result, message, log, **kwargs):
     return {'statusCode': status_code, 'body': json.dumps(response)}
 
 
+def invalid_instruct_args(instruct_args):
+    """Returns an error message if instruct_args cannot be stored in DynamoDB (such as 1e400 or NaN), or None"""
+    if not isinstance(instruct_args, dict):
+        return 'instruct_args must be a map'
+    try:
+        dynamodb_codec.marshal_map(instruct_args)
+    except (TypeError, ValueError) as error:
+        return f'instruct_args cannot be stored: {error}'
+    return None
+
+
 class Task:
 
     def __init__(self, campaign_id, task_name, region, detail: dict, user_id, log):
@@ -28,84 +41,33 @@ class Task:
         self.user_id = user_id
         self.log = log
         self.__aws_dynamodb_client = None
-        self.__aws_s3_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
-    @property
-    def aws_s3_client(self):
-        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
-        if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
-        return self.__aws_s3_client
-
     def get_task_entry(self):
         response = self.aws_dynamodb_client.get_item(
             TableName=f'{self.campaign_id}-tasks',
             Key={
                 'task_name': {'S': self.task_name}
-            }
+            },
+            ProjectionExpression='task_type, task_status'
         )
         assert response, f"get_task_entry failed for task_name {self.task_name}"
         return response
 
-    def get_task_type(self, task_type):
-        response = self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-task-types',
-            Key={
-                'task_type': {'S': task_type}
-            }
-        )
-        assert response, f"get_task_type failed for task_type {task_type}"
-        return response
-
-    def set_task_busy(self, instruct_instances, instruct_instance, instruct_command, instruct_args, timestamp):
-        task_status = 'busy'
-        response = self.aws_dynamodb_client.update_item(
-            TableName=f'{self.campaign_id}-tasks',
-            Key={
-                'task_name': {'S': self.task_name}
-            },
-            UpdateExpression='set task_status=:task_status, instruct_instances=:instruct_instances, '
-                             'last_instruct_user_id=:last_instruct_user_id, '
-                             'last_instruct_instance=:last_instruct_instance, '
-                             'last_instruct_command=:last_instruct_command, last_instruct_args=:last_instruct_args, '
-                             'last_instruct_time=:last_instruct_time',
-            ExpressionAttributeValues={
-                ':task_status': {'S': task_status},
-                ':instruct_instances': {'SS': instruct_instances},
-                ':last_instruct_user_id': {'S': self.user_id},
-                ':last_instruct_instance': {'S': instruct_instance},
-                ':last_instruct_command': {'S': instruct_command},
-                ':last_instruct_args': {'M': instruct_args},
-                ':last_instruct_time': {'S': timestamp}
-            }
-        )
-        assert response, f"add_task_entry failed for task_name {self.task_name}"
-        return True
-
-    def upload_object(self, instruct_instance, instruct_command, instruct_args, end_time, timestamp):
-        payload = {
-            'instruct_user_id': self.user_id, 'instruct_instance': instruct_instance,
-            'instruct_command': instruct_command, 'instruct_args': instruct_args, 'timestamp': timestamp,
-            'end_time': end_time
-        }
-        payload_bytes = json.dumps(payload).encode('utf-8')
-        response = self.aws_s3_client.put_object(
-            Body=payload_bytes,
-            Bucket=f'{self.campaign_id}-workspace',
-            Key=self.task_name + '/' + timestamp
-        )
-        assert response, f"Failed to upload object to workspace for task_name {self.task_name}"
-        return True
+    def get_capabilities(self, task_type):
+        """Returns the task_type's capabilities as a frozenset, from the container's task_type cache when possible"""
+        _, capabilities = task_type_cache.lookup(self.campaign_id, self.region, task_type)
+        return capabilities
 
     def instruct(self):
-        timestamp = datetime.now().strftime('%s')
+        if 'pipeline' in self.detail:
+            return self.start_pipeline()
         try:
             instruct_command = self.detail['instruct_command']
         except:
@@ -123,6 +85,9 @@ class Task:
             end_time = self.detail['end_time']
         else:
             end_time = 'None'
+        invalid = invalid_instruct_args(instruct_args)
+        if invalid:
+            return format_response(400, 'failed', invalid, self.log)
 
         # Validate that task exists and error if it does not
         task_entry = self.get_task_entry()
@@ -131,42 +96,80 @@ class Task:
 
         # Get task capabilities from the task and validate instruct_command
         task_type = task_entry['Item']['task_type']['S']
-        task_type_details = self.get_task_type(task_type)
-        capabilities = task_type_details['Item']['capabilities']['SS']
+        capabilities = self.get_capabilities(task_type)
         if instruct_command not in capabilities:
             return format_response(400, 'failed', f'{instruct_command} not valid for task_name {self.task_name}',
                                    self.log)
 
-        # Validate that task is idle
-        if task_entry['Item']['task_status']['S'] == 'starting':
-            return format_response(409, 'failed', f'task {self.task_name} is still starting', self.log)
-        if task_entry['Item']['task_status']['S'] == 'busy':
-            return format_response(409, 'failed', f'task {self.task_name} is busy', self.log)
-        if task_entry['Item']['task_status']['S'] == 'finished':
+        # Send the instruction straight to an idle task, or queue it behind the instruction the task is working on
+        queue = instruction_queue.InstructionQueue(self.campaign_id, self.task_name, self.region)
+        instruction = queue.new_instruction(self.user_id, instruct_instance, instruct_command, instruct_args, end_time)
+        outcome, queue_position = queue.submit(instruction, task_entry['Item'])
+        return self.submit_response(outcome, queue_position, instruction_id=instruction['instruction_id'])
+
+    def submit_response(self, outcome, queue_position, **kwargs):
+        """Turns an InstructionQueue.submit outcome into the interact response"""
+        if outcome == 'sent':
+            return format_response(200, 'success', f'interact with {self.task_name} succeeded', None,
+                                   pipeline_id=kwargs.get('pipeline_id'))
+        if outcome == 'queued':
+            return format_response(202, 'success', f'instruction queued for task {self.task_name}', None,
+                                   queue_position=queue_position, **kwargs)
+        if outcome == 'queue_full':
+            return format_response(429, 'failed', f'instruction queue for task {self.task_name} is full', self.log)
+        if outcome == 'not_found':
+            return format_response(404, 'failed', f'task_name {self.task_name} not found', self.log)
+        if outcome == 'not_running':
             return format_response(409, 'failed', f'task {self.task_name} no longer running', self.log)
+        return format_response(409, 'failed', f'task {self.task_name} is changing state, try again', self.log)
+
+    def start_pipeline(self):
+        """Sends the first instruction of a pipeline; result delivery sends the others as each result comes in"""
+        if 'end_time' in self.detail and self.detail['end_time']:
+            end_time = self.detail['end_time']
+        else:
+            end_time = 'None'
 
-        # Add new instruct_instance to instruct_instances list
-        instruct_instances = task_entry['Item']['instruct_instances']['SS']
-        if instruct_instances[0] == 'None':
-            instruct_instances.clear()
-        if instruct_instance not in instruct_instances:
-            instruct_instances.append(instruct_instance)
-
-        # Convert instruct_args to DynamoDB map format
-        instruct_args_fixup = {}
-        for k, v in instruct_args.items():
-            if isinstance(v, str):
-                instruct_args_fixup[k] = {'S': f'{v}'}
-            if isinstance(v, int) and not isinstance(v, bool):
-                instruct_args_fixup[k] = {'N': f'{v}'}
-            if isinstance(v, bool):
-                instruct_args_fixup[k] = {'BOOL': v}
-            if isinstance(v, bytes):
-                instruct_args_fixup[k] = {'B': f'{v}'}
-
-        # Set task to busy and send instructions to the task
-        self.set_task_busy(instruct_instances, instruct_instance, instruct_command, instruct_args_fixup, timestamp)
-        self.upload_object(instruct_instance, instruct_command, instruct_args, end_time, timestamp)
-
-        # Send response
-        return format_response(200, 'success', f'interact with {self.task_name} succeeded', None)
+        task_entry = self.get_task_entry()
+        if 'Item' not in task_entry:
+            return format_response(404, 'failed', f'task_name {self.task_name} not found', self.log)
+        capabilities = self.get_capabilities(task_entry['Item']['task_type']['S'])
+        invalid = instruction_pipeline.Pipeline.validate(self.detail['pipeline'], capabilities)
+        if invalid:
+            return format_response(400, 'failed', invalid, self.log)
+
+        pipeline = instruction_pipeline.Pipeline(self.campaign_id, self.task_name, self.region)
+        pipeline_id, outcome, queue_position = pipeline.start(self.detail['pipeline'], self.user_id, end_time,
+                                                              task_entry['Item'])
+        if pipeline_id is None:
+            return format_response(409, 'failed', f'task {self.task_name} is already running a pipeline', self.log)
+        return self.submit_response(outcome, queue_position, pipeline_id=pipeline_id)
+
+    def cancel_pipeline(self):
+        if 'pipeline_id' not in self.detail:
+            return format_response(400, 'failed', 'missing pipeline_id', self.log)
+        pipeline_id = self.detail['pipeline_id']
+        pipeline = instruction_pipeline.Pipeline(self.campaign_id, self.task_name, self.region)
+        if not pipeline.cancel(pipeline_id):
+            return format_response(404, 'failed', f'pipeline {pipeline_id} is not running on task {self.task_name}',
+                                   self.log)
+        return format_response(200, 'success', f'pipeline {pipeline_id} cancelled', None)
+
+    def queue_status(self):
+        """Lists the instructions waiting for the task, oldest first"""
+        queue = instruction_queue.InstructionQueue(self.campaign_id, self.task_name, self.region)
+        task_status, pending = queue.get_pending()
+        if task_status is None:
+            return format_response(404, 'failed', f'task_name {self.task_name} not found', self.log)
+        return format_response(200, 'success', None, None, task_status=task_status, queue_depth=str(len(pending)),
+                               pending_instructions=dynamodb_codec.to_json(pending))
+
+    def cancel_instruction(self):
+        if 'instruction_id' not in self.detail:
+            return format_response(400, 'failed', 'missing instruction_id', self.log)
+        instruction_id = self.detail['instruction_id']
+        queue = instruction_queue.InstructionQueue(self.campaign_id, self.task_name, self.region)
+        if not queue.cancel(instruction_id):
+            return format_response(404, 'failed', f'instruction {instruction_id} is not queued for task '
+                                                  f'{self.task_name}', self.log)
+        return format_response(200, 'success', f'instruction {instruction_id} cancelled', None)
@@ -2,7 +2,11 @@ import re
 import os
 import json
 import execute
+import bulk_execute
+import standby_pool
 import interact
+import broadcast
+import schedules
 import results_queue
 
 
@@ -26,6 +30,31 @@ def lambda_handler(event, context):
     subnet = os.environ['SUBNET']
     log = {'event': event}
 
+    if 'launch_job' in event:
+        # Second half of an asynchronous execute, invoked by the request that started the task
+        launch_job = event['launch_job']
+        launch_task = execute.Task(
+            campaign_id, launch_job['task_name'], subnet, region, launch_job['detail'], launch_job['user_id'], log,
+            context.get_remaining_time_in_millis
+        )
+        response = launch_task.finish_launch(launch_job['ecs_task_id'])
+        return response
+
+    if 'replenish_pool' in event:
+        # Background refill of a task_type's standby pool after a task was claimed from it
+        pool = standby_pool.Pool(
+            campaign_id, event['replenish_pool']['task_type'], subnet, region, log,
+            context.get_remaining_time_in_millis
+        )
+        response = pool.replenish()
+        return response
+
+    if 'run_schedules' in event:
+        # Periodic scheduler run, invoked by an EventBridge rule
+        scheduler = schedules.Scheduler(campaign_id, region, log, context.get_remaining_time_in_millis)
+        response = scheduler.run()
+        return response
+
     user_id = event['requestContext']['authorizer']['user_id']
     data = json.loads(event['body'])
 
@@ -37,22 +66,74 @@ def lambda_handler(event, context):
         return format_response(400, 'failed', 'request must contain valid detail', log)
     detail = data['detail']
 
+    if action == 'bulk_execute':
+        # Execute many container tasks of one task_type
+        new_tasks = bulk_execute.Tasks(
+            campaign_id, subnet, region, detail, user_id, log, context.get_remaining_time_in_millis
+        )
+        response = new_tasks.run_tasks()
+        return response
+
+    if action == 'broadcast':
+        # Send one instruction to many container tasks
+        broadcast_tasks = broadcast.Tasks(campaign_id, region, detail, user_id, log)
+        response = broadcast_tasks.instruct()
+        return response
+
     if 'task_name' not in detail:
         return format_response(400, 'failed', 'request detail must contain task_name', log)
     task_name = detail['task_name']
 
     if action == 'execute':
         # Execute container task
-        new_task = execute.Task(campaign_id, task_name, subnet, region, detail, user_id, log)
+        new_task = execute.Task(
+            campaign_id, task_name, subnet, region, detail, user_id, log, context.get_remaining_time_in_millis,
+            context.invoked_function_arn
+        )
         response = new_task.run_task()
         return response
 
+    if action == 'launch_status':
+        # Check on a task started with an asynchronous execute
+        launch_task = execute.Task(campaign_id, task_name, subnet, region, detail, user_id, log)
+        response = launch_task.launch_status()
+        return response
+
     if action == 'interact':
         # Send instructions to existing container task
         interact_task = interact.Task(campaign_id, task_name, region, detail, user_id, log)
         response = interact_task.instruct()
         return response
 
+    if action == 'queue_status':
+        # List the instructions waiting for a busy or starting task
+        interact_task = interact.Task(campaign_id, task_name, region, detail, user_id, log)
+        response = interact_task.queue_status()
+        return response
+
+    if action == 'cancel_instruction':
+        # Remove an instruction from a task's queue before it is sent
+        interact_task = interact.Task(campaign_id, task_name, region, detail, user_id, log)
+        response = interact_task.cancel_instruction()
+        return response
+
+    if action == 'cancel_pipeline':
+        # Stop a task's pipeline from sending any further steps
+        interact_task = interact.Task(campaign_id, task_name, region, detail, user_id, log)
+        response = interact_task.cancel_pipeline()
+        return response
+
+    if action in ['create_schedule', 'list_schedules', 'delete_schedule']:
+        # Manage the scheduled and recurring instructions of a container task
+        task_schedule = schedules.Schedule(campaign_id, task_name, region, detail, user_id, log)
+        if action == 'create_schedule':
+            response = task_schedule.create()
+        elif action == 'list_schedules':
+            response = task_schedule.list()
+        else:
+            response = task_schedule.delete()
+        return response
+
     if action == 'get_results':
         # Get results from task instructions
         task_results = results_queue.Queue(campaign_id, task_name, region, detail, user_id, log)
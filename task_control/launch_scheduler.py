@@ -0,0 +1,194 @@
+import os
+import random
+import threading
+import aws_clients
+from botocore.exceptions import ClientError
+import time as t
+
+# Comma separated subnet-id:availability-zone pairs to launch tasks into; the SUBNET variable alone is used if unset
+SUBNETS = os.environ.get('SUBNETS', '')
+# Client-side limit on RunTask calls from one Lambda container: sustained calls per second and burst size
+RUN_TASK_RATE = float(os.environ.get('RUN_TASK_RATE', 5))
+RUN_TASK_BURST = float(os.environ.get('RUN_TASK_BURST', 10))
+RUN_TASK_MAX_ATTEMPTS = int(os.environ.get('RUN_TASK_MAX_ATTEMPTS', 5))
+RUN_TASK_BACKOFF_BASE = float(os.environ.get('RUN_TASK_BACKOFF_BASE', 0.25))
+RUN_TASK_BACKOFF_MAX = float(os.environ.get('RUN_TASK_BACKOFF_MAX', 5))
+# How long free IP counts from DescribeSubnets are trusted before they are read again
+SUBNET_LOAD_TTL = float(os.environ.get('SUBNET_LOAD_TTL', 30))
+THROTTLING_ERRORS = ['ThrottlingException', 'Throttling', 'RequestLimitExceeded', 'TooManyRequestsException']
+
+
+def parse_subnets(subnets, default_subnet):
+    """Returns [(subnet_id, availability_zone)] from a SUBNETS value; the zone is None when it is not given"""
+    parsed = []
+    for entry in subnets.split(','):
+        entry = entry.strip()
+        if entry:
+            subnet_id, _, availability_zone = entry.partition(':')
+            parsed.append((subnet_id, availability_zone or None))
+    return parsed or [(default_subnet, None)]
+
+
+class PlacementError(Exception):
+
+    def __init__(self, failures):
+        """Raised when no subnet could take the task; failures are the RunTask failures of the subnets tried"""
+        reasons = sorted({f.get('reason', 'unknown') for f in failures}) or ['no subnet with free addresses']
+        super().__init__(f'no capacity to place the task: {", ".join(reasons)}')
+        self.failures = failures
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        """Thread-safe token bucket holding up to capacity tokens, refilled at rate tokens per second"""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = t.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, waiting for it if the bucket is empty; returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = t.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            t.sleep(wait)
+            waited += wait
+
+
+class Scheduler:
+
+    def __init__(self, region, subnets):
+        """
+        Places RunTask calls on the subnet with the most free IP addresses, spreading ties across availability zones,
+        and paces them with a token bucket. One scheduler is shared by every invocation in a Lambda container.
+        """
+        self.region = region
+        self.subnets = subnets
+        self.bucket = TokenBucket(RUN_TASK_RATE, RUN_TASK_BURST)
+        self.lock = threading.Lock()
+        self.free_ips = {}
+        self.free_ips_time = None
+        self.placements = {subnet_id: 0 for subnet_id, _ in subnets}
+        self.zone_placements = {}
+        self.throttled = 0
+
+    def refresh_free_ips(self):
+        """Reads the free IP count of every subnet; without DescribeSubnets access subnets are treated as equal"""
+        try:
+            response = aws_clients.get_client('ec2', self.region).describe_subnets(
+                SubnetIds=[subnet_id for subnet_id, _ in self.subnets]
+            )
+        except ClientError as error:
+            print({'launch_scheduler': {'describe_subnets_failed': error.response['Error']['Code']}})
+            free_ips = {}
+        else:
+            free_ips = {s['SubnetId']: s['AvailableIpAddressCount'] for s in response['Subnets']}
+        with self.lock:
+            self.free_ips = free_ips
+            self.free_ips_time = t.monotonic()
+
+    def place(self, excluded):
+        """Picks the subnet for the next task and reserves one of its addresses"""
+        if self.free_ips_time is None or t.monotonic() - self.free_ips_time > SUBNET_LOAD_TTL:
+            self.refresh_free_ips()
+        with self.lock:
+            candidates = [s for s in self.subnets if s[0] not in excluded and self.free_ips.get(s[0], 1) > 0]
+            if not candidates:
+                return None, None
+            subnet_id, availability_zone = max(candidates, key=lambda s: (
+                self.free_ips.get(s[0], 0), -self.zone_placements.get(s[1], 0), -self.placements[s[0]]
+            ))
+            if subnet_id in self.free_ips:
+                self.free_ips[subnet_id] -= 1
+            self.placements[subnet_id] += 1
+            self.zone_placements[availability_zone] = self.zone_placements.get(availability_zone, 0) + 1
+        return subnet_id, availability_zone
+
+    def release(self, subnet_id, availability_zone):
+        """Returns the address reserved by place for a launch that did not happen"""
+        with self.lock:
+            if subnet_id in self.free_ips:
+                self.free_ips[subnet_id] += 1
+            self.placements[subnet_id] -= 1
+            self.zone_placements[availability_zone] -= 1
+
+    def run_task(self, **kwargs):
+        """
+        Calls ECS RunTask with kwargs, filling in the subnet. Throttled calls are retried with exponential backoff
+        and full jitter; a subnet that reports launch failures is skipped for the rest of the call. Raises
+        PlacementError if no subnet launched the task.
+        """
+        ecs_client = aws_clients.get_client('ecs', self.region)
+        metrics = {'queue_delay_seconds': 0.0, 'attempts': 0, 'throttled': 0, 'subnets_tried': []}
+        excluded = []
+        failures = []
+        response = None
+        while metrics['attempts'] < RUN_TASK_MAX_ATTEMPTS:
+            subnet_id, availability_zone = self.place(excluded)
+            if subnet_id is None:
+                break
+            metrics['queue_delay_seconds'] += self.bucket.acquire()
+            metrics['attempts'] += 1
+            kwargs['networkConfiguration']['awsvpcConfiguration']['subnets'] = [subnet_id]
+            try:
+                response = ecs_client.run_task(**kwargs)
+            except ClientError as error:
+                self.release(subnet_id, availability_zone)
+                if error.response['Error']['Code'] not in THROTTLING_ERRORS or \
+                        metrics['attempts'] >= RUN_TASK_MAX_ATTEMPTS:
+                    raise
+                metrics['throttled'] += 1
+                with self.lock:
+                    self.throttled += 1
+                backoff = min(RUN_TASK_BACKOFF_MAX, RUN_TASK_BACKOFF_BASE * 2 ** (metrics['attempts'] - 1))
+                pause = random.uniform(0, backoff)
+                metrics['queue_delay_seconds'] += pause
+                t.sleep(pause)
+                continue
+            metrics['subnets_tried'].append(subnet_id)
+            if response.get('tasks') or not response.get('failures'):
+                metrics['subnet'] = subnet_id
+                metrics['availability_zone'] = availability_zone
+                break
+            # Out of addresses or capacity in this subnet; try the next best one
+            failures.extend(response['failures'])
+            response = None
+            self.release(subnet_id, availability_zone)
+            excluded.append(subnet_id)
+        self.record_metrics(metrics)
+        if response is None:
+            raise PlacementError(failures)
+        return response
+
+    def record_metrics(self, metrics):
+        metrics['queue_delay_seconds'] = round(metrics['queue_delay_seconds'], 3)
+        with self.lock:
+            metrics['placements'] = dict(self.placements)
+            metrics['zone_placements'] = {str(k): v for k, v in self.zone_placements.items()}
+            metrics['throttled_total'] = self.throttled
+        print({'launch_scheduler': metrics})
+
+
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+
+def get_scheduler(region, default_subnet):
+    """Returns the Lambda container's scheduler for region, creating it on first use"""
+    scheduler = schedulers.get(region)
+    if scheduler is None:
+        with schedulers_lock:
+            scheduler = schedulers.get(region)
+            if scheduler is None:
+                scheduler = Scheduler(region, parse_subnets(SUBNETS, default_subnet))
+                schedulers[region] = scheduler
+    return scheduler
@@ -1,8 +1,19 @@
+import os
 import json
-import boto3
+import base64
+import binascii
+import aws_clients
+import dynamodb_codec
 from datetime import datetime
 from datetime import timedelta
 
+# Most results one get_results page may hold, and the page size when the request does not give a limit
+GET_RESULTS_MAX_LIMIT = int(os.environ.get('GET_RESULTS_MAX_LIMIT', 1000))
+GET_RESULTS_DEFAULT_LIMIT = min(int(os.environ.get('GET_RESULTS_DEFAULT_LIMIT', 1000)), GET_RESULTS_MAX_LIMIT)
+# A page is cut short once its results add up to this many bytes, keeping the response under the 6 MB Lambda limit.
+# Results are counted as they appear in the response, where the body is JSON encoded a second time.
+GET_RESULTS_MAX_BYTES = int(os.environ.get('GET_RESULTS_MAX_BYTES', 5 * 1024 * 1024))
+
 
 def format_response(status_code, result, message, log, **kwargs):
     response = {'outcome': result}
@@ -33,92 +44,153 @@ class Queue:
     def aws_client(self):
         """Returns the boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_client is None:
-            self.__aws_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_client
 
-    def query_queue(self, start_timestamp, end_timestamp):
-        queue_results = {'Items': []}
-        scan_kwargs = {
+    def query_queue(self, start_timestamp, end_timestamp, scan_forward=True, start_key=None, limit=None):
+        """Yields the task's results in run_time order one at a time, reading at most limit items per query page"""
+        query_kwargs = {
             'TableName': f'{self.campaign_id}-queue',
             'KeyConditionExpression': 'task_name = :task_name AND run_time BETWEEN :start_time AND :end_time',
             'ExpressionAttributeValues': {
                 ':task_name': {'S': self.task_name},
                 ':start_time': {'N': start_timestamp},
                 ':end_time': {'N': end_timestamp}
-            }
+            },
+            'ScanIndexForward': scan_forward
         }
+        if limit:
+            query_kwargs['Limit'] = limit
 
         done = False
-        start_key = None
         while not done:
             if start_key:
-                scan_kwargs['ExclusiveStartKey'] = start_key
-            response = self.aws_client.query(**scan_kwargs)
+                query_kwargs['ExclusiveStartKey'] = start_key
+            response = self.aws_client.query(**query_kwargs)
             for item in response['Items']:
-                queue_results['Items'].append(item)
+                yield item
             start_key = response.get('LastEvaluatedKey', None)
             done = start_key is None
-        return queue_results
+
+    def encode_token(self, last_item, start_timestamp, end_timestamp, order):
+        """Wraps the key of the last result returned, and the query it came from, into a continuation token"""
+        token = {
+            'task_name': self.task_name, 'run_time': last_item['run_time']['N'], 'start_time': start_timestamp,
+            'end_time': end_timestamp, 'order': order
+        }
+        return base64.urlsafe_b64encode(json.dumps(token).encode('utf-8')).decode('utf-8')
+
+    def decode_token(self, next_token):
+        """Returns the query a continuation token resumes, or None if the token is not valid for this task"""
+        try:
+            token = json.loads(base64.urlsafe_b64decode(next_token.encode('utf-8')))
+            if token['task_name'] != self.task_name or token['order'] not in ['ascending', 'descending']:
+                return None
+            int(token['run_time'])
+            int(token['start_time'])
+            int(token['end_time'])
+        except (binascii.Error, ValueError, TypeError, KeyError, AttributeError):
+            return None
+        return token
 
     def get_results(self):
 
         queue_list = []
 
-        # Build query time range
-        start_time = None
-        if 'start_time' in self.detail:
-            start_time = self.detail['start_time']
-        end_time = None
-        if 'end_time' in self.detail:
-            end_time = self.detail['end_time']
-        if start_time != '' and start_time is not None:
-            start = datetime.strptime(start_time, "%m/%d/%Y %H:%M:%S")
+        # Page size and order
+        limit = self.detail.get('limit')
+        if limit not in [None, '']:
+            try:
+                limit = int(limit)
+            except (TypeError, ValueError):
+                limit = 0
+            if not 0 < limit <= GET_RESULTS_MAX_LIMIT:
+                return format_response(400, 'failed', f'limit must be between 1 and {GET_RESULTS_MAX_LIMIT}', self.log)
         else:
-            start = datetime.now() - timedelta(minutes=1440)
+            limit = GET_RESULTS_DEFAULT_LIMIT
+        order = self.detail.get('order') or 'ascending'
+        if order not in ['ascending', 'descending']:
+            return format_response(400, 'failed', 'order must be ascending or descending', self.log)
 
-        if end_time != '' and end_time is not None:
-            end = datetime.strptime(end_time, "%m/%d/%Y %H:%M:%S")
+        start_key = None
+        next_token = self.detail.get('next_token')
+        if next_token:
+            # Continue the query the token came from; its time range and order take precedence
+            token = self.decode_token(next_token)
+            if token is None:
+                return format_response(400, 'failed', 'invalid next_token', self.log)
+            start_timestamp = token['start_time']
+            end_timestamp = token['end_time']
+            order = token['order']
+            start_key = {'task_name': {'S': self.task_name}, 'run_time': {'N': token['run_time']}}
         else:
-            end = datetime.now()
-
-        # Assign query parameters
-        start_timestamp = str(int(datetime.timestamp(start)))
-        end_timestamp = str(int(datetime.timestamp(end)))
-            
-        # Run query
-        queue_data = self.query_queue(start_timestamp, end_timestamp)
-        if queue_data:
-            for item in queue_data['Items']:
-                run_time = item['run_time']['N']
-                task_name = item['task_name']['S']
-                task_type = item['task_type']['S']
-                task_context = item['task_context']['S']
-                task_host_name = item['task_host_name']['S']
-                task_domain_name = item['task_domain_name']['S']
-                instruct_command_output = item['instruct_command_output']['S']
-                attack_ip = item['attack_ip']['S']
-                local_ip = item['local_ip']['SS']
-                instruct_user_id = item['user_id']['S']
-                instruct_instance = item['instruct_instance']['S']
-                instruct_command = item['instruct_command']['S']
-                instruct_args = item['instruct_args']['M']
-                instruct_args_fixup = {}
-                for key, value in instruct_args.items():
-                    if 'S' in value:
-                        instruct_args_fixup[key] = value['S']
-                    if 'N' in value:
-                        instruct_args_fixup[key] = value['N']
-                    if 'BOOL' in value:
-                        instruct_args_fixup[key] = value['BOOL']
-                    if 'B' in value:
-                        instruct_args_fixup[key] = value['B']
-
-                # Add queue entry to results
-                queue_list.append({'task_name': task_name, 'task_type': task_type, 'task_context': task_context,
-                                   'task_host_name': task_host_name, 'task_domain_name': task_domain_name,
-                                   'task_attack_ip': attack_ip, 'task_local_ip': local_ip,
-                                   'instruct_user_id': instruct_user_id, 'instruct_instance': instruct_instance,
-                                   'instruct_command': instruct_command, 'instruct_args': instruct_args_fixup,
-                                   'instruct_command_output': instruct_command_output, 'run_time': run_time})
-
-        return format_response(200, 'success', 'get_results succeeded', None, queue=queue_list)
+            # Build query time range
+            start_time = None
+            if 'start_time' in self.detail:
+                start_time = self.detail['start_time']
+            end_time = None
+            if 'end_time' in self.detail:
+                end_time = self.detail['end_time']
+            if start_time != '' and start_time is not None:
+                start = datetime.strptime(start_time, "%m/%d/%Y %H:%M:%S")
+            else:
+                start = datetime.now() - timedelta(minutes=1440)
+
+            if end_time != '' and end_time is not None:
+                end = datetime.strptime(end_time, "%m/%d/%Y %H:%M:%S")
+            else:
+                end = datetime.now()
+
+            # Assign query parameters
+            start_timestamp = str(int(datetime.timestamp(start)))
+            end_timestamp = str(int(datetime.timestamp(end)))
+
+        # Run query, stopping at limit results or GET_RESULTS_MAX_BYTES of them; a result past the page means there
+        # are more to fetch with next_token. One extra item is read to find out without returning an empty last page.
+        page_bytes = 0
+        last_item = None
+        more = False
+        for item in self.query_queue(start_timestamp, end_timestamp, order == 'ascending', start_key, limit + 1):
+            if len(queue_list) == limit:
+                more = True
+                break
+            run_time = item['run_time']['N']
+            task_name = item['task_name']['S']
+            task_type = item['task_type']['S']
+            task_context = item['task_context']['S']
+            task_host_name = item['task_host_name']['S']
+            task_domain_name = item['task_domain_name']['S']
+            instruct_command_output = item['instruct_command_output']['S']
+            attack_ip = item['attack_ip']['S']
+            local_ip = item['local_ip']['SS']
+            instruct_user_id = item['user_id']['S']
+            instruct_instance = item['instruct_instance']['S']
+            instruct_command = item['instruct_command']['S']
+            instruct_args_fixup = dynamodb_codec.to_json(dynamodb_codec.unmarshal_map(item['instruct_args']['M']))
+
+            # Add queue entry to results
+            queue_entry = {'task_name': task_name, 'task_type': task_type, 'task_context': task_context,
+                           'task_host_name': task_host_name, 'task_domain_name': task_domain_name,
+                           'task_attack_ip': attack_ip, 'task_local_ip': local_ip,
+                           'instruct_user_id': instruct_user_id, 'instruct_instance': instruct_instance,
+                           'instruct_command': instruct_command, 'instruct_args': instruct_args_fixup,
+                           'instruct_command_output': instruct_command_output, 'run_time': run_time}
+            # The proxy response encodes the body string again, which escapes the quotes and backslashes of the
+            # already JSON encoded instruct_command_output once more
+            entry_bytes = len(json.dumps(json.dumps(queue_entry)).encode('utf-8'))
+            if queue_list and page_bytes + entry_bytes > GET_RESULTS_MAX_BYTES:
+                more = True
+                break
+            page_bytes += entry_bytes
+            queue_list.append(queue_entry)
+            last_item = item
+
+        # next_token is always in the response, null on the last page, so a client that does not page can still tell
+        # that a request without a limit stopped at GET_RESULTS_DEFAULT_LIMIT results
+        next_token = None
+        message = 'get_results succeeded'
+        if more:
+            next_token = self.encode_token(last_item, start_timestamp, end_timestamp, order)
+            message = f'get_results returned {len(queue_list)} results; pass next_token to get the rest'
+        response = {'outcome': 'success', 'message': message, 'queue': queue_list, 'next_token': next_token}
+        return {'statusCode': 200, 'body': json.dumps(response)}
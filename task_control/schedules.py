@@ -0,0 +1,359 @@
+import os
+import json
+import uuid
+import aws_clients
+import dynamodb_codec
+import interact
+import task_type_cache
+from botocore.exceptions import ClientError
+import time as t
+
+# Shortest interval a recurring schedule may have
+SCHEDULE_MIN_INTERVAL = int(os.environ.get('SCHEDULE_MIN_INTERVAL', 60))
+# How long a deferred instruction waits before the scheduler looks at its task again
+SCHEDULE_DEFER_SECONDS = int(os.environ.get('SCHEDULE_DEFER_SECONDS', 60))
+# How long a one-off instruction may be deferred before it is dropped
+SCHEDULE_MAX_DEFER = int(os.environ.get('SCHEDULE_MAX_DEFER', 3600))
+# The scheduler stops firing when the invocation has less time left than this; the rest fire on its next run
+SCHEDULER_RESERVED_MILLIS = int(os.environ.get('SCHEDULER_RESERVED_MILLIS', 10000))
+# What happens when a task is busy or starting at the scheduled time: queue the instruction behind the running one,
+# skip this occurrence, or retry every SCHEDULE_DEFER_SECONDS until the task is idle (at most until the next occurrence)
+BUSY_POLICIES = ['queue', 'skip', 'defer']
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+def following_run(schedule, now):
+    """Returns the first regular run time of a recurring schedule after now, or None for a one-off schedule"""
+    interval = schedule['interval']
+    if not interval:
+        return None
+    elapsed = max(now - schedule['start_time'], 0)
+    return schedule['start_time'] + (elapsed // interval + 1) * interval
+
+
+class Schedule:
+
+    def __init__(self, campaign_id, task_name, region, detail: dict, user_id, log):
+        """Creates, lists and deletes the scheduled instructions of a task"""
+        self.campaign_id = campaign_id
+        self.task_name = task_name
+        self.region = region
+        self.detail = detail
+        self.user_id = user_id
+        self.log = log
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    def get_task_entry(self):
+        return self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-tasks',
+            Key={
+                'task_name': {'S': self.task_name}
+            },
+            ProjectionExpression='task_type'
+        )
+
+    def create(self):
+        if 'instruct_command' not in self.detail:
+            return format_response(400, 'failed', 'missing instruct_command', self.log)
+        instruct_command = self.detail['instruct_command']
+        busy_policy = self.detail.get('busy_policy') or 'queue'
+        if busy_policy not in BUSY_POLICIES:
+            return format_response(400, 'failed', f'busy_policy must be one of {", ".join(BUSY_POLICIES)}', self.log)
+        try:
+            interval = int(self.detail.get('interval') or 0)
+            start_time = int(self.detail.get('start_time') or int(t.time()) + interval)
+        except (TypeError, ValueError):
+            return format_response(400, 'failed', 'interval and start_time must be whole numbers of seconds', self.log)
+        if interval and interval < SCHEDULE_MIN_INTERVAL:
+            return format_response(400, 'failed', f'interval must be at least {SCHEDULE_MIN_INTERVAL} seconds',
+                                   self.log)
+        if not interval and start_time < int(t.time()):
+            return format_response(400, 'failed', 'start_time of a one-off schedule must not be in the past', self.log)
+        instruct_args = self.detail.get('instruct_args') or {'no_args': 'True'}
+        invalid = interact.invalid_instruct_args(instruct_args)
+        if invalid:
+            return format_response(400, 'failed', invalid, self.log)
+
+        task_entry = self.get_task_entry()
+        if 'Item' not in task_entry:
+            return format_response(404, 'failed', f'task_name {self.task_name} not found', self.log)
+        _, capabilities = task_type_cache.lookup(self.campaign_id, self.region, task_entry['Item']['task_type']['S'])
+        if instruct_command not in capabilities:
+            return format_response(400, 'failed', f'{instruct_command} not valid for task_name {self.task_name}',
+                                   self.log)
+
+        schedule_id = uuid.uuid4().hex
+        schedule = {
+            'schedule_id': schedule_id, 'task_name': self.task_name, 'instruct_command': instruct_command,
+            'instruct_instance': self.detail.get('instruct_instance') or 'havoc',
+            'instruct_args': instruct_args,
+            'end_time': self.detail.get('end_time') or 'None', 'instruct_user_id': self.user_id,
+            'busy_policy': busy_policy, 'interval': interval, 'start_time': start_time, 'next_run': start_time,
+            'fire_count': 0
+        }
+        response = self.aws_dynamodb_client.put_item(
+            TableName=f'{self.campaign_id}-schedules',
+            Item=dynamodb_codec.marshal_map(schedule)
+        )
+        assert response, f"create_schedule failed for task_name {self.task_name}"
+        return format_response(200, 'success', f'schedule created for task {self.task_name}', None,
+                               schedule_id=schedule_id, next_run=str(start_time))
+
+    def list(self):
+        schedules = []
+        scan_kwargs = {
+            'TableName': f'{self.campaign_id}-schedules',
+            'FilterExpression': 'task_name = :task_name',
+            'ExpressionAttributeValues': {':task_name': {'S': self.task_name}}
+        }
+        done = False
+        start_key = None
+        while not done:
+            if start_key:
+                scan_kwargs['ExclusiveStartKey'] = start_key
+            response = self.aws_dynamodb_client.scan(**scan_kwargs)
+            for item in response['Items']:
+                schedules.append(dynamodb_codec.to_json(dynamodb_codec.unmarshal_map(item)))
+            start_key = response.get('LastEvaluatedKey', None)
+            done = start_key is None
+        schedules.sort(key=lambda s: s['next_run'])
+        return format_response(200, 'success', None, None, schedules=schedules)
+
+    def delete(self):
+        if 'schedule_id' not in self.detail:
+            return format_response(400, 'failed', 'missing schedule_id', self.log)
+        schedule_id = self.detail['schedule_id']
+        try:
+            self.aws_dynamodb_client.delete_item(
+                TableName=f'{self.campaign_id}-schedules',
+                Key={
+                    'schedule_id': {'S': schedule_id}
+                },
+                ConditionExpression='task_name = :task_name',
+                ExpressionAttributeValues={
+                    ':task_name': {'S': self.task_name}
+                }
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return format_response(404, 'failed', f'schedule {schedule_id} not found for task {self.task_name}',
+                                   self.log)
+        return format_response(200, 'success', f'schedule {schedule_id} deleted', None)
+
+
+class Scheduler:
+
+    def __init__(self, campaign_id, region, log, remaining_time=None):
+        """
+        Fires the scheduled instructions that are due, through the same path as an interact request. Every occurrence
+        is claimed with a conditional write on the schedule's next_run before it fires, so scheduler runs that overlap
+        never fire the same occurrence twice. Time comes from t.time(), which a local harness can replace.
+        """
+        self.campaign_id = campaign_id
+        self.region = region
+        self.log = log
+        self.remaining_time = remaining_time
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    def get_due_schedules(self, now):
+        schedules = []
+        scan_kwargs = {
+            'TableName': f'{self.campaign_id}-schedules',
+            'FilterExpression': 'next_run <= :now',
+            'ExpressionAttributeValues': {':now': {'N': str(now)}}
+        }
+        done = False
+        start_key = None
+        while not done:
+            if start_key:
+                scan_kwargs['ExclusiveStartKey'] = start_key
+            response = self.aws_dynamodb_client.scan(**scan_kwargs)
+            for item in response['Items']:
+                schedules.append(dynamodb_codec.unmarshal_map(item))
+            start_key = response.get('LastEvaluatedKey', None)
+            done = start_key is None
+        schedules.sort(key=lambda s: s['next_run'])
+        return schedules
+
+    def get_task_status(self, task_name):
+        response = self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-tasks',
+            Key={
+                'task_name': {'S': task_name}
+            },
+            ProjectionExpression='task_status'
+        )
+        if 'Item' not in response:
+            return None
+        return response['Item']['task_status']['S']
+
+    def claim(self, schedule, next_run, now, fired):
+        """
+        Takes the schedule's current occurrence: moves next_run on, or deletes a one-off schedule when next_run is
+        None. Returns False if another scheduler run claimed the occurrence first.
+        """
+        key = {'schedule_id': {'S': schedule['schedule_id']}}
+        slot = {':slot': {'N': str(schedule['next_run'])}}
+        try:
+            if next_run is None:
+                self.aws_dynamodb_client.delete_item(
+                    TableName=f'{self.campaign_id}-schedules',
+                    Key=key,
+                    ConditionExpression='next_run = :slot',
+                    ExpressionAttributeValues=slot
+                )
+            else:
+                update_expression = 'set next_run=:next_run, last_run=:now'
+                if fired:
+                    update_expression += ' add fire_count :one'
+                    slot[':one'] = {'N': '1'}
+                self.aws_dynamodb_client.update_item(
+                    TableName=f'{self.campaign_id}-schedules',
+                    Key=key,
+                    UpdateExpression=update_expression,
+                    ConditionExpression='next_run = :slot',
+                    ExpressionAttributeValues={
+                        ':next_run': {'N': str(next_run)},
+                        ':now': {'N': str(now)},
+                        **slot
+                    }
+                )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def release(self, schedule, claimed_next_run, now):
+        """
+        Gives back an occurrence that was claimed but could not be sent, to retry SCHEDULE_DEFER_SECONDS later if that
+        is still before the schedule's next occurrence (within SCHEDULE_MAX_DEFER for a one-off schedule, which the
+        claim deleted and is written back). Returns the retry time, or None if the occurrence is dropped.
+        """
+        retry_run = now + SCHEDULE_DEFER_SECONDS
+        try:
+            if claimed_next_run is None:
+                if retry_run > schedule['start_time'] + SCHEDULE_MAX_DEFER:
+                    return None
+                self.aws_dynamodb_client.put_item(
+                    TableName=f'{self.campaign_id}-schedules',
+                    Item=dynamodb_codec.marshal_map({**schedule, 'next_run': retry_run}),
+                    ConditionExpression='attribute_not_exists(schedule_id)'
+                )
+            else:
+                if retry_run >= claimed_next_run:
+                    return None
+                self.aws_dynamodb_client.update_item(
+                    TableName=f'{self.campaign_id}-schedules',
+                    Key={
+                        'schedule_id': {'S': schedule['schedule_id']}
+                    },
+                    UpdateExpression='set next_run=:retry_run add fire_count :minus_one',
+                    ConditionExpression='next_run = :claimed_next_run',
+                    ExpressionAttributeValues={
+                        ':retry_run': {'N': str(retry_run)},
+                        ':minus_one': {'N': '-1'},
+                        ':claimed_next_run': {'N': str(claimed_next_run)}
+                    }
+                )
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                # The schedule was deleted or changed since it was claimed
+                return None
+            raise
+        return retry_run
+
+    def fire(self, schedule):
+        """Sends the scheduled instruction as an interact request from the user who created the schedule"""
+        detail = {
+            'task_name': schedule['task_name'], 'instruct_command': schedule['instruct_command'],
+            'instruct_instance': schedule['instruct_instance'], 'instruct_args': schedule['instruct_args'],
+            'end_time': schedule['end_time']
+        }
+        interact_task = interact.Task(self.campaign_id, schedule['task_name'], self.region, detail,
+                                      schedule['instruct_user_id'], self.log)
+        response = interact_task.instruct()
+        return response['statusCode'], json.loads(response['body'])
+
+    def run_schedule(self, schedule, now):
+        """Handles one due schedule; returns its outcome"""
+        following = following_run(schedule, now)
+        task_status = self.get_task_status(schedule['task_name'])
+        if task_status is None or task_status == 'finished':
+            # The task is gone, so is its schedule
+            self.claim(schedule, None, now, False)
+            return {'outcome': 'task_gone'}
+
+        if task_status in ['busy', 'starting'] and schedule['busy_policy'] != 'queue':
+            deferred_run = now + SCHEDULE_DEFER_SECONDS
+            if schedule['busy_policy'] == 'defer':
+                if following is None and deferred_run <= schedule['start_time'] + SCHEDULE_MAX_DEFER:
+                    outcome = 'deferred'
+                elif following is not None and deferred_run < following:
+                    outcome = 'deferred'
+                else:
+                    outcome = 'skipped'
+            else:
+                outcome = 'skipped'
+            next_run = deferred_run if outcome == 'deferred' else following
+            if not self.claim(schedule, next_run, now, False):
+                return {'outcome': 'claimed_elsewhere'}
+            return {'outcome': outcome, 'task_status': task_status}
+
+        if not self.claim(schedule, following, now, True):
+            return {'outcome': 'claimed_elsewhere'}
+        try:
+            status_code, body = self.fire(schedule)
+        except Exception as error:
+            return {'outcome': 'failed', 'error': f'{type(error).__name__}: {error}',
+                    'retry_run': self.release(schedule, following, now)}
+        outcome = {'outcome': 'fired', 'status_code': status_code, 'result': body['outcome']}
+        for k in ['instruction_id', 'queue_position', 'message']:
+            if k in body:
+                outcome[k] = body[k]
+        return outcome
+
+    def run(self):
+        now = int(t.time())
+        outcomes = {}
+        for schedule in self.get_due_schedules(now):
+            if self.remaining_time and self.remaining_time() < SCHEDULER_RESERVED_MILLIS:
+                break
+            try:
+                outcome = self.run_schedule(schedule, now)
+            except Exception as error:
+                # One schedule's error does not hold up the others that are due
+                outcome = {'outcome': 'failed', 'error': f'{type(error).__name__}: {error}'}
+            outcome['task_name'] = schedule['task_name']
+            outcomes[schedule['schedule_id']] = outcome
+        summary = {'now': now, 'schedules': outcomes}
+        print({'scheduler_run': summary})
+        return summary
@@ -0,0 +1,293 @@
+import os
+import json
+import uuid
+import random
+import aws_clients
+import execute
+from botocore.exceptions import ClientError
+from datetime import datetime
+
+# Upper bound on the standby tasks one replenish job launches, so a large pool fills over several jobs
+STANDBY_POOL_MAX_LAUNCH = int(os.environ.get('STANDBY_POOL_MAX_LAUNCH', 5))
+# Age after which a launch reservation is treated as abandoned, such as by a replenish job that timed out
+STANDBY_LAUNCH_EXPIRY = int(os.environ.get('STANDBY_LAUNCH_EXPIRY', 900))
+DESCRIBE_BATCH_SIZE = 100
+
+
+class Pool:
+
+    def __init__(self, campaign_id, task_type, subnet, region, log, remaining_time=None, function_name=None):
+        """
+        Warm standby pool of a task_type. Standby tasks are running containers with a public IP that have not been
+        assigned to a task yet; they are kept in the standby_tasks map of the task_type entry, keyed by the standby
+        name the container was launched with. Launches in flight are reserved in its standby_launches map before
+        run_task, so replenish jobs that run at the same time cannot launch more tasks than the pool has room for.
+        remaining_time and function_name are used as in execute.Task.
+
+        A pool only helps task_types whose container supports it: launched with its standby name as TASK_NAME, the
+        container keeps polling <standby name>/init.txt in the workspace, and on an Initialize instruction there takes
+        the task_name in its instruct_args as its own and reports the Initialize result under it. execute stops a
+        claimed task that does not report back within STANDBY_ACK_TIMEOUT and launches a new one instead.
+        """
+        self.campaign_id = campaign_id
+        self.task_type = task_type
+        self.subnet = subnet
+        self.region = region
+        self.log = log
+        self.remaining_time = remaining_time
+        self.function_name = function_name
+        self.__aws_dynamodb_client = None
+        self.__aws_ecs_client = None
+        self.__aws_lambda_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    @property
+    def aws_ecs_client(self):
+        """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
+        if self.__aws_ecs_client is None:
+            self.__aws_ecs_client = aws_clients.get_client('ecs', self.region)
+        return self.__aws_ecs_client
+
+    @property
+    def aws_lambda_client(self):
+        """Returns the boto3 Lambda session (establishes one automatically if one does not already exist)"""
+        if self.__aws_lambda_client is None:
+            self.__aws_lambda_client = aws_clients.get_client('lambda', self.region)
+        return self.__aws_lambda_client
+
+    def get_pool_entry(self):
+        return self.aws_dynamodb_client.get_item(
+            TableName=f'{self.campaign_id}-task-types',
+            Key={
+                'task_type': {'S': self.task_type}
+            },
+            ProjectionExpression='standby_pool_size, standby_tasks, standby_launches',
+            ConsistentRead=True
+        )
+
+    def update_pool_entry(self, update_expression, condition_expression, expression_attribute_names=None,
+                          expression_attribute_values=None):
+        """Applies a conditional update to the task_type entry; returns False if the condition did not hold"""
+        kwargs = {
+            'TableName': f'{self.campaign_id}-task-types',
+            'Key': {
+                'task_type': {'S': self.task_type}
+            },
+            'UpdateExpression': update_expression,
+            'ConditionExpression': condition_expression
+        }
+        if expression_attribute_names:
+            kwargs['ExpressionAttributeNames'] = expression_attribute_names
+        if expression_attribute_values:
+            kwargs['ExpressionAttributeValues'] = expression_attribute_values
+        try:
+            self.aws_dynamodb_client.update_item(**kwargs)
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def remove_standby_task(self, standby_name):
+        """Takes a standby task out of the pool; only one caller can succeed for a given standby task"""
+        return self.update_pool_entry(
+            'remove standby_tasks.#standby_name',
+            'attribute_exists(standby_tasks.#standby_name)',
+            {'#standby_name': standby_name}
+        )
+
+    def reserve_launch(self, standby_name, standby_count, pool_size):
+        """
+        Reserves a launch slot for standby_name. Fails if standby tasks were added since standby_count was read, or
+        if the launches already in flight fill the rest of the pool; either way another replenish is filling it.
+        """
+        return self.update_pool_entry(
+            'set standby_launches.#standby_name=:launch_time',
+            'size(standby_tasks) <= :standby_count AND size(standby_launches) < :launch_slots',
+            {'#standby_name': standby_name},
+            {
+                ':launch_time': {'N': datetime.now().strftime('%s')},
+                ':standby_count': {'N': str(standby_count)},
+                ':launch_slots': {'N': str(pool_size - standby_count)}
+            }
+        )
+
+    def release_launch(self, standby_name):
+        return self.update_pool_entry(
+            'remove standby_launches.#standby_name',
+            'attribute_exists(task_type)',
+            {'#standby_name': standby_name}
+        )
+
+    def add_standby_task(self, standby_name, ecs_task_id, attack_ip):
+        """Adds a launched task to the pool and releases its launch slot in the same write"""
+        return self.update_pool_entry(
+            'set standby_tasks.#standby_name=:standby_task remove standby_launches.#standby_name',
+            'attribute_exists(task_type)',
+            {'#standby_name': standby_name},
+            {':standby_task': {'M': {
+                'ecs_task_id': {'S': ecs_task_id},
+                'attack_ip': {'S': attack_ip},
+                'launch_time': {'S': datetime.now().strftime('%s')}
+            }}}
+        )
+
+    def get_standby_tasks(self, pool_entry):
+        standby_tasks = {}
+        for standby_name, standby_task in pool_entry.get('Item', {}).get('standby_tasks', {}).get('M', {}).items():
+            standby_tasks[standby_name] = {k: v['S'] for k, v in standby_task['M'].items()}
+        return standby_tasks
+
+    def describe_ecs_tasks(self, ecs_task_ids):
+        ecs_tasks = {}
+        for i in range(0, len(ecs_task_ids), DESCRIBE_BATCH_SIZE):
+            response = self.aws_ecs_client.describe_tasks(
+                cluster=f'{self.campaign_id}-cluster',
+                tasks=ecs_task_ids[i:i + DESCRIBE_BATCH_SIZE]
+            )
+            for ecs_task in response['tasks']:
+                ecs_tasks[ecs_task['taskArn']] = ecs_task
+        return ecs_tasks
+
+    def stop_standby_task(self, standby_name, ecs_task_id, reason):
+        response = self.aws_ecs_client.stop_task(
+            cluster=f'{self.campaign_id}-cluster',
+            task=ecs_task_id,
+            reason=reason
+        )
+        assert response, f"stop_standby_task failed for standby task {standby_name}, ecs_task_id {ecs_task_id}"
+        return True
+
+    def claim(self):
+        """
+        Takes one running standby task out of the pool. Returns its standby_name, ecs_task_id and attack_ip, or None
+        if the pool is empty.
+        """
+        standby_tasks = self.get_standby_tasks(self.get_pool_entry())
+        standby_names = list(standby_tasks)
+        random.shuffle(standby_names)
+        for standby_name in standby_names:
+            if not self.remove_standby_task(standby_name):
+                # Claimed by a concurrent execute
+                continue
+            standby_task = standby_tasks[standby_name]
+            ecs_task = self.describe_ecs_tasks([standby_task['ecs_task_id']]).get(standby_task['ecs_task_id'], {})
+            if ecs_task.get('lastStatus') != 'RUNNING':
+                print({'standby_task_lost': {'task_type': self.task_type, 'standby_name': standby_name,
+                                             'ecs_task_id': standby_task['ecs_task_id']}})
+                continue
+            standby_task['standby_name'] = standby_name
+            return standby_task
+        return None
+
+    def invoke_replenish(self):
+        """Asks a new invocation of this function to bring the pool back to its configured size"""
+        if not self.function_name:
+            return False
+        response = self.aws_lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'replenish_pool': {'task_type': self.task_type}}).encode('utf-8')
+        )
+        assert response, f"invoke_replenish failed for task_type {self.task_type}"
+        return True
+
+    def replenish(self):
+        """Drops stopped standby tasks, reaps any above the pool size and launches replacements for missing ones"""
+        pool_entry = self.get_pool_entry()
+        if 'Item' not in pool_entry:
+            return {'task_type': self.task_type, 'outcome': 'task_type does not exist'}
+        pool_size = int(pool_entry['Item'].get('standby_pool_size', {'N': '0'})['N'])
+        if 'standby_tasks' not in pool_entry['Item'] or 'standby_launches' not in pool_entry['Item']:
+            # Nested standby entries can only be set once the maps exist
+            self.update_pool_entry(
+                'set standby_tasks=if_not_exists(standby_tasks, :empty), '
+                'standby_launches=if_not_exists(standby_launches, :empty)',
+                'attribute_exists(task_type)',
+                expression_attribute_values={':empty': {'M': {}}}
+            )
+        standby_tasks = self.get_standby_tasks(pool_entry)
+
+        # Launch slots held longer than any replenish job can run were abandoned
+        expired = int(datetime.now().strftime('%s')) - STANDBY_LAUNCH_EXPIRY
+        for standby_name, launch_time in pool_entry['Item'].get('standby_launches', {}).get('M', {}).items():
+            if int(launch_time['N']) < expired:
+                self.update_pool_entry(
+                    'remove standby_launches.#standby_name',
+                    'standby_launches.#standby_name = :launch_time',
+                    {'#standby_name': standby_name},
+                    {':launch_time': launch_time}
+                )
+
+        ecs_tasks = self.describe_ecs_tasks([s['ecs_task_id'] for s in standby_tasks.values()])
+        live = []
+        dropped = 0
+        for standby_name, standby_task in standby_tasks.items():
+            if ecs_tasks.get(standby_task['ecs_task_id'], {}).get('lastStatus') == 'STOPPED' or \
+                    standby_task['ecs_task_id'] not in ecs_tasks:
+                if self.remove_standby_task(standby_name):
+                    dropped += 1
+            else:
+                live.append(standby_name)
+
+        # Reap surplus tasks, oldest first; a task claimed in the meantime is left to its new owner
+        reaped = 0
+        live.sort(key=lambda s: standby_tasks[s]['launch_time'])
+        for standby_name in live[:max(len(live) - pool_size, 0)]:
+            if self.remove_standby_task(standby_name):
+                self.stop_standby_task(standby_name, standby_tasks[standby_name]['ecs_task_id'],
+                                       f'Surplus standby task for {self.task_type}')
+                reaped += 1
+
+        standby_count = len(live) - reaped
+        launched = self.launch_standby_tasks(min(pool_size - standby_count, STANDBY_POOL_MAX_LAUNCH), standby_count,
+                                             pool_size)
+        summary = {
+            'task_type': self.task_type, 'standby_pool_size': pool_size, 'standby_tasks': standby_count,
+            'dropped': dropped, 'reaped': reaped, 'launched': launched
+        }
+        print({'standby_pool_replenished': summary})
+        return summary
+
+    def launch_standby_tasks(self, count, standby_count, pool_size):
+        """
+        Launches up to count standby tasks, each once it holds a launch slot, and adds the ones that become reachable
+        to the pool. standby_count is the number of standby tasks in the pool as replenish left it.
+        """
+        if count <= 0:
+            return 0
+        standby_tasks = []
+        for _ in range(count):
+            standby_name = f'standby-{uuid.uuid4().hex[:12]}'
+            if not self.reserve_launch(standby_name, standby_count, pool_size):
+                break
+            standby_task = execute.Task(self.campaign_id, standby_name, self.subnet, self.region, {}, 'None',
+                                        self.log, self.remaining_time)
+            standby_task.task_type = self.task_type
+            try:
+                standby_task.run_attack_task([], 'None')
+                ecs_task_id = standby_task.run_task_response['tasks'][0]['taskArn']
+            except Exception as error:
+                # The tasks launched so far are still waited on and added below
+                print({'standby_launch_failed': {'task_type': self.task_type, 'standby_name': standby_name,
+                                                 'error': f'{type(error).__name__}: {error}'}})
+                self.release_launch(standby_name)
+                break
+            standby_tasks.append((standby_task, ecs_task_id))
+
+        # The tasks provision in parallel, so waiting on each in turn costs about as long as the slowest one
+        launched = 0
+        for standby_task, ecs_task_id in standby_tasks:
+            attack_ip, _, provisioning = standby_task.wait_for_attack_ip(ecs_task_id)
+            if attack_ip and self.add_standby_task(standby_task.task_name, ecs_task_id, attack_ip):
+                launched += 1
+            else:
+                self.release_launch(standby_task.task_name)
+                standby_task.stop_ecs_task(ecs_task_id, f'Standby task for {self.task_type} was not added to the pool')
+        return launched
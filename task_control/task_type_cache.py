@@ -0,0 +1,80 @@
+import os
+import time
+import aws_clients
+
+# Item in the task-types table whose task_types_version attribute is incremented by manage/task_type.py whenever a
+# task_type is created, updated or deleted; warm containers compare it against the version their cache was filled under.
+TASK_TYPES_VERSION_ID = '__task_types_version__'
+
+TASK_TYPE_CACHE_TTL = int(os.environ.get('TASK_TYPE_CACHE_TTL', 300))
+TASK_TYPES_VERSION_CHECK_INTERVAL = int(os.environ.get('TASK_TYPES_VERSION_CHECK_INTERVAL', 5))
+
+
+class TaskTypeCache:
+
+    def __init__(self, ttl):
+        """
+        TTL-bounded cache of task_type entries that lives at module scope so it survives warm invocations. Each entry
+        keeps the get_item response together with the capabilities as a frozenset; unknown task types are cached too.
+        """
+        self.ttl = ttl
+        self.version = None
+        self.version_checked = 0.0
+        self.__entries = {}
+
+    def get(self, campaign_id, task_type):
+        """Returns the cached (task_type_entry, capabilities) for task_type, or None if there is no live entry"""
+        entry = self.__entries.get((campaign_id, task_type))
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            del self.__entries[(campaign_id, task_type)]
+            return None
+        return entry[0], entry[1]
+
+    def put(self, campaign_id, task_type, task_type_entry):
+        capabilities = frozenset(task_type_entry['Item']['capabilities']['SS']) if 'Item' in task_type_entry \
+            else frozenset()
+        self.__entries[(campaign_id, task_type)] = (task_type_entry, capabilities, time.monotonic() + self.ttl)
+        return task_type_entry, capabilities
+
+    def clear(self):
+        self.__entries.clear()
+
+    def version_check_due(self):
+        return time.monotonic() - self.version_checked >= TASK_TYPES_VERSION_CHECK_INTERVAL
+
+    def set_version(self, version):
+        """Records the latest task types version, dropping all entries if it changed since the last check"""
+        if version != self.version:
+            self.clear()
+            self.version = version
+        self.version_checked = time.monotonic()
+
+
+cache = TaskTypeCache(TASK_TYPE_CACHE_TTL)
+
+
+def read_task_type_entry(campaign_id, region, task_type):
+    return aws_clients.get_client('dynamodb', region).get_item(
+        TableName=f'{campaign_id}-task-types',
+        Key={
+            'task_type': {'S': task_type}
+        }
+    )
+
+
+def lookup(campaign_id, region, task_type):
+    """
+    Returns (task_type_entry, capabilities) for task_type, reading the task-types table only when the cached entry has
+    expired or the task types version has moved on. task_type_entry has the shape of a get_item response.
+    """
+    if task_type == TASK_TYPES_VERSION_ID:
+        return {}, frozenset()
+    if cache.version_check_due():
+        version_entry = read_task_type_entry(campaign_id, region, TASK_TYPES_VERSION_ID)
+        cache.set_version(version_entry.get('Item', {}).get('task_types_version', {}).get('N'))
+    cached = cache.get(campaign_id, task_type)
+    if cached is not None:
+        return cached
+    return cache.put(campaign_id, task_type, read_task_type_entry(campaign_id, region, task_type))
@@ -2,7 +2,11 @@ import re
 import ast
 import json
 import copy
-import boto3
+import aws_clients
+import dns_changes
+import dynamodb_codec
+import instruction_pipeline
+from botocore.exceptions import ClientError
 import time as t
 from datetime import datetime, timedelta
 
@@ -19,22 +23,14 @@ class Deliver:
         self.task_context = None
         self.task_type = None
         self.__aws_dynamodb_client = None
-        self.__aws_route53_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = aws_clients.get_client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
-    @property
-    def aws_route53_client(self):
-        """Returns the boto3 Route53 session (establishes one automatically if one does not already exist)"""
-        if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53', region_name=self.region)
-        return self.__aws_route53_client
-
     def get_domain_entry(self, domain_name):
         return self.aws_dynamodb_client.get_item(
             TableName=f'{self.campaign_id}-domains',
@@ -57,26 +53,11 @@ class Deliver:
         )
 
     def delete_resource_record_set(self, hosted_zone, host_name, domain_name, ip_address):
-        return self.aws_route53_client.change_resource_record_sets(
-            HostedZoneId=hosted_zone,
-            ChangeBatch={
-                'Changes': [
-                    {
-                        'Action': 'DELETE',
-                        'ResourceRecordSet': {
-                            'Name': f'{host_name}.{domain_name}',
-                            'Type': 'A',
-                            'TTL': 300,
-                            'ResourceRecords': [
-                                {
-                                    'Value': ip_address
-                                }
-                            ]
-                        }
-                    }
-                ]
-            }
+        """Deletes the task's A record through the shared change coalescer; returns its change id and status"""
+        change, = dns_changes.coalescer.change(
+            hosted_zone, [dns_changes.a_record_change('DELETE', f'{host_name}.{domain_name}', ip_address)]
         )
+        return change
 
     def add_queue_attribute(self, stime, expire_time, task_instruct_instance, task_instruct_command, task_instruct_args,
                             task_host_name, task_domain_name, task_attack_ip, task_local_ip, json_payload):
@@ -127,7 +108,8 @@ class Deliver:
                 ':task_status': {'S': task_status},
                 ':last_instruct_time': {'S': stime},
                 ':scheduled_end_time': {'S': task_end_time}
-            }
+            },
+            ReturnValues='ALL_NEW'
         )
 
     def delete_task_entry(self):
@@ -138,25 +120,24 @@ class Deliver:
             }
         )
 
-    def get_portgroup_entry(self, portgroup_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            }
-        )
-
-    def update_portgroup_entry(self, portgroup_name, portgroup_tasks):
-        return self.aws_dynamodb_client.update_item(
-            TableName=f'{self.campaign_id}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            },
-            UpdateExpression='set tasks=:tasks',
-            ExpressionAttributeValues={
-                ':tasks': {'SS': portgroup_tasks}
-            }
-        )
+    def remove_portgroup_task(self, portgroup_name):
+        """Removes the task from a portgroup's task set in place, leaving other members untouched"""
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.campaign_id}-portgroups',
+                Key={
+                    'portgroup_name': {'S': portgroup_name}
+                },
+                UpdateExpression='delete tasks :task_name',
+                ConditionExpression='attribute_exists(portgroup_name)',
+                ExpressionAttributeValues={
+                    ':task_name': {'SS': [self.task_name]}
+                }
+            )
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        return True
 
     def deliver_result(self):
         # Set vars
@@ -217,26 +198,11 @@ class Deliver:
         del db_payload['timestamp']
         del db_payload['user_id']
         json_payload = json.dumps(db_payload['instruct_command_output'])
-        task_instruct_args_fixup = {}
-        for k, v in task_instruct_args.items():
-            if isinstance(v, str):
-                task_instruct_args_fixup[k] = {'S': v}
-            if isinstance(v, int) and not isinstance(v, bool):
-                task_instruct_args_fixup[k] = {'N': str(v)}
-            if isinstance(v, bool):
-                task_instruct_args_fixup[k] = {'BOOL': v}
-            if isinstance(v, bytes):
-                task_instruct_args_fixup[k] = {'B': v}
+        task_instruct_args_fixup = dynamodb_codec.marshal_map(task_instruct_args)
         if task_instruct_command == 'terminate':
             for portgroup in portgroups:
                 if portgroup != 'None':
-                    portgroup_entry = self.get_portgroup_entry(portgroup)
-                    portgroup_tasks = portgroup_entry['Item']['tasks']['SS']
-                    if self.task_name in portgroup_tasks:
-                        portgroup_tasks.remove(self.task_name)
-                    if not portgroup_tasks:
-                        portgroup_tasks.append('None')
-                    self.update_portgroup_entry(portgroup, portgroup_tasks)
+                    self.remove_portgroup_task(portgroup)
             if task_host_name != 'None':
                 domain_entry = self.get_domain_entry(task_domain_name)
                 hosted_zone = domain_entry['Item']['hosted_zone']['S']
@@ -262,4 +228,11 @@ class Deliver:
                                  task_instruct_args_fixup, task_host_name, task_domain_name, task_attack_ip,
                                  task_local_ip, json_payload)
 
+        if task_instruct_command != 'terminate':
+            # Now that the task is idle, send it the next step of its pipeline or the next instruction in its queue
+            task_item = completed_instruction['Attributes']
+            pipeline = instruction_pipeline.Pipeline(self.campaign_id, self.task_name, self.region)
+            if not pipeline.advance(task_item, payload['instruct_command_output']):
+                pipeline.queue.dispatch_next(task_item)
+
         return True
@@ -0,0 +1,179 @@
+import os
+import random
+import threading
+import aws_clients
+from botocore.exceptions import ClientError
+import time as t
+
+# How long the first change for a hosted zone waits for others to join its ChangeBatch. A Lambda container serves one
+# request at a time, so by default changes are sent at once; callers with changes in flight on several threads pass
+# their own window to change()
+DNS_CHANGE_WINDOW = float(os.environ.get('DNS_CHANGE_WINDOW', 0))
+DNS_CHANGE_MAX_ATTEMPTS = int(os.environ.get('DNS_CHANGE_MAX_ATTEMPTS', 5))
+DNS_INSYNC_TIMEOUT = float(os.environ.get('DNS_INSYNC_TIMEOUT', 60))
+# Longest a change waits for the thread that sends its ChangeBatch before giving up on it
+DNS_CHANGE_WAIT_TIMEOUT = float(os.environ.get('DNS_CHANGE_WAIT_TIMEOUT', 60))
+# Route53 accepts at most 1000 changes in one ChangeBatch
+MAX_BATCH_CHANGES = 1000
+THROTTLING_ERRORS = ['Throttling', 'ThrottlingException', 'PriorRequestNotComplete']
+
+
+class PendingChange:
+
+    def __init__(self, change):
+        """One resource record change waiting to be sent; done is set once its ChangeBatch has been submitted"""
+        self.change = change
+        self.key = (change['ResourceRecordSet']['Name'], change['ResourceRecordSet']['Type'])
+        self.done = threading.Event()
+        self.change_id = None
+        self.status = None
+        self.error = None
+
+
+class ChangeCoalescer:
+
+    def __init__(self, window=DNS_CHANGE_WINDOW):
+        """
+        Collects resource record changes per hosted zone and submits them together. Changes made within window
+        seconds of the first pending one share a ChangeBatch; one coalescer is shared by the whole Lambda container.
+        """
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @property
+    def aws_route53_client(self):
+        return aws_clients.get_client('route53')
+
+    def enqueue(self, hosted_zone, changes):
+        """Adds changes to the zone's pending batch; returns them and whether the caller must flush the batch"""
+        pending_changes = [PendingChange(c) for c in changes]
+        with self.lock:
+            leader = hosted_zone not in self.pending
+            self.pending.setdefault(hosted_zone, []).extend(pending_changes)
+        return pending_changes, leader
+
+    def flush(self, hosted_zone):
+        """
+        Submits the zone's pending changes. Every one of them is done when this returns: an error that is not a
+        rejected ChangeBatch, such as a botocore connection error or timeout, is set on each change not yet submitted.
+        """
+        with self.lock:
+            pending_changes = self.pending.pop(hosted_zone, [])
+        error = RuntimeError(f'change for hosted zone {hosted_zone} was not submitted')
+        try:
+            # Route53 rejects a batch that changes the same record twice, so a repeated record starts a new batch
+            batches = []
+            batch = []
+            keys = set()
+            for pending_change in pending_changes:
+                if pending_change.key in keys or len(batch) == MAX_BATCH_CHANGES:
+                    batches.append(batch)
+                    batch = []
+                    keys = set()
+                batch.append(pending_change)
+                keys.add(pending_change.key)
+            if batch:
+                batches.append(batch)
+            for batch in batches:
+                self.submit(hosted_zone, batch)
+        except Exception as flush_error:
+            error = flush_error
+        finally:
+            for pending_change in pending_changes:
+                if not pending_change.done.is_set():
+                    pending_change.error = error
+                    pending_change.done.set()
+
+    def submit(self, hosted_zone, batch):
+        try:
+            response = self.change_resource_record_sets(hosted_zone, [p.change for p in batch])
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'InvalidChangeBatch' and len(batch) > 1:
+                # One bad change (such as deleting a record that is already gone) fails the whole batch, so the
+                # changes are retried one at a time to keep the others
+                for pending_change in batch:
+                    self.submit(hosted_zone, [pending_change])
+                return
+            for pending_change in batch:
+                pending_change.error = error
+                pending_change.done.set()
+            return
+        print({'dns_change_submitted': {
+            'hosted_zone': hosted_zone, 'change_id': response['ChangeInfo']['Id'], 'changes': len(batch)
+        }})
+        for pending_change in batch:
+            pending_change.change_id = response['ChangeInfo']['Id']
+            pending_change.status = response['ChangeInfo']['Status']
+            pending_change.done.set()
+
+    def change_resource_record_sets(self, hosted_zone, changes):
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return self.aws_route53_client.change_resource_record_sets(
+                    HostedZoneId=hosted_zone,
+                    ChangeBatch={'Changes': changes}
+                )
+            except ClientError as error:
+                if error.response['Error']['Code'] not in THROTTLING_ERRORS or attempts >= DNS_CHANGE_MAX_ATTEMPTS:
+                    raise
+                t.sleep(random.uniform(0, min(5, 0.5 * 2 ** attempts)))
+
+    def change(self, hosted_zone, changes, wait_insync=False, window=None):
+        """
+        Submits changes for hosted_zone, sharing a ChangeBatch with changes made concurrently, and returns
+        [{'change_id', 'status'}] in the order of changes. Raises the error of a change that was not submitted. With
+        wait_insync, returns only once Route53 reports the changes INSYNC or DNS_INSYNC_TIMEOUT runs out. window
+        overrides DNS_CHANGE_WINDOW; callers that already hold a full batch pass window=0 to send it at once.
+        """
+        pending_changes, leader = self.enqueue(hosted_zone, changes)
+        if leader:
+            window = self.window if window is None else window
+            if window:
+                t.sleep(window)
+            self.flush(hosted_zone)
+        for pending_change in pending_changes:
+            if not pending_change.done.wait(DNS_CHANGE_WAIT_TIMEOUT):
+                raise TimeoutError(f'change to {pending_change.key[0]} was not submitted within '
+                                   f'{DNS_CHANGE_WAIT_TIMEOUT} seconds')
+            if pending_change.error:
+                raise pending_change.error
+        statuses = {}
+        if wait_insync:
+            for change_id in {p.change_id for p in pending_changes}:
+                statuses[change_id] = self.wait_for_insync(change_id)
+        return [
+            {'change_id': p.change_id, 'status': statuses.get(p.change_id, p.status)} for p in pending_changes
+        ]
+
+    def wait_for_insync(self, change_id, timeout=DNS_INSYNC_TIMEOUT):
+        """Polls the change until it is INSYNC, backing off up to 10 seconds; returns the last status seen"""
+        deadline = t.monotonic() + timeout
+        delay = 1
+        while True:
+            status = self.aws_route53_client.get_change(Id=change_id)['ChangeInfo']['Status']
+            if status == 'INSYNC' or t.monotonic() + delay > deadline:
+                return status
+            t.sleep(delay)
+            delay = min(delay * 2, 10)
+
+
+def a_record_change(action, name, ip_address):
+    return {
+        'Action': action,
+        'ResourceRecordSet': {
+            'Name': name,
+            'Type': 'A',
+            'TTL': 300,
+            'ResourceRecords': [
+                {
+                    'Value': ip_address
+                }
+            ]
+        }
+    }
+
+
+coalescer = ChangeCoalescer()
@@ -0,0 +1,126 @@
+"""
+Tests for dynamodb_codec.py and the instruct_args check interact builds on it. Every function directory that ships a
+copy of the codec is tested, so the copies cannot drift apart.
+
+Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import json
+import random
+import string
+import unittest
+import importlib.util
+from decimal import Decimal
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+COPIES = ['manage', 'remote_task', 'task_control', 'task_result']
+
+
+def load_codec(function_name):
+    path = os.path.join(ROOT, function_name, 'dynamodb_codec.py')
+    spec = importlib.util.spec_from_file_location(f'{function_name}_dynamodb_codec', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def random_scalar(rng):
+    kind = rng.randrange(8)
+    if kind == 0:
+        return ''.join(rng.choice(string.printable) for _ in range(rng.randrange(12)))
+    if kind == 1:
+        return rng.randrange(-10 ** 12, 10 ** 12)
+    if kind == 2:
+        return rng.uniform(-1e6, 1e6)
+    if kind == 3:
+        return rng.random() < 0.5
+    if kind == 4:
+        return None
+    if kind == 5:
+        return rng.randbytes(rng.randrange(1, 16))
+    if kind == 6:
+        return {rng.choice([rng.randrange(100), rng.randrange(100) + 0.5]) for _ in range(rng.randrange(1, 5))}
+    return {f's{i}' for i in range(rng.randrange(1, 4))}
+
+
+def random_value(rng, depth=0):
+    kind = rng.randrange(6) if depth < 3 else 0
+    if kind == 4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    if kind == 5:
+        return {f'k{i}': random_value(rng, depth + 1) for i in range(rng.randrange(4))}
+    return random_scalar(rng)
+
+
+class CodecTest(unittest.TestCase):
+
+    codecs = {function_name: load_codec(function_name) for function_name in COPIES}
+
+    def test_copies_are_identical(self):
+        sources = set()
+        for function_name in COPIES:
+            with open(os.path.join(ROOT, function_name, 'dynamodb_codec.py')) as f:
+                sources.add(f.read())
+        self.assertEqual(len(sources), 1)
+
+    def test_round_trip(self):
+        rng = random.Random(1)
+        for function_name, codec in self.codecs.items():
+            for case in range(500):
+                args = {f'arg{i}': random_value(rng) for i in range(rng.randrange(1, 8))}
+                with self.subTest(function_name=function_name, case=case):
+                    self.assertEqual(codec.unmarshal_map(codec.marshal_map(args)), args)
+                    self.assertEqual(codec.unmarshal(codec.marshal(args)), args)
+
+    def test_mixed_number_set(self):
+        for function_name, codec in self.codecs.items():
+            with self.subTest(function_name=function_name):
+                attribute = codec.marshal({1, 2.5, Decimal('3.25')})
+                self.assertEqual(sorted(attribute['NS']), ['1', '2.5', '3.25'])
+                self.assertEqual(codec.unmarshal(attribute), {1, 2.5, 3.25})
+
+    def test_rejects_unstorable_values(self):
+        unstorable = [
+            float('nan'), float('inf'), float('-inf'), Decimal('NaN'), Decimal('sNaN'), Decimal('Infinity'),
+            Decimal('-Infinity'), {1, float('nan')}, {Decimal('Infinity')}, {'a': [float('inf')]}, set(), {1, 'a'},
+            {True, False}, {None}, object()
+        ]
+        for function_name, codec in self.codecs.items():
+            for value in unstorable:
+                with self.subTest(function_name=function_name, value=value):
+                    with self.assertRaises((TypeError, ValueError)):
+                        codec.marshal(value)
+
+    def test_to_json(self):
+        for function_name, codec in self.codecs.items():
+            with self.subTest(function_name=function_name):
+                value = codec.unmarshal(codec.marshal({'hosts': {'b', 'a'}, 'key': b'\x00\x01', 'ports': {443, 80}}))
+                self.assertEqual(json.loads(json.dumps(codec.to_json(value))),
+                                 {'hosts': ['a', 'b'], 'key': 'AAE=', 'ports': [80, 443]})
+
+
+class InstructArgsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sys.path.insert(0, os.path.join(ROOT, 'task_control'))
+        try:
+            cls.interact = importlib.import_module('interact')
+        finally:
+            sys.path.pop(0)
+
+    def test_non_finite_numbers_are_rejected_like_other_unstorable_args(self):
+        # json.loads turns NaN, Infinity and out of range numbers such as 1e400 into non-finite floats
+        for body in ['{"n": NaN}', '{"n": Infinity}', '{"n": [-1e400]}', '{"n": {"m": 1e400}}']:
+            with self.subTest(body=body):
+                message = self.interact.invalid_instruct_args(json.loads(body))
+                self.assertTrue(message.startswith('instruct_args cannot be stored: '))
+
+    def test_storable_args_are_accepted(self):
+        self.assertIsNone(self.interact.invalid_instruct_args({'ports': [80, 443.5], 'target': 'x', 'n': None}))
+        self.assertEqual(self.interact.invalid_instruct_args(['x']), 'instruct_args must be a map')
+
+
+if __name__ == '__main__':
+    unittest.main()
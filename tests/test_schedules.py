@@ -0,0 +1,172 @@
+"""
+Tests for the scheduler in task_control/schedules.py: recurrence, missed runs, busy policies and schedules whose
+instruction fails to send. The campaign's tables come from the in-memory AWS stand-in in benchmarks/local_aws.py and
+the scheduler's clock is replaced, so no test waits.
+
+Usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, os.path.join(ROOT, 'task_control'))
+import aws_clients
+import dynamodb_codec
+import local_aws
+import schedules
+sys.path.remove(os.path.join(ROOT, 'task_control'))
+sys.path.remove(os.path.join(ROOT, 'benchmarks'))
+
+CAMPAIGN_ID = 'test'
+REGION = 'us-east-1'
+START = 1_800_000_000
+INTERVAL = 300
+
+
+class Clock:
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class RecordingScheduler(schedules.Scheduler):
+
+    def __init__(self, *args, failing=(), **kwargs):
+        """Records the schedules it fires instead of sending interact requests; schedules in failing raise"""
+        super().__init__(*args, **kwargs)
+        self.failing = failing
+        self.fired = []
+
+    def fire(self, schedule):
+        if schedule['schedule_id'] in self.failing:
+            raise RuntimeError('instruction could not be sent')
+        self.fired.append(schedule['schedule_id'])
+        return 200, {'outcome': 'success'}
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = local_aws.LocalAWS(REGION)
+        self.backend.create_campaign(CAMPAIGN_ID)
+        self.backend.install(aws_clients)
+        self.dynamodb = self.backend.dynamodb
+        self.clock = Clock(START)
+        self.saved_clock = schedules.t
+        schedules.t = self.clock
+        self.set_task_status('task1', 'idle')
+
+    def tearDown(self):
+        schedules.t = self.saved_clock
+
+    def set_task_status(self, task_name, task_status):
+        self.dynamodb.put_item(TableName=f'{CAMPAIGN_ID}-tasks', Item={
+            'task_name': {'S': task_name}, 'task_status': {'S': task_status}
+        })
+
+    def add_schedule(self, schedule_id, interval=INTERVAL, busy_policy='queue', task_name='task1'):
+        schedule = {
+            'schedule_id': schedule_id, 'task_name': task_name, 'instruct_command': 'echo',
+            'instruct_instance': 'havoc', 'instruct_args': {'no_args': 'True'}, 'end_time': 'None',
+            'instruct_user_id': 'user1', 'busy_policy': busy_policy, 'interval': interval, 'start_time': START,
+            'next_run': START, 'fire_count': 0
+        }
+        self.dynamodb.put_item(TableName=f'{CAMPAIGN_ID}-schedules', Item=dynamodb_codec.marshal_map(schedule))
+
+    def get_schedule(self, schedule_id):
+        response = self.dynamodb.get_item(TableName=f'{CAMPAIGN_ID}-schedules', Key={'schedule_id': {'S': schedule_id}})
+        if 'Item' not in response:
+            return None
+        return dynamodb_codec.unmarshal_map(response['Item'])
+
+    def run_scheduler(self, failing=()):
+        scheduler = RecordingScheduler(CAMPAIGN_ID, REGION, None, failing=failing)
+        return scheduler, scheduler.run()
+
+    def test_recurring_schedule_fires_once_per_occurrence(self):
+        self.add_schedule('s1')
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, ['s1'])
+        self.assertEqual(self.get_schedule('s1')['next_run'], START + INTERVAL)
+
+        # A run at the same time, such as an overlapping invocation, finds nothing due
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, [])
+
+        self.clock.now = START + INTERVAL
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, ['s1'])
+        self.assertEqual(self.get_schedule('s1')['next_run'], START + 2 * INTERVAL)
+        self.assertEqual(self.get_schedule('s1')['fire_count'], 2)
+
+    def test_missed_runs_fire_once_and_keep_the_schedule_aligned(self):
+        self.add_schedule('s1')
+        self.clock.now = START + 3 * INTERVAL + 10
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, ['s1'])
+        self.assertEqual(self.get_schedule('s1')['next_run'], START + 4 * INTERVAL)
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, [])
+
+    def test_one_off_schedule_is_removed_once_fired(self):
+        self.add_schedule('s1', interval=0)
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, ['s1'])
+        self.assertIsNone(self.get_schedule('s1'))
+
+    def test_busy_task_skips_or_defers(self):
+        self.set_task_status('task1', 'busy')
+        self.add_schedule('skip', busy_policy='skip')
+        self.add_schedule('defer', busy_policy='defer')
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(scheduler.fired, [])
+        self.assertEqual(summary['schedules']['skip']['outcome'], 'skipped')
+        self.assertEqual(self.get_schedule('skip')['next_run'], START + INTERVAL)
+        self.assertEqual(summary['schedules']['defer']['outcome'], 'deferred')
+        self.assertEqual(self.get_schedule('defer')['next_run'], START + schedules.SCHEDULE_DEFER_SECONDS)
+
+    def test_schedule_of_a_finished_task_is_removed(self):
+        self.set_task_status('task1', 'finished')
+        self.add_schedule('s1')
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(summary['schedules']['s1']['outcome'], 'task_gone')
+        self.assertIsNone(self.get_schedule('s1'))
+
+    def test_failed_fire_is_retried_and_does_not_stop_the_run(self):
+        self.add_schedule('a')
+        self.add_schedule('b')
+        self.add_schedule('c', interval=0)
+        scheduler, summary = self.run_scheduler(failing=('a', 'c'))
+        self.assertEqual(scheduler.fired, ['b'])
+        retry_run = START + schedules.SCHEDULE_DEFER_SECONDS
+        for schedule_id in ['a', 'c']:
+            self.assertEqual(summary['schedules'][schedule_id]['outcome'], 'failed')
+            self.assertEqual(summary['schedules'][schedule_id]['retry_run'], retry_run)
+            self.assertEqual(self.get_schedule(schedule_id)['next_run'], retry_run)
+        self.assertEqual(self.get_schedule('a')['fire_count'], 0)
+
+        self.clock.now = retry_run
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(sorted(scheduler.fired), ['a', 'c'])
+        self.assertEqual(self.get_schedule('a')['next_run'], START + INTERVAL)
+        self.assertIsNone(self.get_schedule('c'))
+
+    def test_error_before_the_claim_does_not_stop_the_run(self):
+        self.add_schedule('a')
+        self.add_schedule('b')
+        self.backend.fail_next('dynamodb', 'GetItem', 'InternalServerError')
+        scheduler, summary = self.run_scheduler()
+        self.assertEqual(len(scheduler.fired), 1)
+        failed = [s for s, o in summary['schedules'].items() if o['outcome'] == 'failed']
+        self.assertEqual(len(failed), 1)
+        # Nothing was claimed, so the schedule is still due
+        self.assertEqual(self.get_schedule(failed[0])['next_run'], START)
+
+
+if __name__ == '__main__':
+    unittest.main()